@@ -0,0 +1,65 @@
+import tensorflow as tf
+
+
+class GradientAccumulationOptimizer(tf.compat.v1.train.Optimizer):
+  """Applies the mean gradient of `steps` batches with `optimizer`, for effective batches that do not fit in memory.
+
+  Every batch adds its gradients to accumulators and counts as a global step, and `optimizer` applies and clears them
+  on every `steps`-th one. The accumulators are synced on read: each replica adds up its own gradients, which only go
+  through the all-reduce of `optimizer` when they are applied, so workers also talk once every `steps` batches. As in
+  the mixed precision loss scale optimizer, the apply is conditioned in cross replica context.
+  """
+
+  def __init__(self, optimizer: tf.compat.v1.train.Optimizer, steps: int, name: str = 'GradientAccumulation'):
+    super(GradientAccumulationOptimizer, self).__init__(use_locking=False, name=name)
+    self._optimizer = optimizer
+    self._steps = steps
+
+  def compute_gradients(self, loss, var_list=None, **kwargs):
+    return self._optimizer.compute_gradients(loss, var_list=var_list, **kwargs)
+
+  def _accumulators(self, distribution, var_list):
+    # created in cross replica context, like the slots of an optimizer, so they are named after the variables
+    with tf.compat.v1.variable_scope(tf.compat.v1.get_variable_scope(), reuse=tf.compat.v1.AUTO_REUSE):
+      return [self._accumulator(var) for var in var_list]
+
+  def _accumulator(self, var: tf.Variable) -> tf.Variable:
+    return tf.compat.v1.get_variable(f'{var.op.name}/{self._name}', shape=var.shape, dtype=var.dtype.base_dtype,
+                                     initializer=tf.zeros_initializer(), trainable=False,
+                                     collections=[tf.compat.v1.GraphKeys.LOCAL_VARIABLES],
+                                     synchronization=tf.VariableSynchronization.ON_READ,
+                                     aggregation=tf.VariableAggregation.SUM)
+
+  def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+    if tf.distribute.in_cross_replica_context():
+      raise ValueError('apply_gradients() must be called in a replica context.')
+    if global_step is None:
+      raise ValueError('the batches are counted by global_step, it is required.')
+    grads_and_vars = [(grad, var) for grad, var in grads_and_vars if grad is not None]
+    var_list = [var for _, var in grads_and_vars]
+    replica_context = tf.distribute.get_replica_context()
+    accumulators = replica_context.merge_call(self._accumulators, args=(var_list,))
+    accumulated = [accumulator.assign_add(grad / self._steps)
+                   for accumulator, (grad, _) in zip(accumulators, grads_and_vars)]
+    return replica_context.merge_call(self._distributed_apply,
+                                      args=(accumulated, accumulators, var_list, global_step, name or self._name))
+
+  def _distributed_apply(self, distribution, accumulated, accumulators, var_list, global_step, name):
+    # one name object for all replicas, merge_call only collapses the arguments that are the same object
+    apply_name = f'{name}-apply'
+
+    def apply(gradients):
+      apply_op = self._optimizer.apply_gradients(list(zip(gradients, var_list)), name=apply_name)
+      with tf.control_dependencies([apply_op]):
+        return tf.group([accumulator.assign(tf.zeros_like(accumulator)) for accumulator in accumulators])
+
+    def apply_fn():
+      return distribution.group(distribution.extended.call_for_each_replica(apply, args=(accumulated,)))
+
+    # reading the step orders the condition before the increment below
+    should_apply = tf.equal((global_step.read_value() + 1) % self._steps, 0)
+    with tf.control_dependencies([distribution.group(accumulated)]):
+      maybe_apply = tf.cond(should_apply, apply_fn, tf.no_op)
+    with tf.control_dependencies([maybe_apply]):
+      return distribution.extended.update(global_step, lambda step: step.assign_add(1, read_value=False),
+                                          group=True)
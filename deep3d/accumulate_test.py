@@ -0,0 +1,62 @@
+import tensorflow as tf
+
+from deep3d.accumulate import GradientAccumulationOptimizer
+
+
+def split_cpu():
+    # two logical cpus for MirroredStrategy, only possible before the runtime is initialized
+    cpu = tf.config.list_physical_devices('CPU')[0]
+    try:
+        tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()] * 2)
+    except RuntimeError:
+        pass
+    return len(tf.config.list_logical_devices('CPU')) >= 2
+
+
+TWO_CPUS = split_cpu()
+
+
+class GradientAccumulationTest(tf.test.TestCase):
+    def _train(self, strategy: tf.distribute.Strategy, values):
+        with tf.Graph().as_default():
+            with strategy.scope():
+                x = tf.compat.v1.get_variable('x', initializer=tf.constant([1.0, 2.0]))
+                global_step = tf.compat.v1.train.get_or_create_global_step()
+                value = tf.compat.v1.placeholder(tf.float32, shape=())
+
+                def step():
+                    # each replica sees its own batch, value + its replica id
+                    replica_id = tf.distribute.get_replica_context().replica_id_in_sync_group
+                    loss = tf.reduce_sum(x * (value + tf.cast(replica_id, tf.float32)))
+                    optimizer = GradientAccumulationOptimizer(tf.compat.v1.train.GradientDescentOptimizer(1.0), 2)
+                    return optimizer.minimize(loss, global_step=global_step)
+
+                train_op = strategy.group(strategy.extended.call_for_each_replica(step))
+            with tf.compat.v1.Session() as sess:
+                sess.run([tf.compat.v1.global_variables_initializer(), tf.compat.v1.local_variables_initializer()])
+                results = []
+                for each in values:
+                    sess.run(train_op, {value: each})
+                    results.append(sess.run([x, global_step]))
+                return results
+
+    def test_accumulate(self):
+        results = self._train(tf.distribute.get_strategy(), [1.0, 3.0, 5.0, 7.0])
+        # the mean gradient of two batches is applied every second step, every step counts
+        self.assertAllClose(results[0][0], [1.0, 2.0])
+        self.assertAllClose(results[1][0], [-1.0, 0.0])
+        self.assertAllClose(results[2][0], [-1.0, 0.0])
+        self.assertAllClose(results[3][0], [-7.0, -6.0])
+        self.assertEqual([step for _, step in results], [1, 2, 3, 4])
+
+    def test_accumulate_mirrored(self):
+        if not TWO_CPUS:
+            self.skipTest('the cpu was configured before two logical cpus could be made')
+        results = self._train(tf.distribute.MirroredStrategy(['/cpu:0', '/cpu:1']), [1.0, 3.0])
+        self.assertAllClose(results[0][0], [1.0, 2.0])
+        # replicas accumulate (1 + 3) / 2 and (2 + 4) / 2, which the optimizer sums when it applies them
+        self.assertAllClose(results[1][0], [-4.0, -3.0])
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,92 @@
+import numpy as np
+from typing import Tuple
+
+from deep3d.data import OriginType
+
+LAYOUTS = ['sbs', 'tb', 'anaglyph']
+
+
+class FrameAssembler(object):
+  """Writes the left and right views of a movie into preallocated uint8 output frames.
+
+  `layout` is 'sbs' for side by side, 'tb' for top and bottom, or 'anaglyph' with the left view in blue and green and
+  the right view in red; it defaults to sbs for color and anaglyph for gray. For sbs and tb each view is cropped or
+  letterboxed to 1200x1080 proportions first. The layout only depends on the view shape, so it is worked out once and
+  every frame is written into views of the same buffer: a float view in 0-1 is scaled into uint8 in the same pass, and
+  the letterbox bars are never written after the buffer is zeroed. Returned frames are views of that buffer, valid
+  until the next call.
+  """
+
+  def __init__(self, view_shape: Tuple[int, ...], origin_type: OriginType = OriginType.COLOR, layout: str = None):
+    self.layout = layout or ('sbs' if origin_type == OriginType.COLOR else 'anaglyph')
+    if self.layout not in LAYOUTS:
+      raise ValueError(f'unknown layout {self.layout}, expected one of {LAYOUTS}')
+    height, width = view_shape[0], view_shape[1]
+    self._channels = view_shape[2] if len(view_shape) > 2 else 1
+    self._frames = None
+
+    if self.layout == 'anaglyph':
+      self._source = (slice(None), slice(None))
+      self._target = (slice(None), slice(None))
+      self.frame_shape = (height, width, 3)
+      return
+    ratio = min(width / 1200, height / 1080)
+    if width / 1200 > height / 1080:
+      # too wide, the center columns are kept
+      real_width = int(width * ratio)
+      start = int((width - real_width) / 2)
+      self._source = (slice(None), slice(start, start + real_width))
+      self._target = (slice(None), slice(None))
+      eye = (height, real_width)
+    else:
+      # too tall, letterboxed with black bars above and below
+      real_height = int(height / ratio)
+      start = int((real_height - height) / 2)
+      self._source = (slice(None), slice(None))
+      self._target = (slice(start, start + height), slice(None))
+      eye = (real_height, width)
+    if self.layout == 'sbs':
+      self.frame_shape = (eye[0], 2 * eye[1], 3)
+      self._offset = (0, eye[1])
+    else:
+      self.frame_shape = (2 * eye[0], eye[1], 3)
+      self._offset = (eye[0], 0)
+    self._eye = eye
+
+  def _buffer(self, batch_size: int) -> np.ndarray:
+    if self._frames is None or len(self._frames) < batch_size:
+      self._frames = np.zeros((batch_size,) + self.frame_shape, dtype=np.uint8)
+    return self._frames[:batch_size]
+
+  @staticmethod
+  def _write(source: np.ndarray, target: np.ndarray):
+    # as (source * 255).astype(np.uint8) for 0-1 floats, without the temporaries
+    if source.dtype == np.uint8:
+      np.copyto(target, source)
+    else:
+      np.multiply(source, 255, out=target, casting='unsafe')
+
+  def batch(self, origins: np.ndarray, origin_preds: np.ndarray) -> np.ndarray:
+    """The [batch, height, width, 3] uint8 frames of [batch, h, w, c] left and right views."""
+    frames = self._buffer(len(origins))
+    rows, cols = self._source
+    origins, origin_preds = origins[:, rows, cols], origin_preds[:, rows, cols]
+    if self.layout == 'anaglyph':
+      # BGR: the left view in blue (and green for color), the right view in red
+      if self._channels == 1:
+        self._write(origins, frames[..., 0:1])
+        self._write(origin_preds, frames[..., 2:3])
+      else:
+        self._write(origins[..., 0:2], frames[..., 0:2])
+        self._write(origin_preds[..., 2:3], frames[..., 2:3])
+      return frames
+
+    target_rows, target_cols = self._target
+    for views, (row, col) in [(origins, (0, 0)), (origin_preds, self._offset)]:
+      eye = frames[:, row:row + self._eye[0], col:col + self._eye[1]][:, target_rows, target_cols]
+      # a gray view is repeated over the three channels
+      self._write(views, eye)
+    return frames
+
+  def __call__(self, origin: np.ndarray, origin_pred: np.ndarray) -> np.ndarray:
+    return self.batch(origin[np.newaxis], origin_pred[np.newaxis])[0]
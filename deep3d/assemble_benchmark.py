@@ -0,0 +1,58 @@
+import time
+import numpy as np
+import tensorflow as tf
+from absl import flags
+
+from deep3d.assemble import FrameAssembler
+from deep3d.data import OriginType
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('batch_size', 64, 'frames predicted together')
+flags.DEFINE_integer('num_batches', 4, 'batches assembled per benchmark')
+
+
+def _compose_frame(origin: np.ndarray, origin_pred: np.ndarray) -> np.ndarray:
+  # the per frame composition FrameAssembler replaces, for a letterboxed color view
+  height, width = origin.shape[0], origin.shape[1]
+  real_height = int(height / min(width / 1200, height / 1080))
+  start = int((real_height - height) / 2)
+  new_origin = np.zeros(shape=(real_height, width, 3))
+  new_origin_pred = np.zeros(shape=(real_height, width, 3))
+  new_origin[start:start + height] = origin
+  new_origin_pred[start:start + height] = origin_pred
+  img = np.concatenate([new_origin, new_origin_pred], axis=1)
+  return (img * 255).astype(np.uint8)
+
+
+class FrameAssemblerBenchmark(tf.test.Benchmark):
+
+  def _views(self):
+    # the eyes of a 1080p side-by-side movie, as predict returns them
+    rng = np.random.RandomState(0)
+    return (rng.uniform(size=(FLAGS.batch_size, 1080, 960, 3)).astype(np.float32),
+            rng.uniform(size=(FLAGS.batch_size, 1080, 960, 3)).astype(np.float32))
+
+  def _report(self, name: str, wall_time: float):
+    num_frames = FLAGS.batch_size * FLAGS.num_batches
+    self.report_benchmark(iters=num_frames, wall_time=wall_time / num_frames, name=name,
+                          extras={'frames_per_second': num_frames / wall_time})
+
+  def benchmark_compose_frame(self):
+    origins, origin_preds = self._views()
+    start = time.time()
+    for _ in range(FLAGS.num_batches):
+      for origin, origin_pred in zip(origins, origin_preds):
+        _compose_frame(origin, origin_pred)
+    self._report('compose_frame', time.time() - start)
+
+  def benchmark_frame_assembler(self):
+    origins, origin_preds = self._views()
+    assembler = FrameAssembler(origins.shape[1:], OriginType.COLOR)
+    start = time.time()
+    for _ in range(FLAGS.num_batches):
+      assembler.batch(origins, origin_preds)
+    self._report('frame_assembler', time.time() - start)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,72 @@
+import numpy as np
+import tensorflow as tf
+
+from deep3d.assemble import FrameAssembler
+from deep3d.data import OriginType
+
+
+def compose_frame_reference(origin: np.ndarray, origin_pred: np.ndarray, origin_type: OriginType) -> np.ndarray:
+    # the per frame composition model.main used to do
+    if origin_type == OriginType.COLOR:
+        height, width = origin.shape[0], origin.shape[1]
+        ratio = min(width / 1200, height / 1080)
+        if width / 1200 > height / 1080:
+            real_width = int(width * ratio)
+            start = int((width - real_width) / 2)
+            new_origin = origin[:, start:start + real_width, :]
+            new_origin_pred = origin_pred[:, start:start + real_width, :]
+        else:
+            real_height = int(height / ratio)
+            start = int((real_height - height) / 2)
+            new_origin = np.zeros(shape=(real_height, width, 3), dtype=origin.dtype)
+            new_origin_pred = np.zeros(shape=(real_height, width, 3), dtype=origin_pred.dtype)
+            new_origin[start:start + height] = origin
+            new_origin_pred[start:start + height] = origin_pred
+        img = np.concatenate([new_origin, new_origin_pred], axis=1)
+    else:
+        img = np.squeeze(np.stack([origin, np.zeros_like(origin), origin_pred], axis=-1), axis=2)
+    return (img * 255).astype(np.uint8)
+
+
+class FrameAssemblerTest(tf.test.TestCase):
+    def test_reference(self):
+        rng = np.random.RandomState(0)
+        for shape, origin_type in [((1080, 960, 3), OriginType.COLOR), ((360, 960, 3), OriginType.COLOR),
+                                   ((360, 320, 1), OriginType.GRAY)]:
+            assembler = FrameAssembler(shape, origin_type)
+            origins = rng.uniform(size=(3,) + shape).astype(np.float32)
+            origin_preds = rng.uniform(size=(3,) + shape).astype(np.float32)
+            frames = assembler.batch(origins, origin_preds)
+            self.assertEqual(frames.shape[1:], assembler.frame_shape)
+            for frame, origin, origin_pred in zip(frames, origins, origin_preds):
+                self.assertAllEqual(frame, compose_frame_reference(origin, origin_pred, origin_type))
+
+    def test_layouts(self):
+        origin = np.full((108, 120, 3), 10, dtype=np.uint8)
+        origin_pred = np.full((108, 120, 3), 20, dtype=np.uint8)
+
+        # letterboxed to 120x1080 eyes, one above the other
+        frame = FrameAssembler(origin.shape, layout='tb')(origin, origin_pred)
+        self.assertEqual(frame.shape, (2160, 120, 3))
+        self.assertAllEqual(frame[486:594], origin)
+        self.assertAllEqual(frame[1566:1674], origin_pred)
+        self.assertAllEqual(frame[594:1566], np.zeros((972, 120, 3)))
+
+        frame = FrameAssembler(origin.shape, layout='anaglyph')(origin, origin_pred)
+        self.assertAllEqual(frame[..., 0:2], origin[..., 0:2])
+        self.assertAllEqual(frame[..., 2], origin_pred[..., 2])
+
+        # a smaller batch reuses the buffer of a larger one, the bars stay black
+        assembler = FrameAssembler((108, 60, 1), OriginType.GRAY, layout='sbs')
+        assembler.batch(np.full((4, 108, 60, 1), 255, np.uint8), np.full((4, 108, 60, 1), 255, np.uint8))
+        frames = assembler.batch(origin[np.newaxis, :, :60, :1], origin_pred[np.newaxis, :, :60, :1])
+        self.assertEqual(frames.shape, (1, 2160, 120, 3))
+        self.assertAllEqual(frames[0, 1026:1134, :60], np.full((108, 60, 3), 10))
+        self.assertAllEqual(frames[0, :1026], np.zeros((1026, 120, 3)))
+
+        with self.assertRaises(ValueError):
+            FrameAssembler(origin.shape, layout='interlaced')
+
+
+if __name__ == '__main__':
+    tf.test.main()
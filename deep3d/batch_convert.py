@@ -0,0 +1,291 @@
+import os
+import csv
+import json
+import queue
+import threading
+import contextlib
+import subprocess
+import collections
+import numpy as np
+from absl import logging
+from collections import namedtuple
+from typing import Callable, Dict, List, Tuple
+
+from deep3d.assemble import FrameAssembler
+from deep3d.convert import _DONE, _get, _put
+from deep3d.data import FrameGenerator, VideoType, OriginType, Shape, frame_size
+from deep3d.instrument import instruments
+from deep3d.quantize import trunk_predict
+from deep3d.tiling import TiledComposer, tiled_predict
+from deep3d.utils import ffmpeg_binary, save
+
+Job = namedtuple('Job', 'input output video_type')
+_END = object()
+
+
+def parse_manifest(file_name: str, default_video_type: VideoType = VideoType.LR3D) -> List[Job]:
+  """The jobs of a csv manifest, whose lines are input,output[,video_type], skipping blank lines and # comments."""
+  jobs = []
+  with open(file_name, newline='') as f:
+    for row in csv.reader(f):
+      row = [field.strip() for field in row]
+      if not row or not row[0] or row[0].startswith('#'):
+        continue
+      if len(row) not in (2, 3):
+        raise ValueError(f'a manifest line is input,output[,video_type], not {",".join(row)}')
+      video_type = VideoType[row[2].upper()] if len(row) == 3 else default_video_type
+      jobs.append(Job(row[0], row[1], video_type))
+  return jobs
+
+
+class MovieProgress(object):
+  """The segments of a movie written so far, in {output}.progress.json, and the file names of the segments."""
+
+  def __init__(self, output: str):
+    self.output = output
+    self.file_name = f'{output}.progress.json'
+    self.segments, self.done = 0, False
+    if os.path.exists(self.file_name):
+      with open(self.file_name) as f:
+        progress = json.load(f)
+      self.segments, self.done = progress['segments'], progress['done']
+
+  def segment(self, index: int) -> str:
+    root, ext = os.path.splitext(self.output)
+    return f'{root}.part-{index:05d}{ext}'
+
+  def save(self, segments: int, done: bool = False):
+    # written aside and renamed, a crash leaves either progress file whole
+    temp = f'{self.file_name}.tmp'
+    with open(temp, 'w') as f:
+      json.dump({'segments': segments, 'done': done}, f)
+    os.replace(temp, self.file_name)
+    self.segments, self.done = segments, done
+
+
+def join_segments(segments: List[str], output: str, audio: str = None):
+  """Concatenates the video segments into `output` without encoding them again, with the audio of `audio` if any."""
+  if len(segments) == 1 and not audio:
+    os.replace(segments[0], output)
+    return
+  concat = f'{output}.concat.txt'
+  with open(concat, 'w') as f:
+    f.writelines(f"file '{os.path.abspath(segment)}'\n" for segment in segments)
+  command = [ffmpeg_binary(), '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', concat]
+  if audio:
+    # the trailing ? keeps a movie without audio working
+    command += ['-i', audio, '-map', '0:v:0', '-map', '1:a:0?', '-c:a', 'copy', '-shortest']
+  try:
+    process = subprocess.run(command + ['-c:v', 'copy', output], stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+      raise RuntimeError(f'joining the segments of {output} failed: {process.stderr.strip()}')
+  finally:
+    os.remove(concat)
+  for segment in segments:
+    os.remove(segment)
+
+
+class MovieWriter(object):
+  """Writes the converted frames of a movie in segments of `segment_frames` frames, recording each finished one.
+
+  The writer starts at the first segment `progress` does not have, the frames of the movie are expected from there.
+  `error` is set once decoding or encoding the movie failed, its remaining frames are dropped then.
+  """
+
+  def __init__(self, job: Job, progress: MovieProgress, segment_frames: int, fourcc: int, fps: float,
+               origin_type: OriginType = OriginType.COLOR, layout: str = None):
+    self.job = job
+    self._progress = progress
+    self._segment_frames = segment_frames
+    self._fourcc, self._fps = fourcc, fps
+    self._origin_type, self._layout = origin_type, layout
+    self._assembler, self._segment, self._writer, self._frames = None, None, None, 0
+    self.error = None
+
+  def write(self, origin: np.ndarray, origin_pred: np.ndarray):
+    if self._assembler is None:
+      self._assembler = FrameAssembler(origin.shape, self._origin_type, self._layout)
+    if self._segment is None:
+      size = (self._assembler.frame_shape[1], self._assembler.frame_shape[0])
+      self._segment = contextlib.ExitStack()
+      self._writer = self._segment.enter_context(save(self._progress.segment(self._progress.segments),
+                                                      self._fourcc, self._fps, size, True))
+    self._writer.write(self._assembler(origin, origin_pred))
+    self._frames += 1
+    if self._frames == self._segment_frames:
+      self._close_segment()
+
+  def _close_segment(self):
+    self._segment.close()
+    self._segment, self._frames = None, 0
+    self._progress.save(self._progress.segments + 1)
+
+  def abort(self):
+    # the segment being written is dropped, a rerun resumes from the last recorded one
+    if self._segment is not None:
+      self._segment.close()
+      self._segment, self._frames = None, 0
+      # the writer may have failed before it created the file
+      with contextlib.suppress(FileNotFoundError):
+        os.remove(self._progress.segment(self._progress.segments))
+
+  def finish(self, audio: bool = True):
+    if self._segment is not None:
+      self._close_segment()
+    segments = [self._progress.segment(index) for index in range(self._progress.segments)]
+    if not segments:
+      raise ValueError(f'{self.job.input} has no frames')
+    join_segments(segments, self.job.output, self.job.input if audio else None)
+    self._progress.save(self._progress.segments, done=True)
+    logging.info(f'converted {self.job.input} to {self.job.output}')
+
+
+def batch_convert(jobs: List[Job], trunk: Callable[[np.ndarray], np.ndarray], composer: TiledComposer,
+                  view: Shape, batch_size: int = 64, origin_type: OriginType = OriginType.COLOR,
+                  segment_frames: int = 1000, concurrent_movies: int = 2, queue_size: int = 64,
+                  layout: str = None, audio: bool = True) -> Tuple[Dict, Dict[Job, Exception]]:
+  """Converts the movies of `jobs` with one `trunk`, whose weights are loaded once for all of them.
+
+  `concurrent_movies` threads decode a movie each into one queue, so the inference batches take frames of several
+  movies and stay full across the end of a movie. `trunk` returns the kernel logits of a batch of features, which
+  `composer` applies to each full resolution origin, as in deep3d.tiling, and the encode thread writes every frame to
+  the MovieWriter of its movie. Movies the progress files mark as done are skipped and the others resume from their
+  first unwritten segment. A movie that fails to decode or encode is left for a rerun to resume and the others go on,
+  an error of the trunk stops them all. Returns the stages and the error of each job that failed.
+  """
+  stages = {name: instruments.new_stage(name) for name in ['decode', 'inference', 'encode']}
+  pending = queue.Queue()
+  for job in jobs:
+    pending.put(job)
+  decoded, composed = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=2 * batch_size)
+  stop, errors, failures = threading.Event(), [], {}
+
+  def fail(job: Job, error: Exception):
+    logging.error(f'converting {job.input} failed: {error}')
+    failures[job] = error
+
+  def decode():
+    stage = stages['decode']
+    try:
+      while not stop.is_set():
+        try:
+          job = pending.get_nowait()
+        except queue.Empty:
+          break
+        progress = MovieProgress(job.output)
+        if progress.done:
+          logging.info(f'{job.output} is done, skipping it')
+          continue
+        movie = None
+        try:
+          reader = FrameGenerator(job.input, video_type=job.video_type, origin_type=origin_type,
+                                  resize=frame_size(view, job.video_type))
+          with reader:
+            if progress.segments:
+              logging.info(f'resuming {job.input} from segment {progress.segments}')
+              reader.seek(progress.segments * segment_frames)
+            movie = MovieWriter(job, progress, segment_frames, reader.fourcc, reader.fps, origin_type, layout)
+            frames = iter(reader)
+            # the encode thread sets error when writing the movie fails
+            while movie.error is None:
+              with stage.work():
+                frame = next(frames, _DONE)
+              if frame is _DONE:
+                break
+              stage.frames += 1
+              with stage.wait():
+                if not _put(decoded, (movie, frame), stop):
+                  return
+              instruments.sample_queue('decoded', decoded.qsize())
+        except Exception as e:
+          if movie is None:
+            fail(job, e)
+            continue
+          # frames of the movie may be on their way still, the encode thread records it at its end
+          movie.error = e
+        _put(decoded, (movie, _END), stop)
+    except Exception as e:
+      errors.append(e)
+      stop.set()
+    finally:
+      _put(decoded, _DONE, stop)
+
+  def encode():
+    stage = stages['encode']
+    try:
+      while True:
+        with stage.wait():
+          item = _get(composed, stop)
+        if item is _DONE:
+          break
+        movie, origin, origin_pred = item
+        with stage.work():
+          try:
+            if movie.error is None and origin is _END:
+              movie.finish(audio)
+            elif movie.error is None:
+              movie.write(origin, origin_pred)
+              stage.frames += 1
+          except Exception as e:
+            movie.error = e
+          if origin is _END and movie.error is not None:
+            movie.abort()
+            fail(movie.job, movie.error)
+    except Exception as e:
+      errors.append(e)
+      stop.set()
+
+  # the movie of every frame on its way through inference, and the ends of the movies in between
+  owners = collections.deque()
+
+  def frames():
+    running = concurrent_movies
+    while running:
+      item = _get(decoded, stop)
+      if item is _DONE:
+        running -= 1
+        continue
+      movie, frame = item
+      owners.append((movie, frame is _END))
+      if frame is not _END:
+        yield frame
+
+  def ends():
+    # the movies whose last frame went on to the encode thread
+    while owners and owners[0][1]:
+      yield owners.popleft()[0]
+
+  decoders = [threading.Thread(target=decode, name=f'decode-{index}', daemon=True)
+              for index in range(concurrent_movies)]
+  encoder = threading.Thread(target=encode, name='encode', daemon=True)
+  for thread in decoders + [encoder]:
+    thread.start()
+
+  stage = stages['inference']
+  try:
+    predictions = tiled_predict(trunk_predict(trunk, batch_size), composer, lambda frame: frame['origin'])(frames)
+    while not stop.is_set():
+      with stage.work():
+        prediction = next(predictions, _DONE)
+      if prediction is _DONE:
+        break
+      stage.frames += 1
+      with stage.wait():
+        for movie in ends():
+          _put(composed, (movie, _END, None), stop)
+        movie, _ = owners.popleft()
+        _put(composed, (movie, prediction['origin'][0], prediction['origin_pred'][0]), stop)
+    for movie in ends():
+      _put(composed, (movie, _END, None), stop)
+  finally:
+    _put(composed, _DONE, stop)
+    encoder.join()
+    stop.set()
+    for thread in decoders:
+      thread.join()
+
+  if errors:
+    raise errors[0]
+  logging.info(str(instruments))
+  return stages, failures
+
@@ -0,0 +1,117 @@
+import os
+import cv2
+import json
+import numpy as np
+import tensorflow as tf
+
+from deep3d.batch_convert import Job, MovieProgress, MovieWriter, batch_convert, parse_manifest
+from deep3d.data import Shape, VideoType
+from deep3d.synthetic import UniformTrunk, read_frames, stereo_video
+from deep3d.tiling import TiledComposer
+
+
+class BatchConvertTest(tf.test.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.movies = {'a': (VideoType.LR3D, 13), 'b': (VideoType.UD3D, 9)}
+        self.jobs = []
+        for name, (video_type, num_frames) in self.movies.items():
+            file_name = os.path.join(self.get_temp_dir(), f'{name}.mp4')
+            # the second movie is smaller than the view, its frames are resized to it
+            stereo_video(file_name, num_frames, height=64 if name == 'a' else 48, width=56 if name == 'a' else 40,
+                         video_type=video_type)
+            self.jobs.append(Job(file_name, os.path.join(self.get_temp_dir(), f'{name}_3d.mp4'), video_type))
+
+    def convert(self, trunk: UniformTrunk, concurrent_movies: int = 2):
+        return batch_convert(self.jobs, trunk, TiledComposer(4, softmax=True), Shape(64, 56), batch_size=4,
+                             segment_frames=4, concurrent_movies=concurrent_movies, queue_size=4)
+
+    def test_parse_manifest(self):
+        manifest = os.path.join(self.get_temp_dir(), 'manifest.csv')
+        with open(manifest, 'w') as f:
+            f.write('# input,output,video_type\na.mp4, a_3d.mp4\n\nb.mp4,b_3d.mp4,ud3d\n')
+        self.assertEqual(parse_manifest(manifest), [Job('a.mp4', 'a_3d.mp4', VideoType.LR3D),
+                                                    Job('b.mp4', 'b_3d.mp4', VideoType.UD3D)])
+        with open(manifest, 'w') as f:
+            f.write('a.mp4\n')
+        with self.assertRaises(ValueError):
+            parse_manifest(manifest)
+
+    def test_progress(self):
+        output = os.path.join(self.get_temp_dir(), 'movie.mp4')
+        progress = MovieProgress(output)
+        self.assertEqual((progress.segments, progress.done), (0, False))
+        self.assertEqual(progress.segment(3), os.path.join(self.get_temp_dir(), 'movie.part-00003.mp4'))
+        progress.save(2)
+        progress = MovieProgress(output)
+        self.assertEqual((progress.segments, progress.done), (2, False))
+
+    def test_abort(self):
+        output = os.path.join(self.get_temp_dir(), 'aborted.mp4')
+        progress = MovieProgress(output)
+        writer = MovieWriter(Job('a.mp4', output, VideoType.LR3D), progress, 4, cv2.VideoWriter_fourcc(*'mp4v'), 24)
+        frame = np.zeros((64, 56, 3), np.uint8)
+        writer.write(frame, frame)
+        writer.abort()
+        self.assertFalse(os.path.exists(progress.segment(0)))
+        # a segment whose file is gone already, as when the encoder failed to create it
+        writer.write(frame, frame)
+        os.remove(progress.segment(0))
+        writer.abort()
+        self.assertEqual(progress.segments, 0)
+
+    def test_batch_convert(self):
+        trunk = UniformTrunk()
+        stages, failures = self.convert(trunk)
+        self.assertEmpty(failures)
+        # the batches are shared by the movies, only the last one is partial
+        self.assertEqual([shape[0] for shape in trunk.shapes], [4, 4, 4, 4, 4, 2])
+        self.assertEqual(stages['encode'].frames, 22)
+        for job, (_, num_frames) in zip(self.jobs, self.movies.values()):
+            self.assertEqual(len(read_frames(job.output)), num_frames)
+            self.assertEqual(MovieProgress(job.output).done, True)
+            # the segments are written at the frame rate of the movie, not rounded up
+            capture = cv2.VideoCapture(job.output)
+            self.assertAllClose(capture.get(cv2.CAP_PROP_FPS), 24.0)
+            capture.release()
+        self.assertEmpty([name for name in os.listdir(self.get_temp_dir()) if '.part-' in name])
+
+        # the movies are done, a second run skips them
+        trunk = UniformTrunk()
+        self.convert(trunk)
+        self.assertEmpty(trunk.shapes)
+
+    def test_resume(self):
+        with self.assertRaises(RuntimeError):
+            self.convert(UniformTrunk(fail_after=3), concurrent_movies=1)
+        progress = MovieProgress(self.jobs[0].output)
+        self.assertBetween(progress.segments, 1, 3)
+        self.assertFalse(progress.done)
+
+        # the first movie resumes from its first unwritten segment
+        trunk = UniformTrunk()
+        self.convert(trunk, concurrent_movies=1)
+        self.assertEqual(sum(shape[0] for shape in trunk.shapes), 13 - 4 * progress.segments + 9)
+        for job, (_, num_frames) in zip(self.jobs, self.movies.values()):
+            self.assertEqual(len(read_frames(job.output)), num_frames)
+            with open(f'{job.output}.progress.json') as f:
+                self.assertTrue(json.load(f)['done'])
+
+    def test_failed_jobs(self):
+        # a movie that is not there, and one that opens without a frame to read, fail alone
+        empty = os.path.join(self.get_temp_dir(), 'empty.mp4')
+        with open(empty, 'wb'):
+            pass
+        missing = Job(os.path.join(self.get_temp_dir(), 'missing.mp4'), os.path.join(self.get_temp_dir(), 'm.mp4'),
+                      VideoType.LR3D)
+        broken = Job(empty, os.path.join(self.get_temp_dir(), 'empty_3d.mp4'), VideoType.LR3D)
+        self.jobs = [missing, self.jobs[0], broken, self.jobs[1]]
+        _, failures = self.convert(UniformTrunk())
+        self.assertCountEqual(failures, [missing, broken])
+        for job, (_, num_frames) in zip(self.jobs[1::2], self.movies.values()):
+            self.assertEqual(len(read_frames(job.output)), num_frames)
+        self.assertFalse(MovieProgress(broken.output).done)
+
+
+if __name__ == '__main__':
+    tf.test.main()
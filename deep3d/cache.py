@@ -0,0 +1,162 @@
+import os
+import json
+import shutil
+import socket
+import hashlib
+import tensorflow as tf
+from typing import Dict
+
+from deep3d.data import FrameGenerator, VideoType, OriginType, Shape
+
+
+def file_hash(file_name: str, hash_file: str = None) -> str:
+  """sha1 of the file content, memoized in `hash_file` by path, size and mtime since a movie takes a while to read."""
+  stat = os.stat(file_name)
+  stamp = f'{os.path.abspath(file_name)}:{stat.st_size}:{stat.st_mtime_ns}'
+  hashes = {}
+  if hash_file is not None and os.path.exists(hash_file):
+    with open(hash_file) as f:
+      hashes = json.load(f)
+  if stamp not in hashes:
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 24), b''):
+        sha1.update(chunk)
+    hashes[stamp] = sha1.hexdigest()
+    if hash_file is not None:
+      # written aside and renamed, a crash or another job writing at the same time leaves either file whole
+      temp = f'{hash_file}.tmp-{socket.gethostname()}-{os.getpid()}'
+      with open(temp, 'w') as f:
+        json.dump(hashes, f)
+      os.replace(temp, hash_file)
+  return hashes[stamp]
+
+
+def _running(pid: int) -> bool:
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    # alive, under another user
+    return True
+  return True
+
+
+class FrameCache(object):
+  """Preprocessed frames of one movie, as GZIP TFRecord shards under `cache_dir`.
+
+  The cache directory is named after the content hash of the movie, the resize shape, the VideoType, the OriginType
+  and whether the full resolution origin is kept, so a different movie or preprocessing never reads stale frames.
+  Until the cache is complete the first epoch decodes the movie and writes the shards as the frames go by. The shards
+  are moved in place only once the whole movie has been written, later epochs and jobs read them back in parallel.
+  """
+
+  def __init__(self,
+               cache_dir: str,
+               video_file_name: str,
+               video_type: VideoType = VideoType.LR3D,
+               resize: Shape = Shape(256, 448),
+               origin_type: OriginType = OriginType.COLOR,
+               with_origin: bool = False,
+               frames_per_shard: int = 256):
+    self._video_file_name = video_file_name
+    self._video_type = video_type
+    self._resize = resize
+    self._origin_type = origin_type
+    self._frames_per_shard = frames_per_shard
+    self.keys = ['origin', 'left', 'right', 'feature'] if with_origin else ['left', 'right', 'feature']
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = '-'.join([file_hash(video_file_name, os.path.join(cache_dir, 'hashes.json')),
+                    f'{resize.high}x{resize.width}', video_type.name.lower(), origin_type.name.lower(),
+                    'origin' if with_origin else 'no_origin'])
+    self.path = os.path.join(cache_dir, key)
+    self._temp_prefix = f'{self.path}.tmp-{socket.gethostname()}-'
+    # a job killed while it wrote the cache leaves its temp directory, the ones of live jobs on this host are kept
+    for name in os.listdir(cache_dir):
+      path = os.path.join(cache_dir, name)
+      pid = path[len(self._temp_prefix):]
+      if path.startswith(self._temp_prefix) and pid.isdigit() and not _running(int(pid)):
+        shutil.rmtree(path, ignore_errors=True)
+
+  @property
+  def complete(self) -> bool:
+    return os.path.exists(os.path.join(self.path, 'spec.json'))
+
+  def _frame_generator(self) -> FrameGenerator:
+    return FrameGenerator(self._video_file_name, video_type=self._video_type, num_epoch=1, resize=self._resize,
+                          origin_type=self._origin_type)
+
+  def _write(self):
+    # yields the frames of one pass over the movie while writing them, the shards are committed after the last one
+    temp_path = f'{self._temp_prefix}{os.getpid()}'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    try:
+      num_frames, writer = 0, None
+      with self._frame_generator() as generator:
+        shapes = {key: generator.signature[key].shape.as_list() for key in self.keys}
+        try:
+          for frame in generator:
+            if num_frames % self._frames_per_shard == 0:
+              if writer is not None:
+                writer.close()
+              shard = os.path.join(temp_path, f'frames-{num_frames // self._frames_per_shard:05d}.tfrecord.gz')
+              writer = tf.io.TFRecordWriter(shard, options='GZIP')
+            features = {key: tf.train.Feature(bytes_list=tf.train.BytesList(value=[frame[key].tobytes()]))
+                        for key in self.keys}
+            writer.write(tf.train.Example(features=tf.train.Features(feature=features)).SerializeToString())
+            num_frames += 1
+            yield {key: frame[key] for key in self.keys}
+        finally:
+          if writer is not None:
+            writer.close()
+
+      with open(os.path.join(temp_path, 'spec.json'), 'w') as f:
+        json.dump({'num_frames': num_frames, 'shapes': shapes}, f)
+      try:
+        os.rename(temp_path, self.path)
+      except OSError:
+        # another job committed the same cache first
+        pass
+    finally:
+      # nothing is left of a pass that was abandoned, failed or lost the race to commit
+      shutil.rmtree(temp_path, ignore_errors=True)
+
+  def _parse(self, record: tf.Tensor, shapes: Dict[str, list]) -> Dict[str, tf.Tensor]:
+    features = tf.io.parse_single_example(record, {key: tf.io.FixedLenFeature([], tf.string) for key in self.keys})
+    return {key: tf.reshape(tf.io.decode_raw(features[key], tf.uint8), shapes[key]) for key in self.keys}
+
+  def _read(self, shapes: Dict[str, list], shuffle: bool) -> tf.data.Dataset:
+    # the shards are listed when the epoch starts, they do not exist yet while the first epoch writes them
+    pattern = os.path.join(self.path, 'frames-*.tfrecord.gz')
+    files = tf.data.Dataset.from_tensors(pattern).flat_map(
+      lambda pattern: tf.data.Dataset.from_tensor_slices(tf.io.matching_files(pattern)))
+    if shuffle:
+      files = files.shuffle(buffer_size=1 << 16)
+      dataset = files.interleave(lambda file_name: tf.data.TFRecordDataset(file_name, compression_type='GZIP'),
+                                 cycle_length=8, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+    else:
+      dataset = files.interleave(lambda file_name: tf.data.TFRecordDataset(file_name, compression_type='GZIP'),
+                                 cycle_length=1)
+    return dataset.map(lambda record: self._parse(record, shapes), num_parallel_calls=tf.data.AUTOTUNE,
+                       deterministic=not shuffle)
+
+  def dataset(self, num_epoch: int = 1, shuffle_buffer: int = 0) -> tf.data.Dataset:
+    """Unbatched uint8 frames with `keys`, shuffled by shard and within `shuffle_buffer` frames when it is > 0."""
+    shuffle = shuffle_buffer > 0
+    if self.complete:
+      with open(os.path.join(self.path, 'spec.json')) as f:
+        shapes = json.load(f)['shapes']
+      dataset = self._read(shapes, shuffle).repeat(num_epoch)
+    else:
+      with self._frame_generator() as generator:
+        signature = {key: generator.signature[key] for key in self.keys}
+      shapes = {key: spec.shape.as_list() for key, spec in signature.items()}
+      dataset = tf.data.Dataset.from_generator(generator=self._write, output_signature=signature)
+      if num_epoch > 1:
+        dataset = dataset.concatenate(self._read(shapes, shuffle).repeat(num_epoch - 1))
+    if shuffle:
+      dataset = dataset.shuffle(buffer_size=shuffle_buffer)
+    return dataset
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import tensorflow as tf
+
+from deep3d.cache import FrameCache
+from deep3d.data import FrameGenerator, Shape
+from deep3d.synthetic import stereo_video
+
+
+class FrameCacheTest(tf.test.TestCase):
+    def test_frame_cache(self):
+        cache_dir = os.path.join(self.get_temp_dir(), 'cache')
+        file_name = os.path.join(self.get_temp_dir(), 'cached.avi')
+        stereo_video(file_name, 11, height=64, width=64, fourcc='MJPG')
+        with FrameGenerator(file_name) as generator:
+            expected = list(generator)
+
+        cache = FrameCache(cache_dir, file_name, with_origin=True, frames_per_shard=4)
+        self.assertFalse(cache.complete)
+        # the first epoch decodes and writes the shards, the second one reads them back
+        frames = list(cache.dataset(num_epoch=2).as_numpy_iterator())
+        self.assertTrue(cache.complete)
+        self.assertLen(frames, 2 * len(expected))
+        for frame, expected_frame in zip(frames, expected + expected):
+            for key in expected_frame:
+                self.assertAllEqual(frame[key], expected_frame[key])
+
+        # a later job reads the complete cache, shuffled
+        cache = FrameCache(cache_dir, file_name, with_origin=True, frames_per_shard=4)
+        self.assertTrue(cache.complete)
+        frames = list(cache.dataset(shuffle_buffer=8).as_numpy_iterator())
+        self.assertCountEqual([frame['left'].tobytes() for frame in frames],
+                              [frame['left'].tobytes() for frame in expected])
+
+        # a different resize or a changed movie is a different cache
+        self.assertFalse(FrameCache(cache_dir, file_name, resize=Shape(128, 224)).complete)
+        stereo_video(file_name, 12, height=64, width=64, fourcc='MJPG')
+        self.assertFalse(FrameCache(cache_dir, file_name, with_origin=True).complete)
+
+    def test_temp_dirs(self):
+        cache_dir = os.path.join(self.get_temp_dir(), 'temp_cache')
+        file_name = os.path.join(self.get_temp_dir(), 'temp.avi')
+        stereo_video(file_name, 6, height=64, width=64, fourcc='MJPG')
+        cache = FrameCache(cache_dir, file_name, frames_per_shard=4)
+
+        # a pass abandoned halfway leaves no temp directory and no cache
+        frames = cache._write()
+        next(frames)
+        self.assertLen([name for name in os.listdir(cache_dir) if '.tmp-' in name], 1)
+        frames.close()
+        self.assertEqual(os.listdir(cache_dir), ['hashes.json'])
+        self.assertFalse(cache.complete)
+
+        # the temp directory of a killed job goes when the cache is opened again, the one of a live job stays
+        process = subprocess.Popen(['true'])
+        process.wait()
+        dead, live = f'{cache._temp_prefix}{process.pid}', f'{cache._temp_prefix}{os.getpid()}'
+        os.makedirs(dead)
+        os.makedirs(live)
+        FrameCache(cache_dir, file_name, frames_per_shard=4)
+        self.assertFalse(os.path.exists(dead))
+        self.assertTrue(os.path.exists(live))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,52 @@
+import glob
+from absl import flags, app, logging
+from typing import Dict, List
+from tensorflow.core.util import test_log_pb2
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('baseline', None, 'TEST_REPORT_FILE_PREFIX the benchmarks of the baseline commit ran with')
+flags.DEFINE_string('current', None, 'TEST_REPORT_FILE_PREFIX the benchmarks of the current commit ran with')
+flags.DEFINE_float('tolerance', 0.1, 'how much slower than the baseline a benchmark may be before it is a regression')
+
+
+def load_entries(prefix: str) -> Dict[str, Dict[str, float]]:
+  """The wall_time and numeric extras of the benchmarks tf.test.Benchmark wrote under `prefix`, by name."""
+  results = {}
+  for file_name in sorted(glob.glob(f'{prefix}*')):
+    entries = test_log_pb2.BenchmarkEntries()
+    with open(file_name, 'rb') as f:
+      entries.ParseFromString(f.read())
+    for entry in entries.entry:
+      result = {'wall_time': entry.wall_time}
+      result.update({key: value.double_value for key, value in entry.extras.items()
+                     if value.WhichOneof('kind') == 'double_value'})
+      results[entry.name] = result
+  return results
+
+
+def compare(baseline: Dict[str, Dict[str, float]], current: Dict[str, Dict[str, float]],
+            tolerance: float = 0.1) -> List[str]:
+  """Logs the change in wall_time of the benchmarks in both runs, returns the ones slower by more than `tolerance`."""
+  regressions = []
+  for name in sorted(set(baseline) & set(current)):
+    before, after = baseline[name]['wall_time'], current[name]['wall_time']
+    ratio = after / max(before, 1e-12)
+    logging.info(f'{name}: {before:.6f}s -> {after:.6f}s ({ratio - 1:+.1%})')
+    if ratio > 1 + tolerance:
+      regressions.append(name)
+  for name in sorted(set(baseline) ^ set(current)):
+    logging.info(f'{name}: only in the {"baseline" if name in baseline else "current"} run')
+  return regressions
+
+
+def main(_):
+  regressions = compare(load_entries(FLAGS.baseline), load_entries(FLAGS.current), FLAGS.tolerance)
+  if regressions:
+    logging.error(f'{len(regressions)} benchmarks regressed: {", ".join(regressions)}')
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  flags.mark_flags_as_required(['baseline', 'current'])
+  app.run(main)
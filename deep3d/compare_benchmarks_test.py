@@ -0,0 +1,33 @@
+import os
+import tensorflow as tf
+from tensorflow.core.util import test_log_pb2
+
+from deep3d.compare_benchmarks import compare, load_entries
+
+
+def write_entry(prefix: str, name: str, wall_time: float, frames_per_second: float):
+    # what tf.test.Benchmark.report_benchmark writes with TEST_REPORT_FILE_PREFIX set
+    entries = test_log_pb2.BenchmarkEntries()
+    entry = entries.entry.add(name=name, iters=1, wall_time=wall_time)
+    entry.extras['frames_per_second'].double_value = frames_per_second
+    with open(f'{prefix}{name}', 'wb') as f:
+        f.write(entries.SerializeToString())
+
+
+class CompareBenchmarksTest(tf.test.TestCase):
+    def test_compare(self):
+        baseline, current = [os.path.join(self.get_temp_dir(), f'{run}_') for run in ['baseline', 'current']]
+        write_entry(baseline, 'DeepDotBenchmark.deep_dot', 0.10, 640)
+        write_entry(baseline, 'DeepDotBenchmark.grad_deep_dot', 0.20, 320)
+        write_entry(current, 'DeepDotBenchmark.deep_dot', 0.105, 610)
+        write_entry(current, 'DeepDotBenchmark.grad_deep_dot', 0.30, 213)
+        write_entry(current, 'InputPipelineBenchmark.frame_generator', 0.01, 100)
+
+        entries = load_entries(baseline)
+        self.assertEqual(set(entries), {'DeepDotBenchmark.deep_dot', 'DeepDotBenchmark.grad_deep_dot'})
+        self.assertAllClose(entries['DeepDotBenchmark.deep_dot']['frames_per_second'], 640)
+        self.assertEqual(compare(entries, load_entries(current), tolerance=0.1), ['DeepDotBenchmark.grad_deep_dot'])
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -1,5 +1,16 @@
-from absl import flags, app
-from moviepy.editor import *
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import cv2
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from absl import flags, app, logging
+from typing import List
+
+from deep3d.utils import ffmpeg_binary
+from deep3d.instrument import instruments
 
 FLAGS = flags.FLAGS
 
@@ -8,21 +19,134 @@ flags.DEFINE_string('iv', None, 'video_in')
 flags.DEFINE_string('ov', None, 'video_out')
 flags.DEFINE_string('codec', 'mpeg4', 'codec')
 flags.DEFINE_string('bitrate', '2000k', 'bitrate')
+flags.DEFINE_enum('mode', 'auto', ['auto', 'copy', 'segments', 'moviepy'],
+                  'copy remuxes without re-encoding, segments re-encodes keyframe segments in parallel, '
+                  'auto copies and re-encodes only if the codecs do not fit the output, moviepy is the old path')
+flags.DEFINE_string('audio_codec', 'copy', 'audio codec, copy keeps the original audio stream')
+flags.DEFINE_integer('segment_secs', 10, 'length of the segments re-encoded in parallel, cut at the next keyframe')
+flags.DEFINE_integer('num_workers', 0, 'ffmpeg processes encoding segments, 0 for one per cpu')
+flags.DEFINE_string('report_file', '', 'where to write the timings of the steps, as csv for .csv and json otherwise')
 
 
-def compose(audio_in: str, video_in: str, video_out: str,
-            codec: str = 'mpeg4', bitrate='2000k'):
+def duration(video: str) -> float:
+  vc = cv2.VideoCapture(video)
+  try:
+    fps = vc.get(cv2.CAP_PROP_FPS)
+    return vc.get(cv2.CAP_PROP_FRAME_COUNT) / fps if fps else 0.0
+  finally:
+    vc.release()
+
+
+def run_ffmpeg(args: List[str], name: str, total_secs: float = 0.0, report_secs: float = 5.0, stage: str = None):
+  """Runs ffmpeg with `args`, logging how far into the `total_secs` of output it is every `report_secs`.
+
+  The run is timed as the `stage`, `name` by default, of deep3d.instrument.
+  """
+  command = [ffmpeg_binary(), '-y', '-v', 'error', '-nostats', '-progress', 'pipe:1'] + args
+  start, last_report = time.time(), time.time()
+  with instruments.stage(f'compose {stage or name}').work(), \
+      subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
+    # stderr is drained aside, ffmpeg would block on a full stderr pipe while progress is read from stdout
+    errors = []
+    drain = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+    drain.start()
+    for line in process.stdout:
+      key, _, value = line.strip().partition('=')
+      if key == 'out_time_us' and value.isdigit() and time.time() - last_report > report_secs:
+        done = int(value) / 1e6
+        logging.info(f'{name}: {done:.1f}s' + (f' of {total_secs:.1f}s' if total_secs else '') +
+                     f' in {time.time() - start:.1f}s')
+        last_report = time.time()
+    drain.join()
+  if process.returncode != 0:
+    raise RuntimeError(f'{name} failed: {"".join(errors).strip()}')
+  logging.info(f'{name}: done in {time.time() - start:.1f}s')
+
+
+def stream_copy(audio_in: str, video_in: str, video_out: str, audio_codec: str = 'copy'):
+  """Puts the audio of `audio_in` onto `video_in` without decoding the video."""
+  run_ffmpeg(['-i', video_in, '-i', audio_in, '-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy',
+              '-c:a', audio_codec, '-shortest', video_out], 'stream copy', duration(video_in))
+
+
+def segmented_reencode(audio_in: str, video_in: str, video_out: str, codec: str = 'mpeg4', bitrate: str = '2000k',
+                       audio_codec: str = 'copy', segment_secs: int = 10, num_workers: int = 0):
+  """Re-encodes `video_in` as keyframe aligned segments in parallel ffmpeg processes, then joins them with the audio.
+
+  The segments are cut with stream copy, so they start on keyframes and decode on their own. Each one is encoded by
+  its own ffmpeg process, which runs the encoders of `num_workers` segments at a time no matter how well `codec`
+  threads by itself, and the encoded segments are concatenated and muxed with the audio without another encode.
+  """
+  temp_dir = tempfile.mkdtemp(prefix='compose-', dir=os.path.dirname(os.path.abspath(video_out)))
+  try:
+    run_ffmpeg(['-i', video_in, '-map', '0:v:0', '-c', 'copy', '-f', 'segment', '-segment_time', str(segment_secs),
+                '-reset_timestamps', '1', os.path.join(temp_dir, 'part-%05d.mkv')], 'split', duration(video_in))
+    parts = sorted(name for name in os.listdir(temp_dir) if name.startswith('part-'))
+
+    def encode(part: str) -> str:
+      encoded = os.path.join(temp_dir, part.replace('part-', 'encoded-'))
+      run_ffmpeg(['-i', os.path.join(temp_dir, part), '-c:v', codec, '-b:v', bitrate, '-an', encoded], part,
+                 stage='encode')
+      return encoded
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+      futures = [pool.submit(encode, part) for part in parts]
+      for done, future in enumerate(as_completed(futures), 1):
+        future.result()
+        logging.info(f'encoded {done}/{len(parts)} segments in {time.time() - start:.1f}s')
+
+    concat = os.path.join(temp_dir, 'concat.txt')
+    with open(concat, 'w') as f:
+      f.writelines(f"file '{part.replace('part-', 'encoded-')}'\n" for part in parts)
+    run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', concat, '-i', audio_in, '-map', '0:v:0', '-map', '1:a:0',
+                '-c:v', 'copy', '-c:a', audio_codec, '-shortest', video_out], 'concat', duration(video_in))
+  finally:
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def compose_moviepy(audio_in: str, video_in: str, video_out: str,
+                    codec: str = 'mpeg4', bitrate='2000k'):
+  from moviepy.editor import AudioFileClip, VideoFileClip, CompositeVideoClip
   audio_in_clip = AudioFileClip(audio_in)
   video_in_clip = VideoFileClip(video_in)
   video_out_clip = video_in_clip.set_audio(audio_in_clip)
   video = CompositeVideoClip([video_out_clip])
-  video.write_videofile(video_out, codec=codec, bitrate=bitrate)
+  with instruments.stage('compose moviepy').work():
+    video.write_videofile(video_out, codec=codec, bitrate=bitrate)
+
+
+def compose(audio_in: str, video_in: str, video_out: str,
+            codec: str = 'mpeg4', bitrate='2000k', mode: str = 'auto', audio_codec: str = 'copy',
+            segment_secs: int = 10, num_workers: int = 0):
+  if mode == 'moviepy':
+    compose_moviepy(audio_in, video_in, video_out, codec=codec, bitrate=bitrate)
+    return
+  if mode in ('auto', 'copy'):
+    try:
+      stream_copy(audio_in, video_in, video_out, audio_codec=audio_codec)
+      return
+    except RuntimeError as e:
+      if mode == 'copy':
+        raise
+      logging.warning(f'{e}, re-encoding the video')
+      if audio_codec == 'copy':
+        # the audio stream itself may be what the container does not take, copying it would fail the same way
+        audio_codec = 'aac'
+  segmented_reencode(audio_in, video_in, video_out, codec=codec, bitrate=bitrate, audio_codec=audio_codec,
+                     segment_secs=segment_secs, num_workers=num_workers)
 
 
 def main(_):
   compose(FLAGS.ia, FLAGS.iv, FLAGS.ov,
           codec=FLAGS.codec,
-          bitrate=FLAGS.bitrate)
+          bitrate=FLAGS.bitrate,
+          mode=FLAGS.mode,
+          audio_codec=FLAGS.audio_codec,
+          segment_secs=FLAGS.segment_secs,
+          num_workers=FLAGS.num_workers)
+  if FLAGS.report_file:
+    instruments.write(FLAGS.report_file)
 
 
 if __name__ == '__main__':
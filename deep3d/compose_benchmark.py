@@ -0,0 +1,56 @@
+import os
+import time
+import cv2
+import tensorflow as tf
+from absl import flags
+
+from deep3d.compose import compose, run_ffmpeg
+from deep3d.synthetic import stereo_video
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('video', '', 'converted movie to mux, a synthetic 1080p clip when empty')
+flags.DEFINE_string('audio', '', 'audio to mux, a sine tone as long as the synthetic clip when empty')
+flags.DEFINE_integer('num_frames', 240, 'frames in the synthetic clip')
+
+
+def _synthetic_movie(video: str, audio: str, num_frames: int):
+  stereo_video(video, num_frames, 1080, 960)
+  run_ffmpeg(['-f', 'lavfi', '-i', f'sine=frequency=440:duration={num_frames / 24}', '-c:a', 'aac', audio],
+             'audio')
+
+
+class ComposeBenchmark(tf.test.Benchmark):
+
+  def _movie(self):
+    if FLAGS.video and FLAGS.audio:
+      return FLAGS.audio, FLAGS.video
+    temp_dir = tf.compat.v1.test.get_temp_dir()
+    video, audio = os.path.join(temp_dir, 'compose.mp4'), os.path.join(temp_dir, 'compose.m4a')
+    if not os.path.exists(audio):
+      _synthetic_movie(video, audio, FLAGS.num_frames)
+    return audio, video
+
+  def _run(self, mode: str):
+    audio, video = self._movie()
+    video_out = os.path.join(tf.compat.v1.test.get_temp_dir(), f'composed-{mode}.mp4')
+    start = time.time()
+    compose(audio, video, video_out, mode=mode)
+    wall_time = time.time() - start
+    vc = cv2.VideoCapture(video)
+    num_frames = vc.get(cv2.CAP_PROP_FRAME_COUNT)
+    vc.release()
+    self.report_benchmark(iters=1, wall_time=wall_time, name=f'compose_{mode}',
+                          extras={'frames_per_second': num_frames / wall_time})
+
+  def benchmark_moviepy(self):
+    self._run('moviepy')
+
+  def benchmark_stream_copy(self):
+    self._run('copy')
+
+  def benchmark_segmented_reencode(self):
+    self._run('segments')
+
+
+if __name__ == '__main__':
+  tf.test.main()
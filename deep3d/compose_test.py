@@ -0,0 +1,60 @@
+import os
+import shutil
+import tensorflow as tf
+
+from deep3d.compose import run_ffmpeg, compose
+from deep3d.synthetic import read_frames, stereo_video
+from deep3d.utils import ffmpeg_binary
+
+
+def write_movie(video: str, audio: str, num_frames: int = 48):
+    stereo_video(video, num_frames, height=64, width=64)
+    run_ffmpeg(['-f', 'lavfi', '-i', f'sine=frequency=440:duration={num_frames / 24}', '-c:a', 'aac', audio],
+               'audio')
+
+
+class ComposeTest(tf.test.TestCase):
+    def setUp(self):
+        super().setUp()
+        if shutil.which(ffmpeg_binary()) is None:
+            self.skipTest('ffmpeg is not installed')
+        self.video = os.path.join(self.get_temp_dir(), 'video.mp4')
+        self.audio = os.path.join(self.get_temp_dir(), 'audio.m4a')
+        write_movie(self.video, self.audio)
+
+    def assertHasAudio(self, video: str):
+        # fails unless the audio stream decodes
+        run_ffmpeg(['-i', video, '-map', '0:a:0', '-f', 'null', '-'], 'decode audio')
+
+    def test_run_ffmpeg_error(self):
+        # stderr is read next to the progress on stdout and ends up in the error
+        with self.assertRaisesRegex(RuntimeError, 'missing.mp4'):
+            run_ffmpeg(['-i', os.path.join(self.get_temp_dir(), 'missing.mp4'), '-f', 'null', '-'], 'missing')
+
+    def test_stream_copy(self):
+        video_out = os.path.join(self.get_temp_dir(), 'copy.mp4')
+        compose(self.audio, self.video, video_out, mode='copy')
+        self.assertHasAudio(video_out)
+        for frame, expected in zip(read_frames(video_out), read_frames(self.video)):
+            self.assertAllEqual(frame, expected)
+        self.assertLen(read_frames(video_out), 48)
+
+    def test_segmented_reencode(self):
+        video_out = os.path.join(self.get_temp_dir(), 'segments.mp4')
+        compose(self.audio, self.video, video_out, mode='segments', segment_secs=1, num_workers=2)
+        self.assertHasAudio(video_out)
+        self.assertLen(read_frames(video_out), 48)
+        self.assertFalse([name for name in os.listdir(self.get_temp_dir()) if name.startswith('compose-')])
+
+    def test_auto_audio_reencode(self):
+        # mp4 does not hold mu-law audio, the copy fails and so would a re-encode that copied the audio
+        audio = os.path.join(self.get_temp_dir(), 'audio.wav')
+        run_ffmpeg(['-f', 'lavfi', '-i', 'sine=frequency=440:duration=2', '-c:a', 'pcm_mulaw', audio], 'audio')
+        video_out = os.path.join(self.get_temp_dir(), 'auto.mp4')
+        compose(audio, self.video, video_out, mode='auto', segment_secs=1, num_workers=2)
+        self.assertHasAudio(video_out)
+        self.assertLen(read_frames(video_out), 48)
+
+
+if __name__ == '__main__':
+    tf.test.main()
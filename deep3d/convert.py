@@ -0,0 +1,145 @@
+import time
+import queue
+import threading
+import contextlib
+import numpy as np
+import tensorflow as tf
+from absl import logging
+from functools import partial
+from typing import Callable, Dict
+
+from deep3d.assemble import FrameAssembler
+from deep3d.data import OriginType
+from deep3d.instrument import Stage, instruments
+from deep3d.utils import save
+
+_DONE = object()
+
+
+def compose_frame(origin: np.ndarray, origin_pred: np.ndarray, origin_type: OriginType) -> np.ndarray:
+  """The uint8 output frame: origin and origin_pred side by side for color, red/blue anaglyph for gray."""
+  return FrameAssembler(origin.shape, origin_type)(origin, origin_pred)
+
+
+def _put(items: queue.Queue, item, stop: threading.Event) -> bool:
+  # blocks while the queue is full, which is the backpressure, until the pipeline is stopped
+  while not stop.is_set():
+    try:
+      items.put(item, timeout=0.1)
+      return True
+    except queue.Full:
+      pass
+  return False
+
+
+def _get(items: queue.Queue, stop: threading.Event):
+  while True:
+    try:
+      return items.get(timeout=0.1)
+    except queue.Empty:
+      if stop.is_set():
+        return _DONE
+
+
+def estimator_predict(estimator: tf.estimator.Estimator, input_fn):
+  """`predict` for convert through Estimator.predict, `input_fn` takes the frames as `frames`."""
+  return lambda frames: estimator.predict(input_fn=partial(input_fn, frames=frames), yield_single_examples=False)
+
+
+def convert(predict: Callable, frame_reader, output_file: str, origin_type: OriginType = OriginType.COLOR,
+            queue_size: int = 64, report_secs: float = 60.0, writer_options: Dict = None,
+            layout: str = None) -> Dict[str, Stage]:
+  """Predicts a movie and writes it as 3D, with decode, inference and encode running concurrently.
+
+  A decode thread reads `frame_reader` into a queue of `queue_size` frames. `predict` is given a generator function
+  over that queue and returns batches with 'origin' and 'origin_pred', which inference hands to the encode thread
+  through a queue of two batches, and the encode thread assembles them in `layout` and writes the frames. The bounded
+  queues keep memory flat for any movie length and the whole conversion runs at the speed of the slowest stage, which
+  the stage report logged every `report_secs` names. `writer_options` go to deep3d.utils.save, e.g. backend='ffmpeg'
+  with the audio of the movie.
+  """
+  stages = {name: instruments.new_stage(name) for name in ['decode', 'inference', 'encode']}
+  decoded, predicted = queue.Queue(maxsize=queue_size), queue.Queue(maxsize=2)
+  stop, errors = threading.Event(), []
+
+  def decode():
+    stage, frames = stages['decode'], iter(frame_reader)
+    try:
+      while True:
+        with stage.work():
+          frame = next(frames, _DONE)
+        if frame is _DONE:
+          break
+        stage.frames += 1
+        with stage.wait():
+          if not _put(decoded, frame, stop):
+            break
+        instruments.sample_queue('decoded', decoded.qsize())
+    except Exception as e:
+      errors.append(e)
+      stop.set()
+    finally:
+      _put(decoded, _DONE, stop)
+
+  def encode():
+    stage = stages['encode']
+    try:
+      with contextlib.ExitStack() as stack:
+        assembler, writer = None, None
+        while True:
+          with stage.wait():
+            predictions = _get(predicted, stop)
+          if predictions is _DONE:
+            break
+          with stage.work():
+            if assembler is None:
+              # the layout only depends on the view shape, cv2.VideoWriter drops frames of any other size without
+              # a word, so both are set up after the first batch
+              assembler = FrameAssembler(predictions['origin'].shape[1:], origin_type, layout)
+              size = (assembler.frame_shape[1], assembler.frame_shape[0])
+              writer = stack.enter_context(save(output_file, frame_reader.fourcc, frame_reader.fps, size, True,
+                                                **(writer_options or {})))
+            for img in assembler.batch(predictions['origin'], predictions['origin_pred']):
+              writer.write(img)
+              stage.frames += 1
+    except Exception as e:
+      errors.append(e)
+      stop.set()
+
+  def frames():
+    while True:
+      frame = _get(decoded, stop)
+      if frame is _DONE:
+        return
+      yield frame
+
+  threads = [threading.Thread(target=decode, name='decode', daemon=True),
+             threading.Thread(target=encode, name='encode', daemon=True)]
+  for thread in threads:
+    thread.start()
+
+  stage, last_report = stages['inference'], time.time()
+  try:
+    predictions = predict(frames)
+    while not stop.is_set():
+      with stage.work():
+        batch = next(predictions, _DONE)
+      if batch is _DONE:
+        break
+      stage.frames += len(batch['origin_pred'])
+      with stage.wait():
+        _put(predicted, {'origin': batch['origin'], 'origin_pred': batch['origin_pred']}, stop)
+      instruments.sample_queue('predicted', predicted.qsize())
+      if time.time() - last_report > report_secs:
+        logging.info(str(instruments))
+        last_report = time.time()
+  finally:
+    _put(predicted, _DONE, stop)
+    threads[1].join()
+    stop.set()
+    threads[0].join()
+
+  if errors:
+    raise errors[0]
+  logging.info(str(instruments))
+  return stages
@@ -0,0 +1,81 @@
+import os
+import cv2
+import wave
+import shutil
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+from deep3d.convert import compose_frame, convert
+from deep3d.data import FrameGenerator, OriginType
+from deep3d.synthetic import stereo_video
+from deep3d.utils import ffmpeg_binary
+
+
+def identity_predict(frames):
+    # origin_pred is the origin itself
+    dataset = tf.data.Dataset.from_generator(generator=lambda: (frame['origin'] for frame in frames()),
+                                             output_signature=tf.TensorSpec(shape=(108, 120, 3), dtype=tf.uint8))
+    for batch in dataset.batch(4).as_numpy_iterator():
+        yield {'origin': batch, 'origin_pred': batch}
+
+
+class ConvertTest(tf.test.TestCase):
+    def test_compose_frame(self):
+        # one eye of a 1080p side-by-side movie is padded to 1200x1080 proportions
+        origin = np.random.uniform(size=(1080, 960, 3)).astype(np.float32)
+        img = compose_frame(origin, origin, OriginType.COLOR)
+        self.assertEqual(img.shape, (1350, 1920, 3))
+        self.assertEqual(img.dtype, np.uint8)
+        self.assertAllEqual(img[135:1215, :960], (origin * 255).astype(np.uint8))
+        self.assertAllEqual(img[:135], np.zeros_like(img[:135]))
+
+        origin = np.random.randint(0, 255, size=(360, 320, 1)).astype(np.uint8)
+        img = compose_frame(origin, 255 - origin, OriginType.GRAY)
+        self.assertAllEqual(img, np.concatenate([origin, np.zeros_like(origin), 255 - origin], axis=-1))
+
+    def test_convert(self):
+        file_name = os.path.join(self.get_temp_dir(), 'movie.avi')
+        output_file = os.path.join(self.get_temp_dir(), 'converted.avi')
+        stereo_video(file_name, 30, height=108, width=120, fourcc='MJPG')
+
+        # a queue much shorter than the movie, decode has to wait for inference and encode
+        with FrameGenerator(file_name) as frame_reader:
+            stages = convert(identity_predict, frame_reader, output_file, OriginType.COLOR, queue_size=2)
+        self.assertEqual([stage.frames for stage in stages.values()], [30, 30, 30])
+
+        vc = cv2.VideoCapture(output_file)
+        self.assertEqual(vc.get(cv2.CAP_PROP_FRAME_COUNT), 30)
+        self.assertEqual(vc.get(cv2.CAP_PROP_FPS), 24)
+        # 120x108 eyes are padded to 1200x1080 proportions, then put side by side
+        self.assertEqual((vc.get(cv2.CAP_PROP_FRAME_WIDTH), vc.get(cv2.CAP_PROP_FRAME_HEIGHT)), (240, 1080))
+
+    def test_convert_ffmpeg_audio(self):
+        if shutil.which(ffmpeg_binary()) is None:
+            self.skipTest('ffmpeg is not installed')
+        # 48 frames at 25 fps are 1.92s, at 26 they would be 1.85s
+        file_name = os.path.join(self.get_temp_dir(), 'movie.avi')
+        stereo_video(file_name, 48, height=108, width=120, fps=25, fourcc='MJPG')
+        audio = os.path.join(self.get_temp_dir(), 'audio.m4a')
+        subprocess.run([ffmpeg_binary(), '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=duration=3', '-c:a', 'aac',
+                        audio], check=True)
+
+        output_file = os.path.join(self.get_temp_dir(), 'converted.mp4')
+        with FrameGenerator(file_name) as frame_reader:
+            self.assertEqual(frame_reader.fps, 25)
+            convert(identity_predict, frame_reader, output_file, OriginType.COLOR,
+                    writer_options={'backend': 'ffmpeg', 'audio': audio, 'preset': 'ultrafast'})
+
+        vc = cv2.VideoCapture(output_file)
+        self.assertEqual(vc.get(cv2.CAP_PROP_FRAME_COUNT), 48)
+        self.assertEqual(vc.get(cv2.CAP_PROP_FPS), 25)
+        vc.release()
+        # -shortest cuts the audio where the video ends, at the rate the frames were written at
+        decoded = os.path.join(self.get_temp_dir(), 'decoded.wav')
+        subprocess.run([ffmpeg_binary(), '-y', '-v', 'error', '-i', output_file, '-map', '0:a:0', decoded], check=True)
+        with wave.open(decoded) as f:
+            self.assertAllClose(f.getnframes() / f.getframerate(), 48 / 25, atol=0.05)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -1,23 +1,14 @@
 import cv2
-from enum import Enum
+import copy
+import math
+import time
+import queue
+import multiprocessing
 import numpy as np
 import tensorflow as tf
 from typing import Dict
-from collections import namedtuple
-
-
-class VideoType(Enum):
-  SIMPLE = 1
-  LR3D = 2
-  UD3D = 3
-
-
-class OriginType(Enum):
-  GRAY = 1
-  COLOR = 2
-
-
-Shape = namedtuple("Shape", 'high width')
+from deep3d.decode import VideoType, OriginType, Shape, frame_size, view_size, split_frame, decode_segments
+from deep3d.instrument import instruments
 
 
 class FrameGenerator(object):
@@ -28,7 +19,9 @@ class FrameGenerator(object):
                resize: Shape = Shape(256, 448),
                origin_type: OriginType = OriginType.COLOR):
     self._video_file_name = video_file_name
-    self._vc = cv2.VideoCapture(video_file_name)
+    # the [start, stop) frame range read, the whole movie unless sharded
+    self._start, self._stop = 0, None
+    self._open()
     self._video_type = video_type
     self._cur_epoch = 1
     self._num_epoch = num_epoch
@@ -37,6 +30,7 @@ class FrameGenerator(object):
 
     self.previous2 = np.zeros(shape=(self.height, self.width), dtype=np.uint8)
     self.previous1 = np.zeros(shape=(self.height, self.width), dtype=np.uint8)
+    self._handed_off = None
 
   @property
   def height(self):
@@ -55,14 +49,26 @@ class FrameGenerator(object):
       return int(self._resize.width)
 
   @property
-  def fps(self):
+  def resize(self) -> Shape:
+    return self._resize
+
+  @property
+  def fps(self) -> float:
+    # the exact rate, 23.976 stays 23.976: the audio of the movie is muxed against the frames written at it. Some
+    # containers do not tell, a writer can not take 0 and 24 is the common rate then
     assert self._vc is not None and self._vc.isOpened()
-    return int(self._vc.get(propId=cv2.CAP_PROP_FPS)) + 1
+    fps = self._vc.get(propId=cv2.CAP_PROP_FPS)
+    return fps if math.isfinite(fps) and fps > 0 else 24.0
 
   @property
   def fourcc(self):
     return int(self._vc.get(cv2.CAP_PROP_FOURCC))
 
+  @property
+  def frame_count(self) -> int:
+    # an estimate from the container, the stream may end a few frames off
+    return int(self._vc.get(cv2.CAP_PROP_FRAME_COUNT))
+
   @property
   def origin_size(self):
     return int(self._vc.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self._vc.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -96,64 +102,244 @@ class FrameGenerator(object):
   def __iter__(self):
     return self
 
-  def __next__(self) -> Dict[str, np.ndarray]:
+  def _open(self):
+    self._vc = cv2.VideoCapture(self._video_file_name)
+    self._position = self._start
+    if self._start > 0:
+      self._vc.set(cv2.CAP_PROP_POS_FRAMES, self._start)
+
+  def in_process(self) -> 'FrameGenerator':
+    """A FrameGenerator of one pass over the same movie that decodes in this process, to seek to a few frames."""
+    return FrameGenerator(self._video_file_name, self._video_type, resize=self._resize, origin_type=self._origin_type)
+
+  def shard(self, num_shards: int, index: int) -> 'FrameGenerator':
+    """A copy that reads the `index`-th of `num_shards` contiguous and disjoint frame ranges of this one.
+
+    Each worker of a distributed training decodes its own part of the movie only. The temporal context starts from
+    black at the start of a shard, as it does at the start of the movie.
+    """
+    stop = int(self._vc.get(cv2.CAP_PROP_FRAME_COUNT)) if self._stop is None else self._stop
+    length = stop - self._start
+    shard = copy.copy(self)
+    shard._start = self._start + length * index // num_shards
+    # CAP_PROP_FRAME_COUNT is an estimate, the last shard reads on to the end of the stream
+    shard._stop = self._start + length * (index + 1) // num_shards if index + 1 < num_shards else self._stop
+    shard._cur_epoch = 1
+    shard.previous2 = np.zeros_like(self.previous2)
+    shard.previous1 = np.zeros_like(self.previous1)
+    shard._handed_off = None
+    shard._open()
+    return shard
+
+  def seek(self, frame: int) -> 'FrameGenerator':
+    """Moves on to `frame`, reading the two frames before it again for the temporal context, and returns self.
+
+    Later epochs start over from `frame` too.
+    """
+    self._start = max(frame - 2, 0)
+    self.previous2 = np.zeros_like(self.previous2)
+    self.previous1 = np.zeros_like(self.previous1)
+    self._vc.release()
+    self._open()
+    for _ in range(frame - self._start):
+      _, left, _ = split_frame(self._read(), self._video_type, OriginType.GRAY, self._resize)
+      self.previous1, self.previous2 = left, self.previous1
+    self._start = frame
+    return self
+
+  def _read(self) -> np.ndarray:
     if not self._vc.isOpened():
       raise StopIteration
 
-    ret, frame = self._vc.read()
+    ret, frame = self._vc.read() if self._stop is None or self._position < self._stop else (False, None)
     if not ret:
       if self._cur_epoch < self._num_epoch:
         self._vc.release()
-        self._vc = cv2.VideoCapture(self._video_file_name)
+        self._open()
         ret, frame = self._vc.read()
         assert ret
         self._cur_epoch += 1
       else:
         raise StopIteration
+    self._position += 1
+    return frame
 
-    result = {}
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    if self._origin_type == OriginType.COLOR:
-      if self._video_type == VideoType.SIMPLE:
-        result['origin'] = frame
-      elif self._video_type == VideoType.LR3D:
-        split = int(self._vc.get(cv2.CAP_PROP_FRAME_WIDTH) / 2)
-        result['origin'] = frame[:, :split, :]
-      else:
-        split = int(self._vc.get(cv2.CAP_PROP_FRAME_HEIGHT) / 2)
-        result['origin'] = frame[:split, :, :]
-    else:
-      if self._video_type == VideoType.SIMPLE:
-        result['origin'] = np.expand_dims(gray, axis=2)
-      elif self._video_type == VideoType.LR3D:
-        split = int(self._vc.get(cv2.CAP_PROP_FRAME_WIDTH) / 2)
-        result['origin'] = np.expand_dims(gray[:, :split])
-      else:
-        split = int(self._vc.get(cv2.CAP_PROP_FRAME_HEIGHT) / 2)
-        result['origin'] = np.expand_dims(gray[:split, :])
+  def _timed_read(self) -> np.ndarray:
+    # the time between two frames, spent by whoever consumes them (the from_generator handoff included), is
+    # recorded as the read stage waiting
+    read = instruments.stage('read')
+    if self._handed_off is not None:
+      read.waiting += time.time() - self._handed_off
+    with read.work():
+      frame = self._read()
+    read.frames += 1
+    return frame
 
-    gray = cv2.resize(gray, dsize=(self._resize.width, self._resize.high))
-    inner_high, inner_width = gray.shape
+  def _hand_off(self, features: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    self._handed_off = time.time()
+    return features
 
-    if self._video_type == VideoType.LR3D:
-      split = int(inner_width / 2)
-      left, right = gray[:, :split], gray[:, split:inner_width]
-    elif self._video_type == VideoType.UD3D:
-      split = int(inner_high / 2)
-      left, right = gray[:split, :], gray[split:inner_high, :]
-    else:
-      left, right = gray, gray.copy()
+  def __next__(self) -> Dict[str, np.ndarray]:
+    frame = self._timed_read()
+    preprocess = instruments.stage('preprocess')
+    with preprocess.work():
+      origin, left, right = split_frame(frame, self._video_type, self._origin_type, self._resize)
+      features = self._stack(origin, left, right)
+    preprocess.frames += 1
+    return self._hand_off(features)
+
+  def _stack(self, origin: np.ndarray, left: np.ndarray, right: np.ndarray) -> Dict[str, np.ndarray]:
     feature = np.stack([left, self.previous1, self.previous2], axis=2)
     self.previous1, self.previous2 = left.copy(), self.previous1
     left, right = np.expand_dims(left, axis=2), np.expand_dims(right, axis=2)
 
-    result.update({
+    return {
+      'origin': origin,
       'left': left,
       'right': right,
       'feature': feature
-    })
-    return result
+    }
 
   def __call__(self):
     # for tf.data.Dataset.from_generator
     return self
+
+
+def split_frames(frames: tf.Tensor, video_type: VideoType, origin_type: OriginType,
+                 resize: Shape) -> Dict[str, tf.Tensor]:
+  """split_frame for a [batch, height, width, 3] BGR uint8 tensor, with tf ops."""
+  height, width = frames.shape[1], frames.shape[2]
+  # cv2's BGR2GRAY weights, tf.image.rgb_to_grayscale uses slightly different ones
+  gray = tf.tensordot(tf.cast(frames, dtype=tf.float32), tf.constant([0.114, 0.587, 0.299]), axes=1)
+  gray = tf.cast(tf.round(gray[..., tf.newaxis]), dtype=tf.uint8)
+  origin = frames if origin_type == OriginType.COLOR else gray
+  if video_type == VideoType.LR3D:
+    origin = origin[:, :, :int(width / 2), :]
+  elif video_type == VideoType.UD3D:
+    origin = origin[:, :int(height / 2), :, :]
+
+  gray = tf.image.resize(gray, size=(resize.high, resize.width), method='bilinear')
+  gray = tf.cast(tf.clip_by_value(tf.round(gray), 0, 255), dtype=tf.uint8)
+  if video_type == VideoType.LR3D:
+    split = int(resize.width / 2)
+    left, right = gray[:, :, :split, :], gray[:, :, split:, :]
+  elif video_type == VideoType.UD3D:
+    split = int(resize.high / 2)
+    left, right = gray[:, :split, :, :], gray[:, split:, :, :]
+  else:
+    left, right = gray, gray
+  return {'origin': origin, 'left': left, 'right': right}
+
+
+def stack_frames(previous: tf.Tensor, features: Dict[str, tf.Tensor]):
+  """Adds the temporal stack of a batch as 'feature', `previous` holds [previous2, previous1] of its first frame.
+
+  Returns the previous of the frame after the batch along with the features, as a tf.data scan function.
+  """
+  lefts = tf.concat([previous, features['left'][..., 0]], axis=0)
+  features = dict(features, feature=tf.stack([lefts[2:], lefts[1:-1], lefts[:-2]], axis=-1))
+  return lefts[-2:], features
+
+
+class RawFrameGenerator(FrameGenerator):
+  """FrameGenerator that only decodes, the rest of the per frame work is done by `dataset` with batched tf ops.
+
+  The gray conversion and resize are tf ops instead of cv2 and round differently, so gray values can be off by a
+  level or two from FrameGenerator. The temporal stack is a scan over the batches that carries the last two left
+  frames, so it continues across batch and epoch boundaries the same way previous1/previous2 do.
+  """
+
+  @property
+  def signature(self) -> Dict[str, tf.TensorSpec]:
+    height, width = self.origin_size
+    return {'frame': tf.TensorSpec(shape=(height, width, 3), dtype=tf.dtypes.uint8)}
+
+  def __next__(self) -> Dict[str, np.ndarray]:
+    return self._hand_off({'frame': self._timed_read()})
+
+  def dataset(self, batch_size: int, drop_remainder: bool = True, generator=None) -> tf.data.Dataset:
+    # `generator` can stand in for this one, yielding frames that were decoded elsewhere
+    dataset = tf.data.Dataset.from_generator(generator=generator or self, output_signature=self.signature)
+    dataset = dataset.batch(batch_size=batch_size, drop_remainder=drop_remainder)
+    dataset = dataset.map(lambda features: split_frames(features['frame'], self._video_type, self._origin_type,
+                                                        self._resize),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+    previous = tf.zeros(shape=(2, self.height, self.width), dtype=tf.dtypes.uint8)
+    return dataset.apply(tf.data.experimental.scan(previous, stack_frames))
+
+
+class ParallelFrameGenerator(FrameGenerator):
+  """FrameGenerator that decodes the video in `num_workers` processes.
+
+  The video is cut into segments of `segment_frames` frames, segment i is decoded by worker i % num_workers after a
+  seek to its first frame, and the segments are read back round robin so frames come out in file order. Each worker
+  buffers at most `queue_frames` decoded frames ahead, however long its segment. The default segment length is the
+  x264 default keyframe interval, so most seeks land on a keyframe instead of decoding up to the start of the
+  segment. previous1/previous2 are stacked here, in order, so the temporal context is the same as with FrameGenerator
+  across segment and epoch boundaries.
+  """
+
+  def __init__(self,
+               video_file_name: str,
+               video_type: VideoType = VideoType.LR3D,
+               num_epoch: int = 1,
+               resize: Shape = Shape(256, 448),
+               origin_type: OriginType = OriginType.COLOR,
+               num_workers: int = 4,
+               segment_frames: int = 250,
+               queue_frames: int = 4):
+    super(ParallelFrameGenerator, self).__init__(video_file_name, video_type, num_epoch, resize, origin_type)
+    self._num_workers = num_workers
+    self._segment_frames = segment_frames
+    self._queue_frames = queue_frames
+
+  def _segments(self):
+    # CAP_PROP_FRAME_COUNT is an estimate from the container, the last segment reads on to the end of the stream
+    count = int(self._vc.get(cv2.CAP_PROP_FRAME_COUNT)) if self._stop is None else self._stop
+    starts = list(range(self._start, max(count, self._start + 1), self._segment_frames))
+    return list(zip(starts, starts[1:] + [self._stop])) * self._num_epoch
+
+  def __iter__(self):
+    segments = self._segments()
+    # a forked copy of a process running tensorflow is not safe. spawned decoders import __main__ again, a few
+    # seconds once per pass which the speedup wins back within the first minute of a movie
+    context = multiprocessing.get_context('spawn')
+    # a few full resolution frames per worker, a segment of them would hold gigabytes of pickled frames in flight
+    queues = [context.Queue(maxsize=self._queue_frames) for _ in range(self._num_workers)]
+    workers = [context.Process(target=decode_segments,
+                               args=(self._video_file_name, self._video_type, self._origin_type, self._resize,
+                                     segments[i::self._num_workers], queues[i]),
+                               daemon=True)
+               for i in range(self._num_workers)]
+    for worker in workers:
+      worker.start()
+
+    # the decoders run in parallel, read waiting is the time spent waiting on them
+    read, preprocess = instruments.stage('read'), instruments.stage('preprocess')
+    try:
+      for i in range(len(segments)):
+        frames, worker = queues[i % self._num_workers], workers[i % self._num_workers]
+        while True:
+          try:
+            with read.wait():
+              item = frames.get(timeout=1.0)
+          except queue.Empty:
+            if not worker.is_alive():
+              raise RuntimeError(f'decoder process exited with code {worker.exitcode}')
+            continue
+          if item is None:
+            break
+          read.frames += 1
+          try:
+            instruments.sample_queue('decoded_segment', frames.qsize())
+          except NotImplementedError:
+            # macOS has no sem_getvalue, the depth of a multiprocessing queue is not known there
+            pass
+          with preprocess.work():
+            features = self._stack(*item)
+          preprocess.frames += 1
+          yield features
+    finally:
+      for worker in workers:
+        worker.terminate()
+        worker.join()
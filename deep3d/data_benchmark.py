@@ -0,0 +1,66 @@
+import os
+import time
+import tensorflow as tf
+from absl import flags
+
+from deep3d.data import FrameGenerator, RawFrameGenerator, VideoType, Shape
+from deep3d.synthetic import stereo_video
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('video', '', 'movie to read, a synthetic 1080p side-by-side clip when empty')
+flags.DEFINE_integer('num_frames', 240, 'frames in the synthetic clip')
+
+BATCH = 64
+# the eyes of the synthetic movies the frame generators are swept over
+EYES = [(540, 960), (1080, 960), (2160, 1920)]
+
+
+def _synthetic_video(video_type: VideoType, height: int, width: int) -> str:
+  file_name = os.path.join(tf.compat.v1.test.get_temp_dir(), f'{video_type.name.lower()}_{height}x{width}.mp4')
+  if not os.path.exists(file_name):
+    stereo_video(file_name, FLAGS.num_frames, height, width, video_type)
+  return file_name
+
+
+class InputPipelineBenchmark(tf.test.Benchmark):
+
+  def _video(self) -> str:
+    return FLAGS.video or _synthetic_video(VideoType.LR3D, 1080, 960)
+
+  def _run(self, name: str, dataset: tf.data.Dataset):
+    # frames per second through the whole pipeline, as the model reads it, decode included
+    start, num_frames = time.time(), 0
+    for features in dataset:
+      num_frames += int(features['left'].shape[0])
+    wall_time = time.time() - start
+    self.report_benchmark(iters=num_frames, wall_time=wall_time / max(num_frames, 1), name=name,
+                          extras={'frames_per_second': num_frames / wall_time})
+
+  def benchmark_frame_generator(self):
+    generator = FrameGenerator(self._video())
+
+    def map_fn(features):
+      return {key: tf.cast(value, dtype=tf.float32) / 255.0 for key, value in features.items()}
+
+    dataset = tf.data.Dataset.from_generator(generator=generator, output_signature=generator.signature)
+    self._run('frame_generator', dataset.map(map_fn).batch(batch_size=BATCH))
+
+  def benchmark_raw_frame_generator(self):
+    def map_fn(features):
+      return {key: tf.cast(value, dtype=tf.float32) / 255.0 for key, value in features.items()}
+
+    dataset = RawFrameGenerator(self._video()).dataset(batch_size=BATCH, drop_remainder=False)
+    self._run('raw_frame_generator', dataset.map(map_fn, num_parallel_calls=tf.data.AUTOTUNE))
+
+  def benchmark_frame_generator_sweep(self):
+    # side by side and top and bottom movies, resized to the same 256x224 views
+    for video_type, resize in [(VideoType.LR3D, Shape(256, 448)), (VideoType.UD3D, Shape(512, 224))]:
+      for height, width in EYES:
+        generator = FrameGenerator(_synthetic_video(video_type, height, width), video_type=video_type,
+                                   resize=resize)
+        dataset = tf.data.Dataset.from_generator(generator=generator, output_signature=generator.signature)
+        self._run(f'frame_generator_{video_type.name.lower()}_{height}x{width}', dataset.batch(batch_size=BATCH))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import tensorflow as tf
+
+from deep3d.data import FrameGenerator, ParallelFrameGenerator, RawFrameGenerator, VideoType, OriginType
+from deep3d.synthetic import stereo_video
+
+
+class FrameGeneratorTest(tf.test.TestCase):
+    def test_parallel_frame_generator(self):
+        file_name = os.path.join(self.get_temp_dir(), 'video.avi')
+        stereo_video(file_name, 23, height=64, width=64, fourcc='MJPG')
+        for video_type in [VideoType.LR3D, VideoType.UD3D]:
+            kwargs = dict(video_type=video_type, num_epoch=2, origin_type=OriginType.COLOR)
+            with FrameGenerator(file_name, **kwargs) as generator:
+                expected = list(generator)
+            # segments of 5 frames over 2 workers: every segment boundary and the epoch boundary change worker, and
+            # the queues hold fewer frames than a segment
+            with ParallelFrameGenerator(file_name, num_workers=2, segment_frames=5, queue_frames=2,
+                                        **kwargs) as generator:
+                frames = list(generator)
+
+            self.assertEqual(len(expected), 46)
+            self.assertEqual(len(frames), len(expected))
+            for frame, expected_frame in zip(frames, expected):
+                for key in expected_frame:
+                    self.assertAllEqual(frame[key], expected_frame[key])
+
+    def test_raw_frame_generator(self):
+        file_name = os.path.join(self.get_temp_dir(), 'video.avi')
+        stereo_video(file_name, 23, height=64, width=64, fourcc='MJPG')
+        for video_type, origin_type in [(VideoType.LR3D, OriginType.COLOR), (VideoType.UD3D, OriginType.GRAY)]:
+            kwargs = dict(video_type=video_type, num_epoch=2, origin_type=origin_type)
+            with FrameGenerator(file_name, **kwargs) as generator:
+                expected = list(generator)
+            # batches of 4 over 46 frames: the temporal stack crosses batch and epoch boundaries and the last batch
+            # is partial
+            generator = RawFrameGenerator(file_name, **kwargs)
+            batches = list(generator.dataset(batch_size=4, drop_remainder=False).as_numpy_iterator())
+
+            self.assertEqual(sum(len(batch['left']) for batch in batches), len(expected))
+            for key in ['origin', 'left', 'right', 'feature']:
+                values = np.concatenate([batch[key] for batch in batches], axis=0)
+                expected_values = np.stack([frame[key] for frame in expected], axis=0)
+                self.assertEqual(values.shape, expected_values.shape)
+                # the gray conversion and the bilinear resize each round differently from cv2 by up to one level
+                self.assertAllClose(values.astype(np.int32), expected_values.astype(np.int32), atol=2, rtol=0)
+
+    def test_shard(self):
+        file_name = os.path.join(self.get_temp_dir(), 'video.avi')
+        stereo_video(file_name, 23, height=64, width=64, fourcc='MJPG')
+        with FrameGenerator(file_name, num_epoch=2) as generator:
+            expected = list(generator)[:23]
+        # 3 shards of 7, 8 and 8 frames, each one read for the 2 epochs on its own
+        for reader in [FrameGenerator(file_name, num_epoch=2),
+                       ParallelFrameGenerator(file_name, num_epoch=2, num_workers=2, segment_frames=5)]:
+            shards = [list(reader.shard(3, index)) for index in range(3)]
+            self.assertEqual([len(shard) for shard in shards], [14, 16, 16])
+            frames = sum([shard[:len(shard) // 2] for shard in shards], [])
+            for frame, expected_frame in zip(frames, expected):
+                self.assertAllEqual(frame['origin'], expected_frame['origin'])
+                self.assertAllEqual(frame['right'], expected_frame['right'])
+            # the second epoch of a shard repeats its frames
+            self.assertAllEqual(shards[1][8]['origin'], shards[1][0]['origin'])
+            # the shards do not change the movie the generator reads
+            self.assertLen(list(reader), 46)
+
+    def test_seek(self):
+        file_name = os.path.join(self.get_temp_dir(), 'video.avi')
+        stereo_video(file_name, 23, height=64, width=64, fourcc='MJPG')
+        with FrameGenerator(file_name) as generator:
+            expected = list(generator)[10:]
+        with FrameGenerator(file_name) as generator:
+            next(generator)
+            frames = list(generator.seek(10))
+        self.assertLen(frames, 13)
+        # the temporal context is the one of reading from the start
+        for frame, expected_frame in zip(frames, expected):
+            self.assertAllEqual(frame['feature'], expected_frame['feature'])
+            self.assertAllEqual(frame['origin'], expected_frame['origin'])
+
+
+if __name__ == '__main__':
+    tf.test.main()
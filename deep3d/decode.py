@@ -0,0 +1,96 @@
+# cv2/numpy only: shared by FrameGenerator and the ParallelFrameGenerator decoder processes
+import cv2
+import multiprocessing
+from enum import Enum
+import numpy as np
+from collections import namedtuple
+
+
+class VideoType(Enum):
+  SIMPLE = 1
+  LR3D = 2
+  UD3D = 3
+
+
+class OriginType(Enum):
+  GRAY = 1
+  COLOR = 2
+
+
+Shape = namedtuple("Shape", 'high width')
+
+
+def frame_size(view: Shape, video_type: VideoType) -> Shape:
+  """The resize of a full frame of `video_type` that splits into views of `view` size."""
+  if video_type == VideoType.LR3D:
+    return Shape(view.high, 2 * view.width)
+  elif video_type == VideoType.UD3D:
+    return Shape(2 * view.high, view.width)
+  return view
+
+
+def view_size(resize: Shape, video_type: VideoType) -> Shape:
+  """The views a full frame of `video_type` resized to `resize` splits into, the inverse of frame_size."""
+  if video_type == VideoType.LR3D:
+    return Shape(resize.high, resize.width // 2)
+  elif video_type == VideoType.UD3D:
+    return Shape(resize.high // 2, resize.width)
+  return resize
+
+
+def split_frame(frame: np.ndarray, video_type: VideoType, origin_type: OriginType, resize: Shape):
+  """Cut one decoded BGR frame into the full resolution origin and the resized gray left/right views."""
+  gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+  if origin_type == OriginType.COLOR:
+    if video_type == VideoType.SIMPLE:
+      origin = frame
+    elif video_type == VideoType.LR3D:
+      split = int(frame.shape[1] / 2)
+      origin = frame[:, :split, :]
+    else:
+      split = int(frame.shape[0] / 2)
+      origin = frame[:split, :, :]
+  else:
+    if video_type == VideoType.SIMPLE:
+      origin = np.expand_dims(gray, axis=2)
+    elif video_type == VideoType.LR3D:
+      split = int(frame.shape[1] / 2)
+      origin = np.expand_dims(gray[:, :split], axis=2)
+    else:
+      split = int(frame.shape[0] / 2)
+      origin = np.expand_dims(gray[:split, :], axis=2)
+
+  gray = cv2.resize(gray, dsize=(resize.width, resize.high))
+  inner_high, inner_width = gray.shape
+
+  if video_type == VideoType.LR3D:
+    split = int(inner_width / 2)
+    left, right = gray[:, :split], gray[:, split:inner_width]
+  elif video_type == VideoType.UD3D:
+    split = int(inner_high / 2)
+    left, right = gray[:split, :], gray[split:inner_high, :]
+  else:
+    left, right = gray, gray.copy()
+  return origin, left, right
+
+
+def decode_segments(video_file_name: str, video_type: VideoType, origin_type: OriginType, resize: Shape,
+                    segments, frames: multiprocessing.Queue):
+  # runs in a decoder process: the [start, stop) segments are decoded in order, each one closed by a None
+  vc = cv2.VideoCapture(video_file_name)
+  position = 0
+  try:
+    for start, stop in segments:
+      if position != start:
+        vc.set(cv2.CAP_PROP_POS_FRAMES, start)
+        position = start
+      while stop is None or position < stop:
+        ret, frame = vc.read()
+        if not ret:
+          position = None
+          break
+        frames.put(split_frame(frame, video_type, origin_type, resize))
+        position += 1
+      frames.put(None)
+  finally:
+    vc.release()
@@ -3,31 +3,99 @@ import tensorflow as tf
 from tensorflow.python.framework import ops
 from tensorflow.python.framework import load_library
 
+from deep3d import deep_dot_tf
+
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
-deep_dot_lib = load_library.load_op_library('deep3d/tf_deep_dot.so')
+try:
+    deep_dot_lib = load_library.load_op_library('deep3d/tf_deep_dot.so')
+except (tf.errors.NotFoundError, OSError):
+    deep_dot_lib = None
+
+# 'op' runs the custom op, 'tf' the plain tf ops of deep_dot_tf.py, which jit_compile=True can compile and which
+# needs no .so. DEEP3D_DEEP_DOT picks one per deployment, without it the op is used when it could be loaded
+IMPLEMENTATION = os.environ.get('DEEP3D_DEEP_DOT', 'op' if deep_dot_lib is not None else 'tf')
+if IMPLEMENTATION not in ('op', 'tf'):
+    raise ValueError(f"DEEP3D_DEEP_DOT must be 'op' or 'tf', not {IMPLEMENTATION!r}")
+if IMPLEMENTATION == 'op' and deep_dot_lib is None:
+    raise ImportError('DEEP3D_DEEP_DOT=op, but deep3d/tf_deep_dot.so could not be loaded')
+
+
+def deep_dot(origin: tf.Tensor, kernel: tf.Tensor, kernel_size: int,
+             interpolation: str = 'nearest') -> tf.Tensor:
+    # kernel may be coarser than origin, it is sampled with `interpolation` ('nearest' or 'bilinear')
+    if IMPLEMENTATION == 'tf':
+        return deep_dot_tf.deep_dot(origin, kernel, kernel_size, interpolation)
+    return deep_dot_lib.deep_dot(origin=origin, kernel=kernel, kernel_size=kernel_size,
+                                 interpolation=interpolation)
+
+
+def softmax_deep_dot(origin: tf.Tensor, logits: tf.Tensor, kernel_size: int,
+                     interpolation: str = 'nearest') -> tf.Tensor:
+    # deep_dot(origin, softmax(logits, axis=-1)) in one pass, the probabilities are never materialized
+    if IMPLEMENTATION == 'tf':
+        return deep_dot_tf.softmax_deep_dot(origin, logits, kernel_size, interpolation)
+    return deep_dot_lib.softmax_deep_dot(origin=origin, logits=logits, kernel_size=kernel_size,
+                                         interpolation=interpolation)
+
 
+def quantized_deep_dot(origin: tf.Tensor, kernel: tf.Tensor, kernel_size: int,
+                       interpolation: str = 'nearest', softmax: bool = False,
+                       out_type: tf.DType = tf.float32, scale: float = 1.0 / 255,
+                       row_offset: int = 0, full_height: int = 0) -> tf.Tensor:
+    # origin is uint8 and dequantized by `scale` inside the op; a uint8 out_type keeps the 0-255 range
+    # and rounds straight into the output. With softmax, kernel holds logits as in softmax_deep_dot.
+    # A full_height > 0 makes origin the rows from row_offset of a full_height image, see tiling.py
+    if IMPLEMENTATION == 'tf':
+        return deep_dot_tf.quantized_deep_dot(origin, kernel, kernel_size, interpolation, softmax, out_type, scale,
+                                              row_offset, full_height)
+    return deep_dot_lib.quantized_deep_dot(origin=origin, kernel=kernel, kernel_size=kernel_size,
+                                           interpolation=interpolation, softmax=softmax,
+                                           out_type=out_type, scale=scale,
+                                           row_offset=row_offset, full_height=full_height)
 
-def deep_dot(origin: tf.Tensor, kernel: tf.Tensor, kernel_size: int) -> tf.Tensor:
-    return deep_dot_lib.deep_dot(origin=origin, kernel=kernel, kernel_size=kernel_size)
+
+ops.NotDifferentiable('QuantizedDeepDot')
 
 
 @ops.RegisterGradient('DeepDot')
 def _deep_dot_grad(op, grad):
     origin, kernel = op.inputs[0], op.inputs[1]
     kernel_size = op.get_attr('kernel_size')
+    interpolation = op.get_attr('interpolation')
 
     [grad_origin, grad_kernel] = deep_dot_lib.grad_deep_dot(
-        grad_composed=grad, origin=origin, kernel=kernel, kernel_size=kernel_size)
+        grad_composed=grad, origin=origin, kernel=kernel, kernel_size=kernel_size,
+        interpolation=interpolation)
     return [grad_origin, grad_kernel]
 
 
-@tf.custom_gradient
+@ops.RegisterGradient('SoftmaxDeepDot')
+def _softmax_deep_dot_grad(op, grad):
+    origin, logits = op.inputs[0], op.inputs[1]
+    kernel_size = op.get_attr('kernel_size')
+    interpolation = op.get_attr('interpolation')
+
+    [grad_origin, grad_logits] = deep_dot_lib.grad_softmax_deep_dot(
+        grad_composed=grad, origin=origin, logits=logits, kernel_size=kernel_size,
+        interpolation=interpolation)
+    return [grad_origin, grad_logits]
+
+
 def deep_fuse(origin: tf.Tensor = None, kernel: tf.Tensor = None, kernel_size: int = None):
-    composed = deep_dot_lib.deep_dot(origin=origin, kernel=kernel, kernel_size=kernel_size)
+    # without the op tf differentiates the plain tf DeepDot itself
+    if IMPLEMENTATION == 'tf':
+        return deep_dot_tf.deep_dot(origin, kernel, kernel_size)
+
+    # kernel_size is closed over, custom_gradient wants a gradient for every argument of the function
+    @tf.custom_gradient
+    def fuse(origin: tf.Tensor, kernel: tf.Tensor):
+        composed = deep_dot_lib.deep_dot(origin=origin, kernel=kernel, kernel_size=kernel_size)
+
+        def grad(dy: tf.Tensor = None):
+            [grad_origin, grad_kernel] = deep_dot_lib.grad_deep_dot(
+                grad_composed=dy, origin=origin, kernel=kernel, kernel_size=kernel_size)
+            return [grad_origin, grad_kernel]
 
-    def grad(dy: tf.Tensor = None):
-        [grad_origin, grad_kernel] = deep_dot_lib.grad_deep_dot(
-            grad_composed=dy, origin=origin, kernel=kernel, kernel_size=kernel_size)
-        return [grad_origin, grad_kernel]
+        return composed, grad
 
-    return composed, grad
+    return fuse(origin, kernel)
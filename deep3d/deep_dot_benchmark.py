@@ -0,0 +1,142 @@
+import os
+import time
+import tensorflow as tf
+from absl import logging
+
+from deep3d import deep_dot_tf
+from deep3d.deep_dot import deep_dot_lib
+
+# the shapes the model actually runs: one 256x224 eye, depth_ks=4, batch 64
+BATCH, HEIGHT, WIDTH, DEPTH_KS = 64, 256, 224, 4
+# one eye of a 1080p side-by-side movie, the origin that origin_pred is computed on in PREDICT
+ORIGIN_HEIGHT, ORIGIN_WIDTH = 1080, 960
+# what the sweep covers, the view resolutions are half, one and two times the one of the model
+SWEEP_BATCHES = [1, 8]
+SWEEP_RESOLUTIONS = [(128, 112), (256, 224), (512, 448)]
+SWEEP_KERNEL_SIZES = [2, 4, 6]
+SWEEP_ITERS = 5
+
+
+def _implementations():
+  # the custom op against the shifts and einsum of deep_dot_tf, as they are and compiled by XLA
+  forward = {'tf': deep_dot_tf.deep_dot, 'tf_xla': tf.function(deep_dot_tf.deep_dot, jit_compile=True)}
+  if deep_dot_lib is not None:
+    forward['op'] = lambda origin, kernel, kernel_size: deep_dot_lib.deep_dot(
+      origin=origin, kernel=kernel, kernel_size=kernel_size)
+
+  def grad(deep_dot_fn):
+    # one tensor that needs both gradients, so neither is pruned from what is run
+    def grad_fn(origin, kernel, kernel_size):
+      grad_origin, grad_kernel = tf.gradients(deep_dot_fn(origin, kernel, kernel_size), [origin, kernel])
+      return tf.reduce_sum(grad_origin) + tf.reduce_sum(grad_kernel)
+    return grad_fn
+
+  implementations = dict(forward)
+  implementations.update({f'grad_{name}': grad(fn) for name, fn in forward.items()})
+  return implementations
+
+
+def _op_missing(name: str) -> bool:
+  # the rows of the custom op need tf_deep_dot.so, benchmark_deep_dot_implementations still compares the tf ones
+  if deep_dot_lib is None:
+    logging.warning(f'deep3d/tf_deep_dot.so is not built, skipping {name}')
+    return True
+  return False
+
+
+def _thread_counts():
+  counts, n = [], 1
+  while n < (os.cpu_count() or 1):
+    counts.append(n)
+    n *= 2
+  counts.append(os.cpu_count() or 1)
+  return counts
+
+
+class DeepDotBenchmark(tf.test.Benchmark):
+
+  def _run(self, name: str, num_threads: int, build_fn,
+           origin_shape=(BATCH, HEIGHT, WIDTH, 1),
+           kernel_shape=(BATCH, HEIGHT, WIDTH, DEPTH_KS ** 2)):
+    config = tf.compat.v1.ConfigProto(intra_op_parallelism_threads=num_threads,
+                                      inter_op_parallelism_threads=1)
+    with tf.Graph().as_default(), tf.compat.v1.Session(config=config) as sess:
+      origin = tf.Variable(tf.random.uniform(shape=origin_shape))
+      kernel = tf.Variable(tf.nn.softmax(tf.random.uniform(shape=kernel_shape)))
+      sess.run(tf.compat.v1.global_variables_initializer())
+      # run the op node itself, a tf.group over its unused outputs gets pruned by grappler
+      op = tf.nest.flatten(build_fn(origin, kernel))[0].op
+      return self.run_op_benchmark(sess, op, min_iters=5,
+                                   name=f'{name}_threads_{num_threads}',
+                                   extras={'num_threads': num_threads})
+
+  def _sweep(self, name: str, build_fn):
+    # every batch, resolution and kernel_size on all the threads, reported in frames per second
+    for batch in SWEEP_BATCHES:
+      for height, width in SWEEP_RESOLUTIONS:
+        for kernel_size in SWEEP_KERNEL_SIZES:
+          with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+            origin = tf.Variable(tf.random.uniform(shape=(batch, height, width, 1)))
+            kernel = tf.Variable(tf.nn.softmax(tf.random.uniform(shape=(batch, height, width, kernel_size ** 2))))
+            sess.run(tf.compat.v1.global_variables_initializer())
+            op = tf.nest.flatten(build_fn(origin, kernel, kernel_size))[0].op
+            sess.run(op)
+            start = time.time()
+            for _ in range(SWEEP_ITERS):
+              sess.run(op)
+            wall_time = (time.time() - start) / SWEEP_ITERS
+          self.report_benchmark(iters=SWEEP_ITERS, wall_time=wall_time,
+                                name=f'{name}_batch_{batch}_{height}x{width}_ks_{kernel_size}',
+                                extras={'frames_per_second': batch / wall_time, 'batch': batch, 'height': height,
+                                        'width': width, 'kernel_size': kernel_size})
+
+  def benchmark_deep_dot_sweep(self):
+    if _op_missing('deep_dot_sweep'):
+      return
+    self._sweep('deep_dot', lambda origin, kernel, kernel_size: deep_dot_lib.deep_dot(
+      origin=origin, kernel=kernel, kernel_size=kernel_size))
+
+  def benchmark_grad_deep_dot_sweep(self):
+    if _op_missing('grad_deep_dot_sweep'):
+      return
+    self._sweep('grad_deep_dot', lambda origin, kernel, kernel_size: deep_dot_lib.grad_deep_dot(
+      grad_composed=tf.ones_like(origin), origin=origin, kernel=kernel, kernel_size=kernel_size))
+
+  def benchmark_deep_dot_implementations(self):
+    # which DeepDot to deploy, see DEEP3D_DEEP_DOT in deep_dot.py
+    for name, build_fn in _implementations().items():
+      self._run(f'deep_dot_implementation_{name}', os.cpu_count() or 1,
+                lambda origin, kernel: build_fn(origin, kernel, DEPTH_KS))
+
+  def benchmark_deep_dot(self):
+    if _op_missing('deep_dot'):
+      return
+    for num_threads in _thread_counts():
+      self._run('deep_dot', num_threads,
+                lambda origin, kernel: deep_dot_lib.deep_dot(origin=origin, kernel=kernel,
+                                                             kernel_size=DEPTH_KS))
+
+  def benchmark_deep_dot_origin_1080p(self):
+    # color origin at full resolution with the kernel stretched from the 256x224 grid
+    if _op_missing('deep_dot_origin_1080p'):
+      return
+    self._run('deep_dot_origin_1080p', 1,
+              lambda origin, kernel: deep_dot_lib.deep_dot(origin=origin, kernel=kernel,
+                                                           kernel_size=DEPTH_KS),
+              origin_shape=(8, ORIGIN_HEIGHT, ORIGIN_WIDTH, 3),
+              kernel_shape=(8, HEIGHT, WIDTH, DEPTH_KS ** 2))
+
+  def benchmark_grad_deep_dot(self):
+    if _op_missing('grad_deep_dot'):
+      return
+
+    def build_fn(origin, kernel):
+      return deep_dot_lib.grad_deep_dot(grad_composed=tf.ones_like(origin), origin=origin,
+                                        kernel=kernel, kernel_size=DEPTH_KS)
+
+    for num_threads in _thread_counts():
+      self._run('grad_deep_dot', num_threads, build_fn)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -2,12 +2,44 @@ import logging
 import numpy as np
 import tensorflow as tf
 
-from deep3d.deep_dot import deep_dot, deep_dot_lib
+from deep3d.deep_dot import deep_dot, deep_dot_lib, deep_fuse, softmax_deep_dot, quantized_deep_dot
 
 logger = tf.get_logger()
 logger.setLevel(logging.INFO)
 
 
+def deep_dot_reference(origin: tf.Tensor, kernel: tf.Tensor, kernel_size: int) -> tf.Tensor:
+    # the same shift-and-sum written with plain tf ops, so autodiff gives an independent gradient
+    height, width = origin.shape[1], origin.shape[2]
+    start = -(kernel_size // 2)
+    padded = tf.pad(origin, [(0, 0), (-start, kernel_size + start), (-start, kernel_size + start), (0, 0)])
+    composed = tf.zeros_like(origin)
+    for i in range(kernel_size):
+        for j in range(kernel_size):
+            depth = kernel_size * i + j
+            composed += padded[:, i:i + height, j:j + width, :] * kernel[:, :, :, depth:depth + 1]
+    return composed
+
+
+def resize_kernel_reference(kernel: tf.Tensor, height: int, width: int, interpolation: str) -> tf.Tensor:
+    # samples the kernel at every origin position the way DeepDot does, with gathers autodiff can follow
+    def lookup(size, kernel_size):
+        scale = 1.0 if size == kernel_size else kernel_size / size
+        if interpolation == 'nearest':
+            lower = (np.arange(size) * scale).astype(np.int64)
+            return lower, lower, np.zeros(size, dtype=np.float32)
+        source = np.clip((np.arange(size) + 0.5) * scale - 0.5, 0, kernel_size - 1)
+        lower = source.astype(np.int64)
+        return lower, np.minimum(lower + 1, kernel_size - 1), (source - lower).astype(np.float32)
+
+    lower, upper, fraction = lookup(height, kernel.shape[1])
+    fraction = fraction[None, :, None, None]
+    kernel = tf.gather(kernel, lower, axis=1) * (1 - fraction) + tf.gather(kernel, upper, axis=1) * fraction
+    lower, upper, fraction = lookup(width, kernel.shape[2])
+    fraction = fraction[None, None, :, None]
+    return tf.gather(kernel, lower, axis=2) * (1 - fraction) + tf.gather(kernel, upper, axis=2) * fraction
+
+
 class DeepDotTest(tf.test.TestCase):
 
     def test_deep_dot(self):
@@ -108,9 +140,134 @@ class DeepDotTest(tf.test.TestCase):
                                     0, 2, 0, 1,  # 0  -> 0
                                     ],
                              shape=(1, 5, 5, 4), dtype=tf.dtypes.float32)
+        if deep_dot_lib is None:
+            self.skipTest('deep3d/tf_deep_dot.so is not built, GradDeepDot is an op of it')
         grad_origin, grad_kernel = deep_dot_lib.grad_deep_dot(
             grad_composed=grad, origin=origin, kernel=kernel, kernel_size=2)
-        print(grad_origin)
+        # origin[0, 0] only reaches composed[0, 0] and composed[1, 1], through the kernel weights 1, 1 and 1
+        self.assertAllClose(grad_origin[0, 0, 0, 0], 3.0)
+
+        with tf.GradientTape() as tape:
+            tape.watch([origin, kernel])
+            composed = deep_dot_reference(origin, kernel, 2)
+        expected_origin, expected_kernel = tape.gradient(composed, [origin, kernel], output_gradients=grad)
+        self.assertAllClose(grad_origin, expected_origin, rtol=1e-6, atol=1e-6)
+        self.assertAllClose(grad_kernel, expected_kernel, rtol=1e-6, atol=1e-6)
+
+    def test_deep_fuse(self):
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.uniform(size=(2, 9, 7, 3)), dtype=tf.float32)
+        kernel = tf.constant(rng.uniform(size=(2, 9, 7, 9)), dtype=tf.float32)
+        with tf.GradientTape(persistent=True) as tape:
+            tape.watch([origin, kernel])
+            composed = deep_fuse(origin, kernel, kernel_size=3)
+            expected = deep_dot_reference(origin, kernel, 3)
+        self.assertAllClose(composed, expected, rtol=1e-5, atol=1e-5)
+        for actual, reference in zip(tape.gradient(composed, [origin, kernel]),
+                                     tape.gradient(expected, [origin, kernel])):
+            self.assertAllClose(actual, reference, rtol=1e-5, atol=1e-5)
+
+    def test_deep_dot_sharded(self):
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.uniform(size=(3, 17, 11, 3)), dtype=tf.float32)
+        kernel = tf.constant(rng.uniform(size=(3, 17, 11, 16)), dtype=tf.float32)
+        composed = deep_dot(origin, kernel, kernel_size=4)
+        self.assertAllClose(composed, deep_dot_reference(origin, kernel, 4), rtol=1e-5, atol=1e-5)
+
+    def test_deep_dot_grad_sharded(self):
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.uniform(size=(3, 17, 11, 3)), dtype=tf.float32)
+        kernel = tf.constant(rng.uniform(size=(3, 17, 11, 9)), dtype=tf.float32)
+        grad = tf.constant(rng.uniform(size=(3, 17, 11, 3)), dtype=tf.float32)
+        if deep_dot_lib is None:
+            self.skipTest('deep3d/tf_deep_dot.so is not built, GradDeepDot is an op of it')
+        grad_origin, grad_kernel = deep_dot_lib.grad_deep_dot(
+            grad_composed=grad, origin=origin, kernel=kernel, kernel_size=3)
+
+        with tf.GradientTape() as tape:
+            tape.watch([origin, kernel])
+            composed = deep_dot_reference(origin, kernel, 3)
+        expected_origin, expected_kernel = tape.gradient(composed, [origin, kernel], output_gradients=grad)
+        self.assertAllClose(grad_origin, expected_origin, rtol=1e-5, atol=1e-5)
+        self.assertAllClose(grad_kernel, expected_kernel, rtol=1e-5, atol=1e-5)
+
+    def test_deep_dot_grad_resized(self):
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.uniform(size=(2, 23, 19, 3)), dtype=tf.float32)
+        kernel = tf.constant(rng.uniform(size=(2, 6, 5, 16)), dtype=tf.float32)
+        grad = tf.constant(rng.uniform(size=(2, 23, 19, 3)), dtype=tf.float32)
+        for interpolation in ['nearest', 'bilinear']:
+            with tf.GradientTape(persistent=True) as tape:
+                tape.watch([origin, kernel])
+                composed = deep_dot(origin, kernel, kernel_size=4, interpolation=interpolation)
+                expected = deep_dot_reference(
+                    origin, resize_kernel_reference(kernel, 23, 19, interpolation), 4)
+            self.assertAllClose(composed, expected, rtol=1e-5, atol=1e-5)
+            for actual, reference in zip(tape.gradient(composed, [origin, kernel], output_gradients=grad),
+                                         tape.gradient(expected, [origin, kernel], output_gradients=grad)):
+                self.assertAllClose(actual, reference, rtol=1e-4, atol=1e-4)
+
+    def test_deep_dot_numeric_gradient(self):
+        # the registered gradients against finite differences, for any change to the kernels of the ops
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.uniform(size=(2, 7, 6, 2)), dtype=tf.float32)
+        kernel = tf.constant(rng.uniform(size=(2, 7, 6, 9)), dtype=tf.float32)
+        for compose_fn in [lambda origin, kernel: deep_dot(origin, kernel, kernel_size=3),
+                           lambda origin, kernel: deep_dot(origin, kernel[:, :3, :4], kernel_size=3,
+                                                           interpolation='bilinear'),
+                           lambda origin, kernel: softmax_deep_dot(origin, kernel, kernel_size=3)]:
+            theoretical, numerical = tf.test.compute_gradient(compose_fn, [origin, kernel], delta=1e-2)
+            for actual, expected in zip(theoretical, numerical):
+                self.assertAllClose(actual, expected, rtol=1e-3, atol=1e-3)
+
+    def test_softmax_deep_dot(self):
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.uniform(size=(2, 23, 19, 3)), dtype=tf.float32)
+        grad = tf.constant(rng.uniform(size=(2, 23, 19, 3)), dtype=tf.float32)
+        for logits_shape in [(2, 23, 19, 16), (2, 6, 5, 16)]:
+            logits = tf.constant(rng.normal(scale=3, size=logits_shape), dtype=tf.float32)
+            for interpolation in ['nearest', 'bilinear']:
+                with tf.GradientTape(persistent=True) as tape:
+                    tape.watch([origin, logits])
+                    fused = softmax_deep_dot(origin, logits, kernel_size=4, interpolation=interpolation)
+                    unfused = deep_dot(origin, tf.nn.softmax(logits, axis=-1), kernel_size=4,
+                                       interpolation=interpolation)
+                self.assertAllClose(fused, unfused, rtol=1e-5, atol=1e-5)
+                for actual, expected in zip(tape.gradient(fused, [origin, logits], output_gradients=grad),
+                                            tape.gradient(unfused, [origin, logits], output_gradients=grad)):
+                    self.assertAllClose(actual, expected, rtol=1e-4, atol=1e-5)
+
+    def test_deep_dot_low_precision(self):
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.uniform(size=(2, 23, 19, 3)), dtype=tf.float32)
+        logits = tf.constant(rng.normal(size=(2, 6, 5, 16)), dtype=tf.float32)
+        grad = tf.constant(rng.uniform(size=(2, 23, 19, 3)), dtype=tf.float32)
+        with tf.GradientTape() as tape:
+            tape.watch([origin, logits])
+            expected = softmax_deep_dot(origin, logits, kernel_size=4)
+        expected_grads = tape.gradient(expected, [origin, logits], output_gradients=grad)
+
+        for dtype, tolerance in [(tf.float16, 1e-2), (tf.bfloat16, 5e-2)]:
+            low = [tf.cast(tensor, dtype) for tensor in [origin, logits, grad]]
+            with tf.GradientTape() as tape:
+                tape.watch(low[:2])
+                composed = softmax_deep_dot(low[0], low[1], kernel_size=4)
+            self.assertEqual(composed.dtype, dtype)
+            self.assertAllClose(tf.cast(composed, tf.float32), expected, rtol=tolerance, atol=tolerance)
+            for actual, reference in zip(tape.gradient(composed, low[:2], output_gradients=low[2]), expected_grads):
+                self.assertAllClose(tf.cast(actual, tf.float32), reference, rtol=tolerance, atol=tolerance)
+
+    def test_quantized_deep_dot(self):
+        rng = np.random.RandomState(0)
+        origin = tf.constant(rng.randint(0, 256, size=(2, 23, 19, 3)), dtype=tf.uint8)
+        logits = tf.constant(rng.normal(size=(2, 6, 5, 16)), dtype=tf.float32)
+        expected = softmax_deep_dot(tf.cast(origin, tf.float32) / 255.0, logits, kernel_size=4)
+
+        composed = quantized_deep_dot(origin, logits, kernel_size=4, softmax=True)
+        self.assertAllClose(composed, expected, rtol=1e-5, atol=1e-5)
+        composed = quantized_deep_dot(origin, tf.nn.softmax(logits), kernel_size=4, out_type=tf.uint8)
+        self.assertEqual(composed.dtype, tf.uint8)
+        self.assertAllClose(composed, tf.round(expected * 255.0), rtol=0, atol=1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+import tensorflow as tf
+from typing import Optional, Tuple
+
+
+def _size(tensor: tf.Tensor, axis: int):
+  # the static size when the graph knows it, which spares the lookups of a kernel as large as origin
+  return tensor.shape[axis] if tensor.shape[axis] is not None else tf.shape(tensor)[axis]
+
+
+def _lookup(size, kernel_size, bilinear: bool) -> Tuple[tf.Tensor, tf.Tensor, Optional[tf.Tensor]]:
+  # the kernel position of every origin position, computed in double like the ResizeMap of the op
+  scale = tf.where(tf.equal(size, kernel_size), tf.constant(1.0, tf.float64),
+                   tf.cast(kernel_size, tf.float64) / tf.cast(size, tf.float64))
+  position = tf.range(size, dtype=tf.float64)
+  if not bilinear:
+    lower = tf.cast(position * scale, tf.int32)
+    return lower, lower, None
+  source = tf.clip_by_value((position + 0.5) * scale - 0.5, 0.0, tf.cast(kernel_size, tf.float64) - 1.0)
+  lower = tf.cast(source, tf.int32)
+  return lower, tf.minimum(lower + 1, kernel_size - 1), tf.cast(source - tf.cast(lower, tf.float64), tf.float32)
+
+
+def _resize_axis(kernel: tf.Tensor, axis: int, lower: tf.Tensor, upper: tf.Tensor,
+                 fraction: Optional[tf.Tensor]) -> tf.Tensor:
+  lower_kernel = tf.gather(kernel, lower, axis=axis)
+  if fraction is None:
+    return lower_kernel
+  fraction = tf.reshape(fraction, [-1 if i == axis else 1 for i in range(4)])
+  return (1 - fraction) * lower_kernel + fraction * tf.gather(kernel, upper, axis=axis)
+
+
+def resize_kernel(kernel: tf.Tensor, height, width, interpolation: str = 'nearest',
+                  row_offset: int = 0, full_height: int = 0) -> tf.Tensor:
+  """Samples `kernel` at every position of a `height` x `width` origin, rows first, the way DeepDot does.
+
+  A full_height > 0 samples the rows of a full_height image and keeps the `height` ones from row_offset.
+  """
+  bilinear = interpolation == 'bilinear'
+  if full_height > 0:
+    lookup = _lookup(full_height, _size(kernel, 1), bilinear)
+    kernel = _resize_axis(kernel, 1, *[None if x is None else x[row_offset:row_offset + height] for x in lookup])
+  elif not isinstance(height, int) or height != kernel.shape[1]:
+    kernel = _resize_axis(kernel, 1, *_lookup(height, _size(kernel, 1), bilinear))
+  if not isinstance(width, int) or width != kernel.shape[2]:
+    kernel = _resize_axis(kernel, 2, *_lookup(width, _size(kernel, 2), bilinear))
+  return kernel
+
+
+def shifts(origin: tf.Tensor, kernel_size: int) -> tf.Tensor:
+  """The kernel_size² shifts of `origin` the window of DeepDot covers, zero outside, as [b, h, w, ks², c].
+
+  Shift ks * i + j is origin moved by (i - ks // 2, j - ks // 2), which is the kernel depth that weights it.
+  """
+  start = kernel_size // 2
+  padding = [(0, 0), (start, kernel_size - 1 - start), (start, kernel_size - 1 - start), (0, 0)]
+  patches = tf.image.extract_patches(tf.pad(origin, padding), sizes=[1, kernel_size, kernel_size, 1],
+                                     strides=[1, 1, 1, 1], rates=[1, 1, 1, 1], padding='VALID')
+  return tf.reshape(patches, tf.concat([tf.shape(origin)[:3], [kernel_size ** 2, tf.shape(origin)[3]]], axis=0))
+
+
+def _compose(origin: tf.Tensor, kernel: tf.Tensor, kernel_size: int, interpolation: str, softmax: bool = False,
+             row_offset: int = 0, full_height: int = 0) -> tf.Tensor:
+  # all in float like the op, which accumulates in float whatever the tensor types are
+  kernel = tf.cast(kernel, tf.float32)
+  if softmax:
+    kernel = tf.nn.softmax(kernel, axis=-1)
+  kernel = resize_kernel(kernel, _size(origin, 1), _size(origin, 2), interpolation, row_offset, full_height)
+  return tf.einsum('bhwkc,bhwk->bhwc', shifts(origin, kernel_size), kernel)
+
+
+def deep_dot(origin: tf.Tensor, kernel: tf.Tensor, kernel_size: int, interpolation: str = 'nearest') -> tf.Tensor:
+  """DeepDot as padded shifts of `origin` weighted by the resized kernel in one einsum, built of plain tf ops.
+
+  It needs no custom op, so autodiff gives its gradient and the graph can be compiled with jit_compile=True, at the
+  cost of materializing the kernel_size² shifts of origin, which the op never does.
+  """
+  composed = _compose(tf.cast(origin, tf.float32), kernel, kernel_size, interpolation)
+  return tf.cast(composed, origin.dtype)
+
+
+def softmax_deep_dot(origin: tf.Tensor, logits: tf.Tensor, kernel_size: int,
+                     interpolation: str = 'nearest') -> tf.Tensor:
+  composed = _compose(tf.cast(origin, tf.float32), logits, kernel_size, interpolation, softmax=True)
+  return tf.cast(composed, origin.dtype)
+
+
+def quantized_deep_dot(origin: tf.Tensor, kernel: tf.Tensor, kernel_size: int, interpolation: str = 'nearest',
+                       softmax: bool = False, out_type: tf.DType = tf.float32, scale: float = 1.0 / 255,
+                       row_offset: int = 0, full_height: int = 0) -> tf.Tensor:
+  # a uint8 output stays in the 0-255 domain of origin and is rounded and saturated like the op stores it
+  if out_type == tf.uint8:
+    composed = _compose(tf.cast(origin, tf.float32), kernel, kernel_size, interpolation, softmax,
+                        row_offset, full_height)
+    return tf.cast(tf.clip_by_value(composed, 0.0, 255.0) + 0.5, tf.uint8)
+  composed = _compose(tf.cast(origin, tf.float32) * scale, kernel, kernel_size, interpolation, softmax,
+                      row_offset, full_height)
+  return tf.cast(composed, out_type)
@@ -0,0 +1,69 @@
+import numpy as np
+import tensorflow as tf
+
+from deep3d import deep_dot_tf
+from deep3d.deep_dot import deep_dot_lib
+
+
+class DeepDotTfTest(tf.test.TestCase):
+    # every case against the custom op, on an origin finer than the kernel so the resize is covered too
+
+    def setUp(self):
+        super(DeepDotTfTest, self).setUp()
+        if deep_dot_lib is None:
+            self.skipTest('deep3d/tf_deep_dot.so is not built, there is no op to compare with')
+        rng = np.random.RandomState(0)
+        self.origin = rng.uniform(size=(2, 23, 19, 3)).astype(np.float32)
+        self.logits = {kernel_size: rng.normal(size=(2, 9, 7, kernel_size ** 2)).astype(np.float32)
+                       for kernel_size in [2, 3, 4]}
+
+    def test_deep_dot(self):
+        for kernel_size, logits in self.logits.items():
+            kernel = tf.nn.softmax(logits)
+            for interpolation in ['nearest', 'bilinear']:
+                expected = deep_dot_lib.deep_dot(origin=self.origin, kernel=kernel, kernel_size=kernel_size,
+                                                 interpolation=interpolation)
+                composed = deep_dot_tf.deep_dot(self.origin, kernel, kernel_size, interpolation)
+                self.assertAllClose(composed, expected, atol=1e-6)
+                composed = deep_dot_tf.softmax_deep_dot(self.origin, logits, kernel_size, interpolation)
+                self.assertAllClose(composed, expected, atol=1e-6)
+
+    def test_deep_dot_grad(self):
+        origin = tf.constant(self.origin)
+        kernel = tf.nn.softmax(self.logits[4])
+        weights = tf.random.stateless_uniform(origin.shape, seed=(1, 2))
+        with tf.GradientTape() as tape:
+            tape.watch([origin, kernel])
+            composed = deep_dot_tf.deep_dot(origin, kernel, 4, 'bilinear')
+            loss = tf.reduce_sum(composed * weights)
+        grads = tape.gradient(loss, [origin, kernel])
+        expected = deep_dot_lib.grad_deep_dot(grad_composed=weights, origin=origin,
+                                              kernel=kernel, kernel_size=4, interpolation='bilinear')
+        self.assertAllClose(grads[0], expected[0], rtol=1e-5)
+        self.assertAllClose(grads[1], expected[1], rtol=1e-5)
+
+    def test_quantized_deep_dot(self):
+        origin = (self.origin * 255).astype(np.uint8)
+        logits = self.logits[4]
+        for out_type in [tf.float32, tf.uint8]:
+            expected = deep_dot_lib.quantized_deep_dot(origin=origin, kernel=logits, kernel_size=4,
+                                                       interpolation='bilinear', softmax=True, out_type=out_type)
+            composed = deep_dot_tf.quantized_deep_dot(origin, logits, 4, 'bilinear', softmax=True, out_type=out_type)
+            self.assertAllClose(composed, expected, atol=1 if out_type == tf.uint8 else 1e-6)
+
+        # a strip of rows samples the kernel like the whole image
+        expected = deep_dot_lib.quantized_deep_dot(origin=origin[:, 5:12], kernel=logits, kernel_size=4,
+                                                   softmax=True, row_offset=5, full_height=23)
+        composed = deep_dot_tf.quantized_deep_dot(origin[:, 5:12], logits, 4, softmax=True, row_offset=5,
+                                                  full_height=23)
+        self.assertAllClose(composed, expected, atol=1e-6)
+
+    def test_jit_compile(self):
+        kernel = tf.nn.softmax(self.logits[4])
+        compiled = tf.function(deep_dot_tf.deep_dot, jit_compile=True)
+        expected = deep_dot_lib.deep_dot(origin=self.origin, kernel=kernel, kernel_size=4, interpolation='bilinear')
+        self.assertAllClose(compiled(self.origin, kernel, 4, 'bilinear'), expected, atol=1e-6)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,143 @@
+import sys
+import csv
+import json
+import time
+import resource
+import threading
+import contextlib
+import tensorflow as tf
+from typing import Dict
+
+
+def peak_rss_mb() -> float:
+  # ru_maxrss is in kilobytes on linux and in bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+class Stage(object):
+  """Time a pipeline stage spends working and waiting, and the frames it handled.
+
+  With `trace` the work is also a tf.profiler trace annotation named after the stage, so it lines up with the
+  TensorFlow ops in a profile taken through the --profiler server.
+  """
+
+  def __init__(self, name: str, trace: bool = False):
+    self.name = name
+    self.trace = trace
+    self.frames = 0
+    self.busy = 0.0
+    self.waiting = 0.0
+
+  @contextlib.contextmanager
+  def work(self):
+    start = time.time()
+    with tf.profiler.experimental.Trace(self.name) if self.trace else contextlib.nullcontext():
+      yield
+    self.busy += time.time() - start
+
+  @contextlib.contextmanager
+  def wait(self):
+    start = time.time()
+    yield
+    self.waiting += time.time() - start
+
+  @property
+  def fps(self) -> float:
+    return self.frames / max(self.busy, 1e-6)
+
+  def as_dict(self) -> Dict:
+    return {'frames': self.frames, 'busy': self.busy, 'waiting': self.waiting, 'fps': self.fps}
+
+  def __str__(self):
+    return (f'{self.name}: {self.frames} frames, {self.busy:.1f}s busy ({self.fps:.1f} fps), '
+            f'{self.waiting:.1f}s waiting')
+
+
+class QueueDepth(object):
+  """Depth of a queue, sampled every time an item is put on it."""
+
+  def __init__(self, name: str):
+    self.name = name
+    self.samples = 0
+    self.total = 0
+    self.max = 0
+
+  def sample(self, depth: int):
+    self.samples += 1
+    self.total += depth
+    self.max = max(self.max, depth)
+
+  def as_dict(self) -> Dict:
+    return {'samples': self.samples, 'mean': self.total / max(self.samples, 1), 'max': self.max}
+
+
+class Instruments(object):
+  """The stages and queues of a job, reported with the wall time and peak RSS as JSON or CSV.
+
+  Stages are created on first use under their name, so the code doing the work does not need to be handed anything.
+  A slow stage with little waiting is the one that limits the job, the stages around it wait on it.
+  """
+
+  def __init__(self):
+    self.trace = False
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self._start = time.time()
+      self._stages, self._queues = {}, {}
+
+  def stage(self, name: str) -> Stage:
+    with self._lock:
+      if name not in self._stages:
+        self._stages[name] = Stage(name, trace=self.trace)
+      return self._stages[name]
+
+  def new_stage(self, name: str) -> Stage:
+    """A stage starting from zero, replacing any earlier one of the same name."""
+    with self._lock:
+      self._stages[name] = Stage(name, trace=self.trace)
+      return self._stages[name]
+
+  def sample_queue(self, name: str, depth: int):
+    with self._lock:
+      if name not in self._queues:
+        self._queues[name] = QueueDepth(name)
+      self._queues[name].sample(depth)
+
+  def report(self) -> Dict:
+    with self._lock:
+      return {
+        'wall_time': time.time() - self._start,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {name: stage.as_dict() for name, stage in self._stages.items()},
+        'queues': {name: depth.as_dict() for name, depth in self._queues.items()},
+      }
+
+  def __str__(self):
+    with self._lock:
+      return '; '.join(str(stage) for stage in self._stages.values())
+
+  def write(self, file_name: str):
+    """Writes the report as CSV when `file_name` ends with .csv, as JSON otherwise."""
+    report = self.report()
+    if not file_name.endswith('.csv'):
+      with open(file_name, 'w') as f:
+        json.dump(report, f, indent=2)
+      return
+    # one row per stage and queue, and one per job total with its value in the last column
+    with open(file_name, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(['kind', 'name', 'frames', 'busy', 'waiting', 'fps', 'mean_depth', 'max_depth', 'value'])
+      for name in ['wall_time', 'peak_rss_mb']:
+        writer.writerow(['job', name, '', '', '', '', '', '', report[name]])
+      for name, stage in report['stages'].items():
+        writer.writerow(['stage', name, stage['frames'], stage['busy'], stage['waiting'], stage['fps'], '', '', ''])
+      for name, depth in report['queues'].items():
+        writer.writerow(['queue', name, '', '', '', '', depth['mean'], depth['max'], ''])
+
+
+# the instruments of this process, what data, convert, utils and compose record into
+instruments = Instruments()
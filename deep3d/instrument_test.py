@@ -0,0 +1,53 @@
+import os
+import csv
+import json
+import time
+import tensorflow as tf
+
+from deep3d.instrument import Instruments
+
+
+class InstrumentTest(tf.test.TestCase):
+    def test_stage(self):
+        instruments = Instruments()
+        stage = instruments.stage('decode')
+        self.assertIs(instruments.stage('decode'), stage)
+        with stage.work():
+            time.sleep(0.05)
+        with stage.wait():
+            time.sleep(0.02)
+        stage.frames += 10
+        self.assertGreaterEqual(stage.busy, 0.05)
+        self.assertGreaterEqual(stage.waiting, 0.02)
+        self.assertAllClose(stage.fps, 10 / stage.busy)
+
+        # a new stage starts from zero
+        self.assertEqual(instruments.new_stage('decode').frames, 0)
+
+    def test_write(self):
+        instruments = Instruments()
+        with instruments.stage('encode').work():
+            pass
+        instruments.stage('encode').frames += 3
+        for depth in [1, 3, 2]:
+            instruments.sample_queue('decoded', depth)
+
+        json_file = os.path.join(self.get_temp_dir(), 'report.json')
+        instruments.write(json_file)
+        with open(json_file) as f:
+            report = json.load(f)
+        self.assertGreater(report['peak_rss_mb'], 0)
+        self.assertEqual(report['stages']['encode']['frames'], 3)
+        self.assertEqual(report['queues']['decoded'], {'samples': 3, 'mean': 2.0, 'max': 3})
+
+        csv_file = os.path.join(self.get_temp_dir(), 'report.csv')
+        instruments.write(csv_file)
+        with open(csv_file) as f:
+            rows = {row['name']: row for row in csv.DictReader(f)}
+        self.assertEqual(rows['peak_rss_mb']['kind'], 'job')
+        self.assertEqual(rows['encode']['frames'], '3')
+        self.assertEqual(rows['decoded']['max_depth'], '3')
+
+
+if __name__ == '__main__':
+    tf.test.main()
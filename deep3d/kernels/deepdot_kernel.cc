@@ -1,12 +1,221 @@
 #include "tensorflow/core/framework/op_kernel.h"
+#include "tensorflow/core/framework/types.h"
 #include "tensorflow/core/platform/threadpool.h"
+#include "tensorflow/core/util/work_sharder.h"
+#include "third_party/eigen3/Eigen/Core"
+
+#include <algorithm>
+#include <cmath>
+#include <type_traits>
+#include <vector>
 
 using namespace tensorflow;
 
+namespace {
+
+// Maps every origin row (or column) onto the kernel grid it is sampled from. Nearest keeps the
+// (int) (x * scale) truncation DeepDot has always used, bilinear samples at pixel centers like
+// tf.image.resize. A position reads lower[x] with weight 1 - fraction[x] and upper[x] with
+// weight fraction[x], nearest is the case where fraction[x] is always 0.
+struct ResizeMap {
+    std::vector<int> lower, upper;
+    std::vector<float> fraction;
+
+    ResizeMap(int origin_size, int kernel_size, bool bilinear)
+            : lower(origin_size), upper(origin_size), fraction(origin_size, 0.f) {
+        double scale = origin_size == kernel_size ? 1.0 : (1.0 * kernel_size / origin_size);
+        for (int x = 0; x < origin_size; ++x) {
+            if (bilinear) {
+                double source = std::min(std::max((x + 0.5) * scale - 0.5, 0.0), kernel_size - 1.0);
+                lower[x] = (int) source;
+                upper[x] = std::min(lower[x] + 1, kernel_size - 1);
+                fraction[x] = (float) (source - lower[x]);
+            } else {
+                lower[x] = upper[x] = (int) (x * scale);
+            }
+        }
+    }
+
+    // keeps the `size` positions from `first` on, for an origin that is a strip of a taller image
+    void Crop(int first, int size) {
+        lower.assign(lower.begin() + first, lower.begin() + first + size);
+        upper.assign(upper.begin() + first, upper.begin() + first + size);
+        fraction.assign(fraction.begin() + first, fraction.begin() + first + size);
+    }
+};
+
+// Softmax over the depth axis of every cell of a kernel row.
+void SoftmaxRow(const float *logits, int cells, int depth_size, float *probabilities) {
+    for (int cell = 0; cell < cells; ++cell) {
+        Eigen::Map<const Eigen::ArrayXf> logit(logits + (int64) cell * depth_size, depth_size);
+        Eigen::Map<Eigen::ArrayXf> probability(probabilities + (int64) cell * depth_size, depth_size);
+        probability = (logit - logit.maxCoeff()).exp();
+        probability /= probability.sum();
+    }
+}
+
+// Turns the gradient of a row of softmax probabilities into the gradient of its logits, in place.
+void SoftmaxGradRow(const float *logits, int cells, int depth_size, float *grad) {
+    Eigen::ArrayXf probability(depth_size);
+    for (int cell = 0; cell < cells; ++cell) {
+        SoftmaxRow(logits + (int64) cell * depth_size, 1, depth_size, probability.data());
+        Eigen::Map<Eigen::ArrayXf> grad_cell(grad + (int64) cell * depth_size, depth_size);
+        grad_cell = probability * (grad_cell - (probability * grad_cell).sum());
+    }
+}
+
+// Writes a row accumulated in float back to the tensor type, rounding and saturating for uint8.
+template <typename T>
+void StoreRow(const float *source, int64 size, T *target) {
+    for (int64 x = 0; x < size; ++x) target[x] = static_cast<T>(source[x]);
+}
+
+template <>
+void StoreRow<uint8>(const float *source, int64 size, uint8 *target) {
+    for (int64 x = 0; x < size; ++x) target[x] = (uint8) (std::min(std::max(source[x], 0.f), 255.f) + 0.5f);
+}
+
+// Rows of a tensor as float. All arithmetic runs in float, so half, bfloat16 and uint8 rows are
+// converted (and multiplied by `scale`) the first time they are read and kept in a small ring;
+// walking down the image converts every row about once. Float rows are used in place.
+template <typename T>
+class FloatRows {
+public:
+    FloatRows(const T *data, int64 row_size, int capacity, float scale = 1.f)
+            : data_(data), row_size_(row_size), scale_(scale), keys_(capacity, -1),
+              rows_(InPlace() ? 0 : (size_t) capacity * row_size) {}
+
+    const float *Get(int64 row) {
+        if (InPlace()) return reinterpret_cast<const float *>(data_) + row * row_size_;
+        const int slot = row % keys_.size();
+        float *converted = rows_.data() + (size_t) slot * row_size_;
+        if (keys_[slot] != row) {
+            const T *source = data_ + row * row_size_;
+            for (int64 x = 0; x < row_size_; ++x) converted[x] = static_cast<float>(source[x]) * scale_;
+            keys_[slot] = row;
+        }
+        return converted;
+    }
+
+private:
+    bool InPlace() const { return std::is_same<T, float>::value && scale_ == 1.f; }
+
+    const T *data_;
+    const int64 row_size_;
+    const float scale_;
+    std::vector<int64> keys_;
+    std::vector<float> rows_;
+};
+
+// The kernel weights of one origin row, transposed into one plane per depth and laid out like an
+// origin row (the weight repeated for every channel), so that a shift (i, j) of the window becomes
+// a single element-wise multiply-add over a contiguous span of the row. The planes only depend on
+// the kernel rows the origin row is sampled from, so consecutive origin rows that map to the same
+// kernel rows reuse them. With `softmax` the kernel holds logits, and each kernel row is
+// normalized when it is first read, so the probabilities never exist as a whole tensor.
+template <typename T>
+class KernelPlanes {
+public:
+    KernelPlanes(const T *kernel, int kernel_height, int kernel_width, int depth_size,
+                 const ResizeMap *rows, const ResizeMap *cols, int channel, bool softmax = false)
+            : kernel_rows_(kernel, (int64) kernel_width * depth_size, 2), kernel_height_(kernel_height),
+              kernel_width_(kernel_width), depth_size_(depth_size), rows_(rows), cols_(cols),
+              channel_(channel), row_size_((int) cols->lower.size() * channel), softmax_(softmax),
+              planes_((size_t) depth_size * row_size_), blended_((size_t) kernel_width * depth_size) {
+        if (softmax_)
+            for (auto &row : softmax_rows_) row.second.resize((size_t) kernel_width * depth_size);
+    }
+
+    // the plane of `depth` for row h of batch b
+    const float *Get(int b, int h, int depth) {
+        Build(b, h);
+        return planes_.data() + (size_t) depth * row_size_;
+    }
+
+private:
+    void Build(int b, int h) {
+        const int64 lower = (int64) b * kernel_height_ + rows_->lower[h];
+        const int64 upper = (int64) b * kernel_height_ + rows_->upper[h];
+        const float fraction = rows_->fraction[h];
+        if (lower == lower_ && upper == upper_ && fraction == fraction_) return;
+        lower_ = lower, upper_ = upper, fraction_ = fraction;
+
+        const int64 kernel_row_size = (int64) kernel_width_ * depth_size_;
+        const float *source = Row(lower);
+        if (fraction != 0.f) {
+            const float *source_upper = Row(upper);
+            Eigen::Map<Eigen::ArrayXf>(blended_.data(), kernel_row_size) =
+                    (1.f - fraction) * Eigen::Map<const Eigen::ArrayXf>(source, kernel_row_size) +
+                    fraction * Eigen::Map<const Eigen::ArrayXf>(source_upper, kernel_row_size);
+            source = blended_.data();
+        }
+
+        const int width = cols_->lower.size();
+        for (int w = 0; w < width; ++w) {
+            const float *left = source + (int64) cols_->lower[w] * depth_size_;
+            const float *right = source + (int64) cols_->upper[w] * depth_size_;
+            const float fraction_w = cols_->fraction[w];
+            for (int depth = 0; depth < depth_size_; ++depth) {
+                float weight = fraction_w == 0.f ? left[depth] :
+                               (1.f - fraction_w) * left[depth] + fraction_w * right[depth];
+                float *plane = planes_.data() + (size_t) depth * row_size_ + w * channel_;
+                for (int k = 0; k < channel_; ++k) plane[k] = weight;
+            }
+        }
+    }
+
+    // a kernel row, normalized first when the kernel holds logits; the two rows a bilinear row
+    // blends stay cached, so walking down the image normalizes every kernel row about once
+    const float *Row(int64 index) {
+        if (!softmax_) return kernel_rows_.Get(index);
+        for (auto &row : softmax_rows_)
+            if (row.first == index) return row.second.data();
+        auto &row = softmax_rows_[next_softmax_row_];
+        next_softmax_row_ = 1 - next_softmax_row_;
+        SoftmaxRow(kernel_rows_.Get(index), kernel_width_, depth_size_, row.second.data());
+        row.first = index;
+        return row.second.data();
+    }
+
+    FloatRows<T> kernel_rows_;
+    const int kernel_height_, kernel_width_, depth_size_;
+    const ResizeMap *rows_, *cols_;
+    const int channel_, row_size_;
+    const bool softmax_;
+    std::vector<float> planes_, blended_;
+    std::pair<int64, std::vector<float>> softmax_rows_[2] = {{-1, {}}, {-1, {}}};
+    int next_softmax_row_ = 0;
+    int64 lower_ = -1, upper_ = -1;
+    float fraction_ = -1.f;
+};
+
+}  // namespace
+
+
+// DeepDot, SoftmaxDeepDot and QuantizedDeepDot. Rows are read as float whatever TOrigin and
+// TKernel are, and accumulated in float before being stored as TOut. With kSoftmax (or the
+// `softmax` attr of QuantizedDeepDot) input 1 holds the pre-softmax logits, and the softmax over
+// depth is applied while the kernel planes are built, fused into the weighted shift-sum.
+// A uint8 origin is dequantized by `scale` inside the loop, unless the output is uint8 too:
+// then the sum stays in the 0-255 domain of the origin and is rounded straight into the output.
+template <typename TOrigin, typename TKernel, typename TOut, bool kSoftmax>
 class DeepDotOp : public OpKernel {
 public:
     explicit DeepDotOp(OpKernelConstruction *context) : OpKernel(context) {
         OP_REQUIRES_OK(context, context->GetAttr("kernel_size", &kernel_size_));
+        string interpolation;
+        OP_REQUIRES_OK(context, context->GetAttr("interpolation", &interpolation));
+        bilinear_ = interpolation == "bilinear";
+        softmax_ = kSoftmax;
+        if (context->HasAttr("softmax")) OP_REQUIRES_OK(context, context->GetAttr("softmax", &softmax_));
+        scale_ = 1.f;
+        if (context->HasAttr("scale") && !std::is_same<TOut, uint8>::value)
+            OP_REQUIRES_OK(context, context->GetAttr("scale", &scale_));
+        row_offset_ = full_height_ = 0;
+        if (context->HasAttr("full_height")) {
+            OP_REQUIRES_OK(context, context->GetAttr("row_offset", &row_offset_));
+            OP_REQUIRES_OK(context, context->GetAttr("full_height", &full_height_));
+        }
     }
 
     void Compute(OpKernelContext *context) override {
@@ -15,13 +224,11 @@ public:
         OP_REQUIRES(context, origin_tensor.dims() == 4,
                     errors::InvalidArgument("origin must be 4-dimensional",
                                             origin_tensor.shape().DebugString()));
-        auto origin = origin_tensor.tensor<float, 4>();
 
         const Tensor &kernel_tensor = context->input(1);
         OP_REQUIRES(context, kernel_tensor.dims() == 4,
                     errors::InvalidArgument("kernel must be 4-dimensional",
                                             kernel_tensor.shape().DebugString()));
-        auto kernel = kernel_tensor.tensor<float, 4>();
 
         OP_REQUIRES(context, origin_tensor.dim_size(0) == kernel_tensor.dim_size(0),
                     errors::InvalidArgument("origin and kernel must have identity batch_size",
@@ -34,49 +241,91 @@ public:
         // Create an output tensor
         Tensor *composed_tensor = nullptr;
         OP_REQUIRES_OK(context, context->allocate_output(0, origin_tensor.shape(), &composed_tensor));
-        auto composed = composed_tensor->tensor<float, 4>();
-        std::memset(composed.data(), 0, composed_tensor->TotalBytes());
+        TOut *composed = composed_tensor->flat<TOut>().data();
+        // float outputs are accumulated in place, every other type is stored row by row
+        if (std::is_same<TOut, float>::value) std::memset(composed_tensor->data(), 0, composed_tensor->TotalBytes());
 
-        // resize the kernel to fit the origin
-        double h_ = origin_tensor.dim_size(1) == kernel_tensor.dim_size(1) ? 1.0 : (
-                1.0 * kernel_tensor.dim_size(1) / origin_tensor.dim_size(1));
-        double w_ = origin_tensor.dim_size(2) == kernel_tensor.dim_size(2) ? 1.0 : (
-                1.0 * kernel_tensor.dim_size(2) / origin_tensor.dim_size(2));
-        auto rsh = [&h_](int x) { return (int) (x * h_); };
-        auto rsw = [&w_](int x) { return (int) (x * w_); };
+        const int height = origin_tensor.dim_size(1);
+        const int width = origin_tensor.dim_size(2);
+        const int channel = origin_tensor.dim_size(3);
+        const int row_size = width * channel;
+
+        // resize the kernel to fit the origin, the kernel position of every row and column is
+        // looked up once instead of being recomputed for each multiply-add. An origin that is the
+        // strip of rows from row_offset of a full_height image samples the kernel as the whole
+        // image would, the rows around the strip are simply not there
+        OP_REQUIRES(context, full_height_ == 0 || (row_offset_ >= 0 && row_offset_ + height <= full_height_),
+                    errors::InvalidArgument("the origin rows from row_offset must be inside full_height"));
+        ResizeMap rows(full_height_ > 0 ? full_height_ : height, kernel_tensor.dim_size(1), bilinear_);
+        if (full_height_ > 0) rows.Crop(row_offset_, height);
+        const ResizeMap cols(width, kernel_tensor.dim_size(2), bilinear_);
 
         int start = -kernel_size_ / 2;
         int end = kernel_size_ + start;
         int offset = -(kernel_size_ + 1) * start;
 
-        for (int b = 0; b < origin_tensor.dim_size(0); ++b) {
-            for (int h = 0; h < origin_tensor.dim_size(1); ++h) {
-                for (int w = 0; w < origin_tensor.dim_size(2); ++w) {
-                    for (int k = 0; k < origin_tensor.dim_size(3); ++k) {
-                        for (int i = start; i < end; ++i) {  // height
-                            for (int j = start; j < end; ++j) {  // width
-                                if (h + i < 0 || h + i >= origin_tensor.dim_size(1) ||
-                                    w + j < 0 || w + j >= origin_tensor.dim_size(2))
-                                    continue;
-                                int depth = kernel_size_ * i + j + offset;
-                                composed(b, h, w, k) += origin(b, h + i, w + j, k) * kernel(b, rsh(h), rsw(w), depth);
-                            }
-                        }
+        // Every (batch, row) pair writes its own output row, so rows can be sharded freely. Each
+        // shift (i, j) of the window is one vectorized multiply-add over the span of the row where
+        // w + j is inside the image, and rows outside the image are skipped as a whole.
+        auto work = [&](int64 first_row, int64 last_row) {
+            KernelPlanes<TKernel> planes(kernel_tensor.flat<TKernel>().data(), kernel_tensor.dim_size(1),
+                                         kernel_tensor.dim_size(2), kernel_tensor.dim_size(3), &rows, &cols,
+                                         channel, softmax_);
+            FloatRows<TOrigin> origin_rows(origin_tensor.flat<TOrigin>().data(), row_size, kernel_size_, scale_);
+            std::vector<float> accumulated(std::is_same<TOut, float>::value ? 0 : row_size);
+
+            for (int64 row = first_row; row < last_row; ++row) {
+                const int b = row / height;
+                const int h = row % height;
+                float *composed_row_data = accumulated.data();
+                if (std::is_same<TOut, float>::value)
+                    composed_row_data = reinterpret_cast<float *>(composed) + row * row_size;
+                else
+                    std::fill(accumulated.begin(), accumulated.end(), 0.f);
+                Eigen::Map<Eigen::ArrayXf> composed_row(composed_row_data, row_size);
+                for (int i = start; i < end; ++i) {  // height
+                    if (h + i < 0 || h + i >= height) continue;
+                    const float *origin_row = origin_rows.Get(row + i);
+                    for (int j = start; j < end; ++j) {  // width
+                        const int first = std::max(0, -j) * channel;
+                        const int last = std::min(width, width - j) * channel;
+                        if (first >= last) continue;
+                        const float *plane = planes.Get(b, h, kernel_size_ * i + j + offset);
+                        composed_row.segment(first, last - first) +=
+                                Eigen::Map<const Eigen::ArrayXf>(plane + first, last - first) *
+                                Eigen::Map<const Eigen::ArrayXf>(origin_row + first + j * channel, last - first);
                     }
                 }
+                if (!std::is_same<TOut, float>::value)
+                    StoreRow(composed_row_data, row_size, composed + row * row_size);
             }
-        }
+        };
+
+        auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+        const int64 cost_per_row = 2LL * row_size * kernel_size_ * kernel_size_;
+        Shard(worker_threads->num_threads, worker_threads->workers,
+              origin_tensor.dim_size(0) * height, cost_per_row, work);
     }
 
 private:
     int kernel_size_;
+    bool bilinear_;
+    bool softmax_;
+    float scale_;
+    int row_offset_, full_height_;
 };
 
 
+// GradDeepDot and GradSoftmaxDeepDot for every float type T, accumulated in float. With kSoftmax
+// input 2 holds the logits and output 1 is their gradient.
+template <typename T, bool kSoftmax>
 class GradDeepDotOp : public OpKernel {
 public:
     explicit GradDeepDotOp(OpKernelConstruction *context) : OpKernel(context) {
         OP_REQUIRES_OK(context, context->GetAttr("kernel_size", &kernel_size_));
+        string interpolation;
+        OP_REQUIRES_OK(context, context->GetAttr("interpolation", &interpolation));
+        bilinear_ = interpolation == "bilinear";
     }
 
     void Compute(OpKernelContext *context) override {
@@ -85,28 +334,19 @@ public:
         OP_REQUIRES(context, grad_composed.dims() == 4,
                     errors::InvalidArgument("grad must be 4-dimensional",
                                             grad_composed.shape().DebugString()));
-        auto grad = grad_composed.tensor<float, 4>();
 
         const Tensor &origin_tensor = context->input(1);
         OP_REQUIRES(context, origin_tensor.shape() == grad_composed.shape(),
                     errors::InvalidArgument("shape of grad_composed and origin must the same"));
-        auto origin = origin_tensor.tensor<float, 4>();
 
         const Tensor &kernel_tensor = context->input(2);
         OP_REQUIRES(context, kernel_tensor.dims() == 4,
                     errors::InvalidArgument("kernel must be 4-dimensional",
                                             kernel_tensor.shape().DebugString()));
-        auto kernel = kernel_tensor.tensor<float, 4>();
 
         OP_REQUIRES(context, origin_tensor.dim_size(0) == kernel_tensor.dim_size(0),
                     errors::InvalidArgument("origin and kernel must have identity batch_size",
                                             kernel_tensor.shape().DebugString()));
-        OP_REQUIRES(context, origin_tensor.dim_size(1) == kernel_tensor.dim_size(1),
-                    errors::InvalidArgument("origin and kernel must have identity height",
-                                            kernel_tensor.shape().DebugString()));
-        OP_REQUIRES(context, origin_tensor.dim_size(2) == kernel_tensor.dim_size(2),
-                    errors::InvalidArgument("origin and kernel must have identity width",
-                                            kernel_tensor.shape().DebugString()));
         OP_REQUIRES(context, kernel_tensor.dim_size(3) == kernel_size_ * kernel_size_,
                     errors::InvalidArgument("kernel_size not match",
                                             kernel_tensor.shape().DebugString()));
@@ -114,46 +354,174 @@ public:
         // Create the output tensor
         Tensor *grad_origin_tensor = nullptr;
         OP_REQUIRES_OK(context, context->allocate_output(0, origin_tensor.shape(), &grad_origin_tensor));
-        auto grad_origin = grad_origin_tensor->tensor<float, 4>();
-        std::memset(grad_origin.data(), 0, grad_origin_tensor->TotalBytes());
+        T *grad_origin = grad_origin_tensor->flat<T>().data();
 
         Tensor *grad_kernel_tensor = nullptr;
         OP_REQUIRES_OK(context, context->allocate_output(1, kernel_tensor.shape(), &grad_kernel_tensor));
-        auto grad_kernel = grad_kernel_tensor->tensor<float, 4>();
-        std::memset(grad_kernel.data(), 0, grad_kernel_tensor->TotalBytes());
+        T *grad_kernel = grad_kernel_tensor->flat<T>().data();
+
+        const T *grad = grad_composed.flat<T>().data();
+        const T *origin = origin_tensor.flat<T>().data();
+        const T *kernel = kernel_tensor.flat<T>().data();
+        // float gradients are accumulated in place, every other type is stored row by row
+        const bool in_place = std::is_same<T, float>::value;
+        if (in_place) {
+            std::memset(grad_origin_tensor->data(), 0, grad_origin_tensor->TotalBytes());
+            std::memset(grad_kernel_tensor->data(), 0, grad_kernel_tensor->TotalBytes());
+        }
+
+        const int batch_size = origin_tensor.dim_size(0);
+        const int height = origin_tensor.dim_size(1);
+        const int width = origin_tensor.dim_size(2);
+        const int channel = origin_tensor.dim_size(3);
+        const int kernel_height = kernel_tensor.dim_size(1);
+        const int kernel_width = kernel_tensor.dim_size(2);
+        const int depth_size = kernel_tensor.dim_size(3);
+        const int row_size = width * channel;
+        const int kernel_row_size = kernel_width * depth_size;
+
+        const ResizeMap rows(height, kernel_height, bilinear_);
+        const ResizeMap cols(width, kernel_width, bilinear_);
 
         int start = -kernel_size_ / 2;
         int end = kernel_size_ + start;
         int offset = -(kernel_size_ + 1) * start;
 
-        // context->device()->tensorflow_cpu_worker_threads()->workers->Schedule()
-        for (int b = 0; b < origin_tensor.dim_size(0); ++b) {
-            for (int h = 0; h < origin_tensor.dim_size(1); ++h) {
-                for (int w = 0; w < origin_tensor.dim_size(2); ++w) {
-                    for (int k = 0; k < origin_tensor.dim_size(3); ++k) {
-                        float grad_hwk = grad(b, h, w, k);
-                        for (int i = start; i < end; ++i) {  // height
-                            for (int j = start; j < end; ++j) {  // width
-                                if (h + i < 0 || h + i >= origin_tensor.dim_size(1) ||
-                                    w + j < 0 || w + j >= origin_tensor.dim_size(2))
-                                    continue;
-                                int depth = kernel_size_ * i + j + offset;
-
-                                grad_origin(b, h + i, w + j, k) += kernel(b, h, w, depth) * grad_hwk;
-                                grad_kernel(b, h, w, depth) += origin(b, h + i, w + j, k) * grad_hwk;
+        // grad_origin: the forward pass scatters composed(b, h, w) from origin(b, h + i, w + j), so
+        // the natural backward pass would scatter across rows. Instead every (batch, row) pair
+        // gathers its own grad_origin row from the composed pixels (h - i, w - j) that read it,
+        // weighted by the kernel as sampled at those pixels. The planes of the kernel_size source
+        // rows a row reads are kept in a ring, so each of them is built once per shard.
+        auto origin_work = [&](int64 first_row, int64 last_row) {
+            std::vector<KernelPlanes<T>> ring;
+            ring.reserve(kernel_size_);
+            for (int n = 0; n < kernel_size_; ++n)
+                ring.emplace_back(kernel, kernel_height, kernel_width, depth_size, &rows, &cols, channel,
+                                  kSoftmax);
+            FloatRows<T> grad_rows(grad, row_size, kernel_size_);
+            std::vector<float> accumulated(in_place ? 0 : row_size);
+
+            for (int64 row = first_row; row < last_row; ++row) {
+                const int b = row / height;
+                const int h = row % height;
+                float *grad_origin_row_data = accumulated.data();
+                if (in_place)
+                    grad_origin_row_data = reinterpret_cast<float *>(grad_origin) + row * row_size;
+                else
+                    std::fill(accumulated.begin(), accumulated.end(), 0.f);
+                Eigen::Map<Eigen::ArrayXf> grad_origin_row(grad_origin_row_data, row_size);
+                for (int i = start; i < end; ++i) {  // height
+                    const int source = h - i;
+                    if (source < 0 || source >= height) continue;
+                    KernelPlanes<T> &planes = ring[source % kernel_size_];
+                    const float *grad_row = grad_rows.Get(row - i);
+                    for (int j = start; j < end; ++j) {  // width
+                        const int first = std::max(0, j) * channel;
+                        const int last = std::min(width, width + j) * channel;
+                        if (first >= last) continue;
+                        const float *plane = planes.Get(b, source, kernel_size_ * i + j + offset);
+                        grad_origin_row.segment(first, last - first) +=
+                                Eigen::Map<const Eigen::ArrayXf>(plane + first - j * channel, last - first) *
+                                Eigen::Map<const Eigen::ArrayXf>(grad_row + first - j * channel, last - first);
+                    }
+                }
+                if (!in_place) StoreRow(grad_origin_row_data, row_size, grad_origin + row * row_size);
+            }
+        };
+
+        // grad_kernel: every origin pixel (h, w) contributes sum_k origin(h + i, w + j, k) * grad(h, w, k)
+        // to the kernel cells it was sampled from. To keep the writes of each shard disjoint the work
+        // is sharded by (batch, kernel row), and each kernel row pulls from the origin rows that map
+        // onto it. With a kernel coarser than the origin this accumulates straight onto the coarse
+        // grid, without ever materializing the upsampled kernel or its gradient. A kernel row is
+        // complete once its shard is done with it, so the softmax backward is applied right there.
+        std::vector<std::vector<std::pair<int, float>>> taps(kernel_height);
+        for (int h = 0; h < height; ++h) {
+            taps[rows.lower[h]].emplace_back(h, 1.f - rows.fraction[h]);
+            if (rows.fraction[h] != 0.f) taps[rows.upper[h]].emplace_back(h, rows.fraction[h]);
+        }
+
+        auto kernel_work = [&](int64 first_row, int64 last_row) {
+            FloatRows<T> origin_rows(origin, row_size, kernel_size_);
+            FloatRows<T> grad_rows(grad, row_size, 1);
+            FloatRows<T> kernel_rows(kernel, kernel_row_size, 1);
+            std::vector<float> products(row_size);
+            std::vector<float> accumulated(in_place ? 0 : kernel_row_size);
+
+            for (int64 row = first_row; row < last_row; ++row) {
+                const int b = row / kernel_height;
+                float *grad_kernel_row = accumulated.data();
+                if (in_place)
+                    grad_kernel_row = reinterpret_cast<float *>(grad_kernel) + row * kernel_row_size;
+                else
+                    std::fill(accumulated.begin(), accumulated.end(), 0.f);
+                for (const auto &tap : taps[row % kernel_height]) {
+                    const int h = tap.first;
+                    const float *grad_row = grad_rows.Get((int64) b * height + h);
+                    for (int i = start; i < end; ++i) {  // height
+                        if (h + i < 0 || h + i >= height) continue;
+                        const float *origin_row = origin_rows.Get((int64) b * height + h + i);
+                        for (int j = start; j < end; ++j) {  // width
+                            const int first_w = std::max(0, -j), last_w = std::min(width, width - j);
+                            if (first_w >= last_w) continue;
+                            const int depth = kernel_size_ * i + j + offset;
+                            const int first = first_w * channel, length = (last_w - first_w) * channel;
+                            Eigen::Map<Eigen::ArrayXf>(products.data() + first, length) =
+                                    Eigen::Map<const Eigen::ArrayXf>(origin_row + first + j * channel, length) *
+                                    Eigen::Map<const Eigen::ArrayXf>(grad_row + first, length);
+                            for (int w = first_w; w < last_w; ++w) {
+                                float grad_ij = 0;
+                                for (int k = 0; k < channel; ++k) grad_ij += products[w * channel + k];
+                                grad_ij *= tap.second;
+                                const float fraction = cols.fraction[w];
+                                if (fraction == 0.f) {
+                                    grad_kernel_row[cols.lower[w] * depth_size + depth] += grad_ij;
+                                } else {
+                                    grad_kernel_row[cols.lower[w] * depth_size + depth] += (1.f - fraction) * grad_ij;
+                                    grad_kernel_row[cols.upper[w] * depth_size + depth] += fraction * grad_ij;
+                                }
                             }
                         }
                     }
                 }
+                if (kSoftmax) SoftmaxGradRow(kernel_rows.Get(row), kernel_width, depth_size, grad_kernel_row);
+                if (!in_place) StoreRow(grad_kernel_row, kernel_row_size, grad_kernel + row * kernel_row_size);
             }
-        }
+        };
+
+        auto worker_threads = context->device()->tensorflow_cpu_worker_threads();
+        const int64 cost_per_row = 2LL * row_size * kernel_size_ * kernel_size_;
+        Shard(worker_threads->num_threads, worker_threads->workers,
+              (int64) batch_size * height, cost_per_row, origin_work);
+        Shard(worker_threads->num_threads, worker_threads->workers,
+              (int64) batch_size * kernel_height,
+              cost_per_row * std::max(1, (height + kernel_height - 1) / kernel_height), kernel_work);
     }
 
 private:
     int kernel_size_;
+    bool bilinear_;
 };
 
 
-REGISTER_KERNEL_BUILDER(Name("DeepDot").Device(DEVICE_CPU), DeepDotOp);
+#define REGISTER_DEEP_DOT(T)                                                                         \
+    REGISTER_KERNEL_BUILDER(Name("DeepDot").Device(DEVICE_CPU).TypeConstraint<T>("T"),              \
+                            DeepDotOp<T, T, T, false>);                                              \
+    REGISTER_KERNEL_BUILDER(Name("GradDeepDot").Device(DEVICE_CPU).TypeConstraint<T>("T"),          \
+                            GradDeepDotOp<T, false>);                                                \
+    REGISTER_KERNEL_BUILDER(Name("SoftmaxDeepDot").Device(DEVICE_CPU).TypeConstraint<T>("T"),       \
+                            DeepDotOp<T, T, T, true>);                                               \
+    REGISTER_KERNEL_BUILDER(Name("GradSoftmaxDeepDot").Device(DEVICE_CPU).TypeConstraint<T>("T"),   \
+                            GradDeepDotOp<T, true>);                                                 \
+    REGISTER_KERNEL_BUILDER(Name("QuantizedDeepDot").Device(DEVICE_CPU).TypeConstraint<T>("T")      \
+                                    .TypeConstraint<float>("out_type"),                              \
+                            DeepDotOp<uint8, T, float, false>);                                      \
+    REGISTER_KERNEL_BUILDER(Name("QuantizedDeepDot").Device(DEVICE_CPU).TypeConstraint<T>("T")      \
+                                    .TypeConstraint<uint8>("out_type"),                              \
+                            DeepDotOp<uint8, T, uint8, false>);
+
+REGISTER_DEEP_DOT(float);
+REGISTER_DEEP_DOT(Eigen::half);
+REGISTER_DEEP_DOT(bfloat16);
 
-REGISTER_KERNEL_BUILDER(Name("GradDeepDot").Device(DEVICE_CPU), GradDeepDotOp);
+#undef REGISTER_DEEP_DOT
@@ -0,0 +1,190 @@
+import os
+import cv2
+import glob
+import json
+import numpy as np
+import tensorflow as tf
+from collections import namedtuple
+from typing import Dict, List
+
+from deep3d.cache import file_hash
+from deep3d.data import VideoType, OriginType, Shape, frame_size, split_frame
+
+Movie = namedtuple("Movie", 'file_name video_type')
+
+
+def parse_library(spec: str, default_video_type: VideoType = VideoType.LR3D) -> List[Movie]:
+  """Movies from a comma separated list of file names or globs, each optionally followed by `:lr3d` or `:ud3d`."""
+  movies = []
+  for entry in spec.split(','):
+    pattern, video_type = entry.strip(), default_video_type
+    if ':' in pattern and pattern.rsplit(':', 1)[1].upper() in VideoType.__members__:
+      pattern, name = pattern.rsplit(':', 1)
+      video_type = VideoType[name.upper()]
+    file_names = sorted(glob.glob(pattern))
+    if not file_names:
+      raise ValueError(f'no movie matches {pattern}')
+    movies.extend(Movie(file_name, video_type) for file_name in file_names)
+  return movies
+
+
+def detect_scenes(file_name: str, cut_threshold: float = 30.0, duplicate_threshold: float = 2.0,
+                  thumbnail: Shape = Shape(36, 64)) -> List[List[int]]:
+  """Frame indices of a movie grouped by scene, without near-duplicate frames.
+
+  Frames are compared as small gray thumbnails by mean absolute difference. A difference above `cut_threshold` to the
+  previous frame starts a new scene, a frame within `duplicate_threshold` of the last frame kept in its scene is
+  dropped, which removes static shots and the repeated frames of telecined material.
+  """
+  vc = cv2.VideoCapture(file_name)
+  scenes, scene, previous, kept, index = [], [], None, None, 0
+  try:
+    while True:
+      ret, frame = vc.read()
+      if not ret:
+        break
+      small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), dsize=(thumbnail.width, thumbnail.high),
+                         interpolation=cv2.INTER_AREA).astype(np.float32)
+      if previous is not None and np.mean(np.abs(small - previous)) > cut_threshold:
+        scenes.append(scene)
+        scene, kept = [], None
+      if kept is None or np.mean(np.abs(small - kept)) > duplicate_threshold:
+        scene.append(index)
+        kept = small
+      previous = small
+      index += 1
+  finally:
+    vc.release()
+  if scene:
+    scenes.append(scene)
+  return scenes
+
+
+class MovieLibrary(object):
+  """Training frames sampled at random across the scenes of several stereo movies.
+
+  Every epoch draws up to `frames_per_scene` frames from each scene of each movie, so long static scenes do not
+  outweigh short ones, and reads them back with seeks on one cv2.VideoCapture per movie. `num_parallel_movies` movies
+  are read at the same time and interleaved into a shuffle buffer. LR3D and UD3D movies can be mixed, each one is
+  resized so that its left and right views come out as `view`. The scene index of a movie costs one decode pass,
+  it is kept in `index_dir` under the content hash of the movie when one is given.
+  """
+
+  def __init__(self,
+               movies: List[Movie],
+               view: Shape = Shape(256, 224),
+               frames_per_scene: int = 8,
+               index_dir: str = None,
+               seek_frames: int = 250,
+               seed: int = 0):
+    self._movies = movies
+    self._view = view
+    self._frames_per_scene = frames_per_scene
+    self._index_dir = index_dir
+    self._seek_frames = seek_frames
+    self._seed = seed
+    self._scenes = [self._load_scenes(movie.file_name) for movie in movies]
+
+  def _load_scenes(self, file_name: str) -> List[List[int]]:
+    if not self._index_dir:
+      return detect_scenes(file_name)
+    os.makedirs(self._index_dir, exist_ok=True)
+    index_file = os.path.join(self._index_dir,
+                              file_hash(file_name, os.path.join(self._index_dir, 'hashes.json')) + '.scenes.json')
+    if os.path.exists(index_file):
+      with open(index_file) as f:
+        return json.load(f)
+    scenes = detect_scenes(file_name)
+    with open(index_file, 'w') as f:
+      json.dump(scenes, f)
+    return scenes
+
+  @property
+  def num_scenes(self) -> int:
+    return sum(len(scenes) for scenes in self._scenes)
+
+  def _resize(self, video_type: VideoType) -> Shape:
+    return frame_size(self._view, video_type)
+
+  @property
+  def signature(self) -> Dict[str, tf.TensorSpec]:
+    # the movies do not share an origin size, and training does not use the origin
+    height, width = self._view
+    return {
+      'left': tf.TensorSpec(shape=(height, width, 1), dtype=tf.dtypes.uint8),
+      'right': tf.TensorSpec(shape=(height, width, 1), dtype=tf.dtypes.uint8),
+      'feature': tf.TensorSpec(shape=(height, width, 3), dtype=tf.dtypes.uint8),
+    }
+
+  def sample(self, movie: int, epoch: int) -> List[int]:
+    """Frame indices of `movie` drawn for `epoch`, in increasing order."""
+    rng = np.random.RandomState([self._seed, epoch, movie])
+    indices = []
+    for scene in self._scenes[movie]:
+      size = min(len(scene), self._frames_per_scene)
+      indices.extend(rng.choice(scene, size=size, replace=False).tolist())
+    return sorted(indices)
+
+  def _read(self, movie: int, epoch: int, num_shards: int = 1, shard: int = 0):
+    # every num_shards-th frame of the sample from the shard-th one, the sample is the same for every worker
+    movie, epoch, num_shards, shard = int(movie), int(epoch), int(num_shards), int(shard)
+    file_name, video_type = self._movies[movie]
+    vc = cv2.VideoCapture(file_name)
+    position = 0
+    try:
+      for index in self.sample(movie, epoch)[shard::num_shards]:
+        # the frame and the two before it, which make the temporal stack of feature
+        start = max(index - 2, 0)
+        if start < position or start - position > self._seek_frames:
+          vc.set(cv2.CAP_PROP_POS_FRAMES, start)
+          position = start
+        while position < start:
+          vc.grab()
+          position += 1
+
+        lefts, right = [], None
+        while position <= index:
+          ret, frame = vc.read()
+          if not ret:
+            break
+          _, left, right = split_frame(frame, video_type, OriginType.GRAY, self._resize(video_type))
+          lefts.append(left)
+          position += 1
+        if position <= index:
+          continue
+        lefts = [np.zeros_like(lefts[0])] * (3 - len(lefts)) + lefts
+        yield {
+          'left': np.expand_dims(lefts[2], axis=2),
+          'right': np.expand_dims(right, axis=2),
+          'feature': np.stack([lefts[2], lefts[1], lefts[0]], axis=2),
+        }
+    finally:
+      vc.release()
+
+  def dataset(self, num_epoch: int = 1, shuffle_buffer: int = 4096, num_parallel_movies: int = 4,
+              num_shards: int = 1, index: int = 0) -> tf.data.Dataset:
+    """Unbatched uint8 left/right/feature frames of `num_epoch` epochs.
+
+    With `num_shards` the frames are the `index`-th of disjoint shards, for one worker of a distributed training:
+    the worker reads its own movies, or its share of the frames of all of them when there are fewer movies.
+    """
+    signature = self.signature
+    num_movies = len(self._movies)
+
+    by_movie = num_movies >= num_shards
+    # the frames are shared out within each movie before the interleave, whose order differs from worker to worker
+    frame_shards, frame_shard = (1, 0) if by_movie else (num_shards, index)
+
+    def read(task):
+      movie, epoch = task % num_movies, task // num_movies
+      return tf.data.Dataset.from_generator(self._read, args=(movie, epoch, frame_shards, frame_shard),
+                                            output_signature=signature)
+
+    dataset = tf.data.Dataset.range(num_epoch * num_movies)
+    if num_shards > 1 and by_movie:
+      dataset = dataset.filter(lambda task: task % num_movies % num_shards == index)
+    dataset = dataset.interleave(read, cycle_length=min(num_parallel_movies, num_movies),
+                                 num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+    if shuffle_buffer > 0:
+      dataset = dataset.shuffle(buffer_size=shuffle_buffer)
+    return dataset
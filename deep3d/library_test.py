@@ -0,0 +1,67 @@
+import os
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from deep3d.data import FrameGenerator, VideoType, Shape
+from deep3d.library import Movie, MovieLibrary, detect_scenes, parse_library
+
+
+def write_scenes(file_name: str, height: int = 64, width: int = 128):
+    # a dark scene and a bright scene of 10 moving frames each, then 5 copies of the last frame
+    rng = np.random.RandomState(0)
+    writer = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*'MJPG'), 24, (width, height))
+    for low, high in [(0, 100), (150, 255)]:
+        base = rng.randint(low, high, size=(height, width, 3)).astype(np.uint8)
+        for i in range(10):
+            frame = np.roll(base, 8 * i, axis=1)
+            writer.write(frame)
+    for i in range(5):
+        writer.write(frame)
+    writer.release()
+
+
+class MovieLibraryTest(tf.test.TestCase):
+    def test_detect_scenes(self):
+        file_name = os.path.join(self.get_temp_dir(), 'scenes.avi')
+        write_scenes(file_name)
+        scenes = detect_scenes(file_name)
+        self.assertEqual(scenes, [list(range(10)), list(range(10, 20))])
+
+    def test_movie_library(self):
+        lr3d = os.path.join(self.get_temp_dir(), 'lr3d.avi')
+        ud3d = os.path.join(self.get_temp_dir(), 'ud3d.avi')
+        write_scenes(lr3d)
+        write_scenes(ud3d, height=128, width=64)
+        movies = parse_library(f'{lr3d},{ud3d}:ud3d')
+        self.assertEqual(movies, [Movie(lr3d, VideoType.LR3D), Movie(ud3d, VideoType.UD3D)])
+
+        library = MovieLibrary(movies, view=Shape(32, 32), frames_per_scene=3,
+                               index_dir=os.path.join(self.get_temp_dir(), 'index'))
+        self.assertEqual(library.num_scenes, 4)
+        frames = list(library.dataset(num_epoch=2, shuffle_buffer=16).as_numpy_iterator())
+        self.assertLen(frames, 2 * 4 * 3)
+
+        # every sampled frame is the frame the sequential reader produces at that index, temporal stack included
+        expected = {}
+        for file_name, video_type, resize in [(lr3d, VideoType.LR3D, Shape(32, 64)),
+                                              (ud3d, VideoType.UD3D, Shape(64, 32))]:
+            with FrameGenerator(file_name, video_type=video_type, resize=resize) as generator:
+                for frame in generator:
+                    expected[frame['feature'].tobytes()] = frame
+        for frame in frames:
+            self.assertIn(frame['feature'].tobytes(), expected)
+            expected_frame = expected[frame['feature'].tobytes()]
+            for key in ['left', 'right']:
+                self.assertAllEqual(frame[key], expected_frame[key])
+
+        # two workers read one movie each, three share the frames of both
+        for num_shards in [2, 3]:
+            shards = [list(library.dataset(num_epoch=2, shuffle_buffer=0, num_shards=num_shards,
+                                           index=index).as_numpy_iterator()) for index in range(num_shards)]
+            features = sorted(frame['feature'].tobytes() for shard in shards for frame in shard)
+            self.assertEqual(features, sorted(frame['feature'].tobytes() for frame in frames))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from absl import flags, app, logging
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('num_workers', 2, 'worker processes to start on this host')
+flags.DEFINE_integer('port', 23456, 'port of the first worker, the others take the ports after it')
+flags.DEFINE_string('script', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.py'),
+                    'what every worker runs')
+
+
+def main(argv):
+  """Trains with --distribute=multi_worker in `num_workers` local processes, for testing on one host.
+
+  The arguments after -- go to every worker, e.g.
+    python deep3d/local_cluster.py --num_workers=2 -- --file_name=movie.mkv --model_dir=/tmp/ckpt --train_steps=100
+  Worker 0 is the chief that writes the checkpoints to model_dir.
+  """
+  cluster = {'worker': [f'localhost:{FLAGS.port + i}' for i in range(FLAGS.num_workers)]}
+  # the profiler servers of the workers would all take the same port
+  command = [sys.executable, FLAGS.script, '--mode=train', '--distribute=multi_worker', '--noprofiler'] + argv[1:]
+  workers = []
+  for index in range(FLAGS.num_workers):
+    tf_config = {'cluster': cluster, 'task': {'type': 'worker', 'index': index}}
+    workers.append(subprocess.Popen(command, env=dict(os.environ, TF_CONFIG=json.dumps(tf_config))))
+  try:
+    # the others would wait for a failed worker in the all-reduce forever, they are stopped along with it
+    while any(worker.poll() is None for worker in workers):
+      if any(worker.poll() for worker in workers):
+        break
+      time.sleep(1.0)
+  finally:
+    for worker in workers:
+      if worker.poll() is None:
+        worker.terminate()
+        worker.wait()
+  codes = [worker.returncode for worker in workers]
+  for index, code in enumerate(codes):
+    if code != 0:
+      logging.error(f'worker {index} exited with code {code}')
+  return max(codes, key=abs)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -1,15 +1,14 @@
-import numpy as np
 from absl import logging, flags, app
-import os
-import cv2
-from typing import Dict
 
 import tensorflow as tf
-from deep3d.utils import read_vgg16, bilinear, save
-from tensorflow.keras.layers import Conv2D, MaxPooling2D, BatchNormalization, Conv2DTranspose, ReLU, Softmax
-from tensorflow.keras.losses import MAE
-from deep3d.data import FrameGenerator, VideoType, OriginType
-from deep3d.deep_dot import deep_dot
+from deep3d.batch_convert import batch_convert, parse_manifest
+from deep3d.data import VideoType, Shape
+from deep3d.convert import convert, estimator_predict
+from deep3d.instrument import instruments
+from deep3d.model_lib import Deep3dModel
+from deep3d.multiscale import ScalePicker, multiscale_predict
+from deep3d.tiling import TiledComposer, tiled_predict
+from deep3d.quantize import FloatTrunk, Int8Trunk, calibration_features, compare, trunk_predict
 
 FLAGS = flags.FLAGS
 flags.DEFINE_integer('batch_size', 64, 'batch_size')
@@ -18,188 +17,178 @@ flags.DEFINE_integer('depth_ks', 4, 'depth_ks')
 flags.DEFINE_enum('vt', 'lr3d', ['simple', 'lr3d', 'ud3d'], 'video_type')
 flags.DEFINE_enum('ot', 'color', ['gray', 'color'], 'video_type')
 flags.DEFINE_bool('drop_remainder', True, 'drop_remainder')
+flags.DEFINE_enum('interpolation', 'nearest', ['nearest', 'bilinear'], 'how the kernel is sampled onto origin')
+flags.DEFINE_bool('fused_softmax', False, 'apply the kernel softmax inside the deep_dot op')
+flags.DEFINE_enum('mixed_precision', 'none', ['none', 'float16', 'bfloat16'], 'compute dtype of the network')
+flags.DEFINE_integer('num_decoders', 1, 'number of video decoder processes, 1 decodes in the input pipeline')
+flags.DEFINE_bool('raw_frames', False, 'only decode in python, preprocess the frames with batched tf ops')
+flags.DEFINE_string('cache_dir', '', 'cache the preprocessed frames here, decoding the movie only once')
+flags.DEFINE_bool('cache_origin', False, 'also cache the full resolution origin, so predict can read from the cache')
+flags.DEFINE_integer('shuffle_buffer', 4096, 'frames shuffled together when training from the cache')
+flags.DEFINE_string('library', '', 'train on frames sampled across these movies, comma separated globs with an '
+                    'optional :lr3d or :ud3d each, instead of reading file_name in order')
+flags.DEFINE_integer('frames_per_scene', 8, 'frames sampled from each scene of the library per epoch')
+flags.DEFINE_bool('uint8_origin', False, 'keep the predict origin as uint8 and compose it with QuantizedDeepDot')
 flags.DEFINE_string('file_name', '/Volumes/data/baidu/Avatar_3D.mkv', 'input movie file_name')
 # flags.DEFINE_string('file_name', '/Volumes/data/baidu/carrier.mp4', 'input movie file_name')
 flags.DEFINE_string('model_dir', '/Users/fitz/data/code/deep3d/ckpt', 'input movie file_name')
+flags.DEFINE_enum('mode', 'convert', ['train', 'convert', 'export', 'quantize', 'batch'],
+                  'train on file_name, convert file_name to 3D, export a SavedModel for deep3d.serving, quantize '
+                  'the network to int8_model, or convert the movies of manifest with the network loaded once')
+flags.DEFINE_string('export_dir', '/Users/fitz/data/code/deep3d/export', 'where export writes the SavedModel')
+flags.DEFINE_string('output_file', '/Volumes/data/baidu/carrier2.mp4', 'the converted 3D movie')
+flags.DEFINE_integer('queue_size', 64, 'decoded frames buffered ahead of inference')
+flags.DEFINE_enum('encoder', 'cv2', ['cv2', 'ffmpeg'], 'ffmpeg encodes with libx264 and muxes the audio of file_name')
+flags.DEFINE_integer('crf', 18, 'constant quality of the ffmpeg encoder, lower is better')
+flags.DEFINE_string('preset', 'medium', 'x264 preset of the ffmpeg encoder')
+flags.DEFINE_enum('layout', None, ['sbs', 'tb', 'anaglyph'], 'output layout, sbs for color and anaglyph for gray '
+                  'when not set')
 flags.DEFINE_bool('profiler', True, 'whether start profiler')
-
-params = read_vgg16('/Users/fitz/data/code/deep3d/vgg_16.ckpt')
-
-
-class Deep3dModel(object):
-  def __init__(self, file_name, depth_ks: int, num_epoch: int = 1, batch_size: int = 64,
-               drop_remainder: bool = True, video_type: str = 'lr3d', origin_type='color'):
-    self.num_epoch = num_epoch
-    self.video_type = VideoType[video_type.upper()]
-    self.origin_type = OriginType[origin_type.upper()]
-    self.batch_size = batch_size
-    self.drop_remainder = drop_remainder
-    self._depth_ks = depth_ks
-
-    self.frame_reader = FrameGenerator(file_name,
-                                       num_epoch=self.num_epoch,
-                                       video_type=self.video_type,
-                                       origin_type=self.origin_type)
-
-  @property
-  def fps(self):
-    return self.frame_reader.fps
-
-  @property
-  def origin_size(self):
-    return self.frame_reader.origin_size
-
-  @property
-  def fourcc(self):
-    return self.frame_reader.fourcc
-
-  def input_fn(self) -> tf.data.Dataset:
-    dataset = tf.data.Dataset.from_generator(generator=self.frame_reader, output_signature=self.frame_reader.signature)
-
-    def map_fn(features):
-      return {key: tf.cast(value, dtype=tf.float32) / 255.0 for key, value in features.items()}
-
-    dataset = dataset.map(map_fn).batch(batch_size=self.batch_size, drop_remainder=self.drop_remainder)
-    dataset = dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
-
-    return dataset
-
-  def model_fn(self, features: Dict[str, tf.Tensor],
-               labels: tf.Tensor,
-               mode: str) -> tf.estimator.EstimatorSpec:
-    data, labels = features['feature'], (labels or features.get('right', None))
-    logging.info(f'the shape of left is {data.get_shape().as_list()}')
-    depth_ks = self._depth_ks
-    depth = depth_ks ** 2
-
-    # group 1
-    data = Conv2D(filters=64, kernel_size=(3, 3), activation='relu', padding="same", name='conv1_1',
-                  kernel_initializer=tf.constant_initializer(params['conv1_1/weights']),
-                  bias_initializer=tf.constant_initializer(params['conv1_1/biases']))(data)
-    data = Conv2D(filters=64, kernel_size=(3, 3), activation='relu', padding="same", name='conv1_2',
-                  kernel_initializer=tf.constant_initializer(params['conv1_2/weights']),
-                  bias_initializer=tf.constant_initializer(params['conv1_2/biases']))(data)
-    data = MaxPooling2D(pool_size=(2, 2), strides=(2, 2))(data)
-    emit1 = BatchNormalization()(data)
-    emit1 = Conv2D(filters=depth, kernel_size=(3, 3), padding="same", activation='relu')(emit1)
-    logging.info(f'the shape of emit1 is {emit1.get_shape().as_list()}]')
-    emit1 = Conv2DTranspose(filters=depth, kernel_size=(1, 1), strides=(1, 1), use_bias=False)(emit1)
-    logging.info(f'the shape of emit1 after Conv2DTranspose is {emit1.get_shape().as_list()}')
-
-    # group 2
-    data = Conv2D(filters=128, kernel_size=(3, 3), activation='relu', padding="same", name='conv2_1',
-                  kernel_initializer=tf.constant_initializer(params['conv2_1/weights']),
-                  bias_initializer=tf.constant_initializer(params['conv2_1/biases']))(data)
-    data = Conv2D(filters=128, kernel_size=(3, 3), activation='relu', padding="same", name='conv2_2',
-                  kernel_initializer=tf.constant_initializer(params['conv2_2/weights']),
-                  bias_initializer=tf.constant_initializer(params['conv2_2/biases']))(data)
-    data = MaxPooling2D(pool_size=(2, 2), strides=(2, 2))(data)
-    emit2 = BatchNormalization()(data)
-    emit2 = Conv2D(filters=depth, kernel_size=(3, 3), padding="same", activation='relu')(emit2)
-    logging.info(f'the shape of emit2 is {emit2.get_shape().as_list()}]')
-    emit2 = Conv2DTranspose(filters=depth, kernel_size=(4, 4), strides=(2, 2), padding="same", use_bias=False,
-                            kernel_initializer=tf.constant_initializer(bilinear(shape=[4, 4, depth, depth])))(emit2)
-    logging.info(f'the shape of emit2 after Conv2DTranspose is {emit2.get_shape().as_list()}')
-
-    # group 3
-    data = Conv2D(filters=256, kernel_size=(3, 3), activation='relu', padding="same", name='conv3_1',
-                  kernel_initializer=tf.constant_initializer(params['conv3_1/weights']),
-                  bias_initializer=tf.constant_initializer(params['conv3_1/biases']))(data)
-    data = Conv2D(filters=256, kernel_size=(3, 3), activation='relu', padding="same", name='conv3_2',
-                  kernel_initializer=tf.constant_initializer(params['conv3_2/weights']),
-                  bias_initializer=tf.constant_initializer(params['conv3_2/biases']))(data)
-    data = MaxPooling2D(pool_size=(2, 2), strides=(2, 2))(data)
-    emit3 = BatchNormalization()(data)
-    emit3 = Conv2D(filters=depth, kernel_size=(3, 3), padding="same", activation='relu')(emit3)
-    logging.info(f'the shape of emit3 is {emit3.get_shape().as_list()}')
-    emit3 = Conv2DTranspose(filters=depth, kernel_size=(8, 8), strides=(4, 4), padding="same", use_bias=False,
-                            kernel_initializer=tf.constant_initializer(bilinear(shape=[8, 8, depth, depth])))(emit3)
-    logging.info(f'the shape of emit3 after Conv2DTranspose is {emit3.get_shape().as_list()}')
-
-    emit = ReLU()(emit1 * emit2 * emit3)
-    emit = Conv2DTranspose(filters=depth, kernel_size=(4, 4), strides=(2, 2), padding="same", use_bias=False,
-                           kernel_initializer=tf.constant_initializer(bilinear(shape=[4, 4, depth, depth])))(emit)
-    logging.info(f'the shape of emit after Conv2DTranspose is {emit.get_shape().as_list()}')
-    emit = Conv2D(filters=depth, kernel_size=(3, 3), padding="same")(ReLU()(emit))
-    emit = Softmax(axis=-1)(emit)
-    logging.info(f'the shape of emit is {emit.get_shape().as_list()}')
-
-    if mode == tf.estimator.ModeKeys.PREDICT:
-      pred = {
-        'origin': features['origin'],
-        'origin_pred': deep_dot(origin=features['origin'], kernel=emit, kernel_size=depth_ks),
-        'left': features['left'],
-        'left_pred': deep_dot(origin=features['left'], kernel=emit, kernel_size=depth_ks),
-        'right': features['right'],
-      }
-    else:
-      pred = deep_dot(origin=features['left'], kernel=emit, kernel_size=depth_ks)
-      logging.info(f'the shape of pred is {pred.get_shape().as_list()}')
-
-    if mode == tf.estimator.ModeKeys.TRAIN:
-      loss = tf.reduce_mean(MAE(pred, labels))
-      opt = tf.compat.v1.train.MomentumOptimizer(learning_rate=0.001, momentum=0.9)
-      train_op = opt.minimize(loss=loss, global_step=tf.compat.v1.train.get_or_create_global_step())
-      return tf.estimator.EstimatorSpec(mode=mode, loss=loss, train_op=train_op, predictions=pred)
-    elif mode == tf.estimator.ModeKeys.EVAL:
-      loss = tf.reduce_mean(MAE(pred, labels))
-      return tf.estimator.EstimatorSpec(mode=mode, loss=loss, predictions=pred)
-    else:
-      return tf.estimator.EstimatorSpec(mode=mode, predictions=pred)
+flags.DEFINE_string('report_file', '', 'where to write the stage timers, queue depths and peak RSS of the run, as csv '
+                   'for .csv and json otherwise, empty for none')
+flags.DEFINE_bool('trace', False, 'annotate the pipeline stages in the TensorFlow profiler trace')
+flags.DEFINE_float('skip_threshold', 0.0, 'reuse the kernel of the last key frame for frames whose left view '
+                   'differs from it by at most this mean absolute difference, in [0, 1) as the features go from 0 '
+                   'to 1 rather than in gray levels like scene_threshold: 8 gray levels are 8 / 255 = 0.031. 0 runs '
+                   'the network on every frame')
+flags.DEFINE_bool('skip_eval', False, 'also run the network on every frame to report what skip_threshold costs')
+flags.DEFINE_integer('tile_rows', 0, 'compose the full resolution frames outside the graph in strips of this many '
+                     'rows, with memory bounded by the strip rather than by the batch, 0 composes whole batches')
+flags.DEFINE_string('vgg16', '/Users/fitz/data/code/deep3d/vgg_16.ckpt', 'VGG16 checkpoint fresh training starts from')
+flags.DEFINE_string('vgg16_cache', '', 'the conv layers extracted from vgg16, next to the checkpoint when empty')
+flags.DEFINE_enum('distribute', 'none', ['none', 'multi_worker'], 'multi_worker trains data parallel with '
+                  'MultiWorkerMirroredStrategy over the workers of TF_CONFIG, batch_size being the global batch, see '
+                  'deep3d/local_cluster.py to run the workers on one host')
+flags.DEFINE_integer('train_steps', 0, 'global steps to train for, 0 trains until the input runs out, which '
+                     'multi_worker does not support as the shards of the workers differ in length')
+flags.DEFINE_integer('accumulation_steps', 1, 'apply the mean gradient of this many batches at once, for effective '
+                     'batches of accumulation_steps * batch_size that do not fit in memory')
+flags.DEFINE_string('int8_model', '', 'TFLite model of the network with INT8 convolutions, which quantize writes and '
+                    'convert runs instead of the float network when set, with the softmax and DeepDot in float')
+flags.DEFINE_integer('calibration_frames', 256, 'frames across file_name the INT8 activation ranges are calibrated on')
+flags.DEFINE_integer('quality_frames', 64, 'frames quantize compares the INT8 origin_pred to the float one on')
+flags.DEFINE_string('manifest', '', 'csv of the movies batch converts, one input,output[,video_type] line each, '
+                    'video_type being lr3d, ud3d or simple and vt when left out. They are resized to the views of vt')
+flags.DEFINE_integer('segment_frames', 1000, 'frames of each output segment of batch, which resumes a movie from the '
+                     'first segment it did not write when run again')
+flags.DEFINE_integer('concurrent_movies', 2, 'movies batch decodes at once, their frames share the inference batches')
+flags.DEFINE_bool('audio', True, 'copy the audio of each input movie into its output in batch')
+flags.DEFINE_list('scales', [], 'convert runs the network on each frame at one of these scales of the views it is '
+                  'trained on, from coarse to fine, picked from the detail of the frame, e.g. 0.5,1,1.5')
+flags.DEFINE_list('scale_thresholds', [], 'the detail, mean absolute gradient in gray levels of the left view at '
+                  'scale 1, above which a frame gets the next scale, one less than scales')
+flags.DEFINE_float('scene_threshold', 0.0, 'keep the scale of a scene until the thumbnail of the left view moves this '
+                   'many gray levels in mean from the frame it was picked on, 0 picks for every frame')
+flags.DEFINE_string('scale_report', '', 'where to write every scale decision with its timings as csv')
+
+
+def report_skips(predict):
+  """Wraps `predict` of deep3d.convert to log how many frames reused a kernel, and what it cost with skip_eval."""
+
+  def predict_and_report(frames):
+    num_frames, num_skipped, error = 0, 0, None
+    for batch in predict(frames):
+      num_frames += len(batch['skipped'])
+      num_skipped += int(batch['skipped'].sum())
+      if 'skip_error' in batch:
+        error = (error or 0.0) + float(batch['skip_error'].sum())
+      yield batch
+    message = f'reused the kernel of {num_skipped}/{num_frames} frames ({num_skipped / max(num_frames, 1):.1%})'
+    if error is not None:
+      message += f', left_pred is off by {255 * error / max(num_frames, 1):.2f} gray levels on average'
+    logging.info(message)
+
+  return predict_and_report
 
 
 def main(_):
   tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.INFO)
   if FLAGS.profiler:
     tf.profiler.experimental.server.start(6009)
-  model = Deep3dModel(FLAGS.file_name, FLAGS.depth_ks, FLAGS.num_epoch, FLAGS.batch_size,
-                      FLAGS.drop_remainder, FLAGS.vt, FLAGS.ot)
-  config = tf.estimator.RunConfig(save_checkpoints_steps=100, save_summary_steps=20)
+  instruments.trace = FLAGS.trace
+  if FLAGS.mixed_precision != 'none':
+    tf.keras.mixed_precision.set_global_policy(f'mixed_{FLAGS.mixed_precision}')
+  scales = [float(scale) for scale in FLAGS.scales] if FLAGS.mode == 'convert' else []
+  if scales and (FLAGS.raw_frames or FLAGS.skip_threshold > 0 or FLAGS.int8_model):
+    raise ValueError('scales read the features the frame reader preprocesses, not raw_frames, and run the float '
+                     'network on every frame, without skip_threshold or int8_model')
+  jobs = parse_manifest(FLAGS.manifest, VideoType[FLAGS.vt.upper()]) if FLAGS.mode == 'batch' else []
+  # batch takes the views of vt from the model, which any movie of the manifest opens for
+  model = Deep3dModel(jobs[0].input if jobs else FLAGS.file_name, FLAGS.depth_ks, FLAGS.num_epoch, FLAGS.batch_size,
+                      FLAGS.drop_remainder, FLAGS.vt, FLAGS.ot, FLAGS.interpolation,
+                      FLAGS.fused_softmax, FLAGS.uint8_origin, FLAGS.num_decoders,
+                      FLAGS.raw_frames, FLAGS.cache_dir, FLAGS.cache_origin, FLAGS.shuffle_buffer,
+                      FLAGS.library, FLAGS.frames_per_scene, FLAGS.vgg16, FLAGS.vgg16_cache,
+                      FLAGS.skip_threshold, FLAGS.skip_eval, FLAGS.tile_rows, FLAGS.accumulation_steps,
+                      view_scale=scales[-1] if scales else 1.0)
+  strategy = None
+  if FLAGS.distribute == 'multi_worker':
+    if FLAGS.train_steps <= 0:
+      raise ValueError('multi_worker training needs train_steps, the workers read shards of different lengths')
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+  int8 = FLAGS.mode == 'quantize' or (FLAGS.mode == 'convert' and FLAGS.int8_model)
+  if int8 and (FLAGS.raw_frames or not FLAGS.int8_model):
+    raise ValueError('the INT8 network needs int8_model, and reads the features the frame reader preprocesses, '
+                     'not raw_frames')
+  config = tf.estimator.RunConfig(save_checkpoints_steps=100, save_summary_steps=20, train_distribute=strategy)
   estimator = tf.estimator.Estimator(model_fn=model.model_fn,
                                      model_dir=FLAGS.model_dir, config=config)
 
-  # estimator.train(input_fn=model.input_fn)
-  if model.origin_type == OriginType.COLOR:
-    # size = (2 * model.origin_size[1], model.origin_size[0])  # (width, height)
-    ratio = min(model.origin_size[0] / 1080, model.origin_size[1] / 1200)
-    if model.origin_size[1] / 1200 > model.origin_size[0] / 1080:
-      size = (int(model.origin_size[1] * ratio) * 2, model.origin_size[0])
-    else:
-      size = (model.origin_size[1] * 2, int(model.origin_size[0] / ratio))
+  if FLAGS.mode == 'train' and strategy is not None:
+    # the estimator only runs the workers of TF_CONFIG through train_and_evaluate, without an evaluator task it
+    # only trains
+    tf.estimator.train_and_evaluate(estimator, tf.estimator.TrainSpec(model.input_fn, max_steps=FLAGS.train_steps),
+                                    tf.estimator.EvalSpec(model.input_fn, steps=1))
+  elif FLAGS.mode == 'train':
+    estimator.train(input_fn=model.input_fn, max_steps=FLAGS.train_steps or None)
+  elif FLAGS.mode == 'export':
+    estimator.export_saved_model(FLAGS.export_dir, model.serving_input_receiver_fn)
+  elif FLAGS.mode == 'quantize':
+    tflite_model = FloatTrunk(model, FLAGS.model_dir, batch_size=1).to_int8(
+      lambda: calibration_features(model.frame_reader, FLAGS.calibration_frames))
+    with tf.io.gfile.GFile(FLAGS.int8_model, 'wb') as f:
+      f.write(tflite_model)
+    composer = TiledComposer(FLAGS.depth_ks, FLAGS.interpolation, softmax=True, tile_rows=FLAGS.tile_rows or 64)
+    compare(FloatTrunk(model, FLAGS.model_dir), Int8Trunk(tflite_model), composer, model.frame_reader, model.origin,
+            FLAGS.quality_frames, FLAGS.batch_size)
+  elif FLAGS.mode == 'batch':
+    # the network runs on the views of vt, every movie of the manifest is resized to them
+    trunk = Int8Trunk.load(FLAGS.int8_model) if FLAGS.int8_model else FloatTrunk(model, FLAGS.model_dir)
+    composer = TiledComposer(FLAGS.depth_ks, FLAGS.interpolation, softmax=True, tile_rows=FLAGS.tile_rows or 64)
+    _, failures = batch_convert(jobs, trunk, composer,
+                                Shape(model.frame_reader.height, model.frame_reader.width), FLAGS.batch_size,
+                                model.origin_type, FLAGS.segment_frames, FLAGS.concurrent_movies, FLAGS.queue_size,
+                                FLAGS.layout, FLAGS.audio)
+    if failures:
+      raise RuntimeError(f'{len(failures)} of {len(jobs)} movies failed: {", ".join(job.input for job in failures)}')
   else:
-    size = (model.origin_size[1], model.origin_size[0])  # (width, height)
-
-  with save('/Volumes/data/baidu/carrier2.mp4', model.fourcc, model.fps, size, True) as writer:
-    for predictions in estimator.predict(input_fn=model.input_fn):
-      if model.origin_type == OriginType.COLOR:
-        origin, origin_pred = predictions['origin'], predictions['origin_pred']
-        height, width = origin.shape[0], origin.shape[1]
-        ratio = min(width / 1200, height / 1080)
-        if width / 1200 > height / 1080:
-          real_width = int(width * ratio)
-          start = int((width - real_width) / 2)
-          end = start + real_width
-          new_origin = origin[:, start:end, :]
-          new_origin_pred = origin_pred[:, start:end, :]
-        else:
-          real_height = int(height / ratio)
-          start = int((real_height - height) / 2)
-          end = start + height
-          new_origin = np.zeros(shape=(real_height, width, 3))
-          new_origin_pred = np.zeros(shape=(real_height, width, 3))
-
-          new_origin[start:end, :, :] = origin[:, :, :]
-          new_origin_pred[start:end, :, :] = origin_pred[:, :, :]
-
-        img = np.concatenate([new_origin, new_origin_pred], axis=1)
-      else:
-        img = np.stack([predictions['origin'],
-                        np.zeros_like(predictions['origin']),
-                        predictions['origin_pred']], axis=-1)
-        img = np.squeeze(img, axis=2)
-      img = (img * 255).astype(np.uint8)
-      writer.write(img)
-      cv2.waitKey(20)
+    writer_options = {}
+    if FLAGS.encoder == 'ffmpeg':
+      writer_options = {'backend': 'ffmpeg', 'audio': FLAGS.file_name, 'crf': FLAGS.crf, 'preset': FLAGS.preset}
+    if scales:
+      # the frames are read at the finest scale, the kernel of each comes out at its own and DeepDot stretches it
+      trunk = FloatTrunk(model, FLAGS.model_dir, any_size=True)
+      picker = ScalePicker(scales, [float(threshold) for threshold in FLAGS.scale_thresholds], FLAGS.scene_threshold,
+                           model.view)
+      composer = TiledComposer(FLAGS.depth_ks, FLAGS.interpolation, softmax=True, tile_rows=FLAGS.tile_rows or 64)
+      predict = tiled_predict(multiscale_predict(trunk, picker, model.view, FLAGS.batch_size, FLAGS.scale_report),
+                              composer, model.origin)
+    elif FLAGS.int8_model:
+      # the INT8 network only returns the logits, the softmax and DeepDot run in float on the full resolution origins
+      composer = TiledComposer(FLAGS.depth_ks, FLAGS.interpolation, softmax=True, tile_rows=FLAGS.tile_rows or 64)
+      predict = tiled_predict(trunk_predict(Int8Trunk.load(FLAGS.int8_model), FLAGS.batch_size), composer,
+                              model.origin)
+    else:
+      predict = estimator_predict(estimator, model.input_fn)
+      if FLAGS.skip_threshold > 0:
+        predict = report_skips(predict)
+      if FLAGS.tile_rows > 0:
+        composer = TiledComposer(FLAGS.depth_ks, FLAGS.interpolation, FLAGS.fused_softmax, FLAGS.tile_rows)
+        predict = tiled_predict(predict, composer, model.origin)
+    convert(predict, model.frame_reader, FLAGS.output_file,
+            model.origin_type, queue_size=FLAGS.queue_size, writer_options=writer_options, layout=FLAGS.layout)
+  if FLAGS.report_file:
+    instruments.write(FLAGS.report_file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,79 @@
+import os
+import time
+import tempfile
+import tensorflow as tf
+from absl import flags
+
+from deep3d.convert import convert, estimator_predict
+from deep3d.data import VideoType
+from deep3d.model import Deep3dModel
+from deep3d.synthetic import stereo_video
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('video', '', 'movie to train on and convert, a synthetic 1080p side-by-side clip when empty')
+flags.DEFINE_integer('num_frames', 96, 'frames in the synthetic clip')
+flags.DEFINE_integer('train_steps', 10, 'training steps timed, after the first one that builds and warms up')
+
+
+class _StepTimer(tf.estimator.SessionRunHook):
+  # the first step runs the initializers and fills the input pipeline, it is left out
+  def __init__(self):
+    self.steps, self.wall_time, self._start = -1, 0.0, 0.0
+
+  def before_run(self, run_context):
+    self._start = time.time()
+
+  def after_run(self, run_context, run_values):
+    self.steps += 1
+    if self.steps > 0:
+      self.wall_time += time.time() - self._start
+
+
+class Deep3dModelBenchmark(tf.test.Benchmark):
+  """Training steps and conversion frames per second of Deep3dModel, configured by the flags of deep3d.model."""
+
+  def _video(self) -> str:
+    if FLAGS.video:
+      return FLAGS.video
+    file_name = os.path.join(tf.compat.v1.test.get_temp_dir(), f'model_{FLAGS.num_frames}.mp4')
+    if not os.path.exists(file_name):
+      stereo_video(file_name, FLAGS.num_frames, 1080, 960, VideoType.LR3D)
+    return file_name
+
+  def _estimator(self):
+    # no vgg16, the network starts from random weights, which runs as fast as the pretrained ones
+    model = Deep3dModel(self._video(), FLAGS.depth_ks, FLAGS.num_epoch, FLAGS.batch_size,
+                        FLAGS.drop_remainder, FLAGS.vt, FLAGS.ot, FLAGS.interpolation,
+                        FLAGS.fused_softmax, FLAGS.uint8_origin, FLAGS.num_decoders,
+                        FLAGS.raw_frames, FLAGS.cache_dir, FLAGS.cache_origin, FLAGS.shuffle_buffer,
+                        FLAGS.library, FLAGS.frames_per_scene, skip_threshold=FLAGS.skip_threshold,
+                        tile_rows=FLAGS.tile_rows)
+    model_dir = tempfile.mkdtemp(dir=tf.compat.v1.test.get_temp_dir())
+    return model, tf.estimator.Estimator(model_fn=model.model_fn, model_dir=model_dir)
+
+  def benchmark_train(self):
+    model, estimator = self._estimator()
+    timer = _StepTimer()
+    estimator.train(input_fn=model.input_fn, steps=FLAGS.train_steps + 1, hooks=[timer])
+    self.report_benchmark(iters=timer.steps, wall_time=timer.wall_time / max(timer.steps, 1), name='train',
+                          extras={'steps_per_second': timer.steps / max(timer.wall_time, 1e-6),
+                                  'frames_per_second': timer.steps * FLAGS.batch_size / max(timer.wall_time, 1e-6),
+                                  'batch_size': FLAGS.batch_size})
+
+  def benchmark_convert(self):
+    # end to end, from the movie to the written 3D movie, with the graph built and restored along the way
+    model, estimator = self._estimator()
+    output_file = os.path.join(tf.compat.v1.test.get_temp_dir(), 'converted.mp4')
+    start = time.time()
+    stages = convert(estimator_predict(estimator, model.input_fn), model.frame_reader, output_file,
+                     model.origin_type, queue_size=FLAGS.queue_size)
+    wall_time = time.time() - start
+    num_frames = stages['encode'].frames
+    extras = {'frames_per_second': num_frames / wall_time}
+    extras.update({f'{name}_frames_per_second': stage.fps for name, stage in stages.items()})
+    self.report_benchmark(iters=num_frames, wall_time=wall_time / max(num_frames, 1), name='convert', extras=extras)
+
+
+if __name__ == '__main__':
+  tf.compat.v1.disable_eager_execution()
+  tf.test.main()
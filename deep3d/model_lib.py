@@ -0,0 +1,336 @@
+import numpy as np
+from absl import logging
+from typing import Dict
+
+import tensorflow as tf
+from tensorflow.keras.layers import Conv2D, MaxPooling2D, BatchNormalization, Conv2DTranspose, ReLU, Softmax
+from tensorflow.keras.losses import MAE
+from deep3d.utils import load_vgg16, bilinear
+from deep3d.accumulate import GradientAccumulationOptimizer
+from deep3d.data import FrameGenerator, ParallelFrameGenerator, RawFrameGenerator, VideoType, OriginType, Shape
+from deep3d.data import frame_size, view_size, split_frame, split_frames, stack_frames
+from deep3d.cache import FrameCache
+from deep3d.library import MovieLibrary, parse_library
+from deep3d.multiscale import scale_view
+from deep3d.deep_dot import deep_dot, softmax_deep_dot, quantized_deep_dot
+from deep3d.skip import thumbnail, select_key_frames
+
+
+class Deep3dModel(object):
+  def __init__(self, file_name, depth_ks: int, num_epoch: int = 1, batch_size: int = 64,
+               drop_remainder: bool = True, video_type: str = 'lr3d', origin_type='color',
+               interpolation: str = 'nearest', fused_softmax: bool = False, uint8_origin: bool = False,
+               num_decoders: int = 1, raw_frames: bool = False, cache_dir: str = None,
+               cache_origin: bool = False, shuffle_buffer: int = 4096, library: str = None,
+               frames_per_scene: int = 8, vgg16: str = None, vgg16_cache: str = None,
+               skip_threshold: float = 0.0, skip_eval: bool = False, tile_rows: int = 0,
+               accumulation_steps: int = 1, view_scale: float = 1.0):
+    self.num_epoch = num_epoch
+    self.video_type = VideoType[video_type.upper()]
+    self.origin_type = OriginType[origin_type.upper()]
+    self.batch_size = batch_size
+    self.drop_remainder = drop_remainder
+    self._depth_ks = depth_ks
+    self._interpolation = interpolation
+    self._fused_softmax = fused_softmax
+    self._uint8_origin = uint8_origin
+    self._shuffle_buffer = shuffle_buffer
+    self._vgg16 = vgg16
+    self._vgg16_cache = vgg16_cache
+    if not 0 <= skip_threshold < 1:
+      raise ValueError(f'skip_threshold {skip_threshold} is out of [0, 1), it compares left views that go from 0 to 1')
+    self._skip_threshold = skip_threshold
+    self._skip_eval = skip_eval
+    self._tile_rows = tile_rows
+    self._accumulation_steps = accumulation_steps
+    # the views the network is trained on, the frames are read at view_scale times their size
+    self.view = view_size(Shape(256, 448), self.video_type)
+    resize = frame_size(scale_view(self.view, view_scale), self.video_type)
+
+    if raw_frames:
+      self.frame_reader = RawFrameGenerator(file_name,
+                                            num_epoch=self.num_epoch,
+                                            video_type=self.video_type,
+                                            resize=resize,
+                                            origin_type=self.origin_type)
+    elif num_decoders > 1:
+      self.frame_reader = ParallelFrameGenerator(file_name,
+                                                 num_epoch=self.num_epoch,
+                                                 video_type=self.video_type,
+                                                 resize=resize,
+                                                 origin_type=self.origin_type,
+                                                 num_workers=num_decoders)
+    else:
+      self.frame_reader = FrameGenerator(file_name,
+                                         num_epoch=self.num_epoch,
+                                         video_type=self.video_type,
+                                         resize=resize,
+                                         origin_type=self.origin_type)
+
+    self._library = None
+    if library:
+      # the scene index goes next to the frame cache, the views match the frames file_name is predicted on
+      self._library = MovieLibrary(parse_library(library, default_video_type=self.video_type),
+                                   view=Shape(self.frame_reader.height, self.frame_reader.width),
+                                   frames_per_scene=frames_per_scene, index_dir=cache_dir or None)
+    self._cache = None
+    if cache_dir:
+      self._cache = FrameCache(cache_dir, file_name, video_type=self.video_type, resize=resize,
+                               origin_type=self.origin_type, with_origin=cache_origin)
+
+  def __deepcopy__(self, memo):
+    # train_and_evaluate deep copies the estimator along with model_fn, the copy shares the readers of the movie
+    return self
+
+  @property
+  def fps(self):
+    return self.frame_reader.fps
+
+  @property
+  def origin_size(self):
+    return self.frame_reader.origin_size
+
+  @property
+  def fourcc(self):
+    return self.frame_reader.fourcc
+
+  def origin(self, frame: Dict[str, np.ndarray]) -> np.ndarray:
+    """The uint8 full resolution origin of an item of frame_reader."""
+    if 'origin' in frame:
+      return frame['origin']
+    return split_frame(frame['frame'], self.video_type, self.origin_type, self.frame_reader.resize)[0]
+
+  def input_fn(self, mode: str = None, frames=None,
+               input_context: tf.distribute.InputContext = None) -> tf.data.Dataset:
+    def map_fn(features):
+      # the full resolution origin is only composed, QuantizedDeepDot reads it as uint8 directly, and tiled
+      # prediction composes it outside of the graph, see deep3d.tiling
+      if self._tile_rows > 0 and mode == tf.estimator.ModeKeys.PREDICT:
+        features = {key: value for key, value in features.items() if key != 'origin'}
+      return {key: value if key == 'origin' and self._uint8_origin else tf.cast(value, dtype=tf.float32) / 255.0
+              for key, value in features.items()}
+
+    # a distributed training gives each worker its own shard of the frames, batch_size is the global batch
+    batch_size, num_shards, index = self.batch_size, 1, 0
+    if input_context is not None and mode == tf.estimator.ModeKeys.TRAIN:
+      batch_size = input_context.get_per_replica_batch_size(self.batch_size)
+      num_shards, index = input_context.num_input_pipelines, input_context.input_pipeline_id
+    # a new shard every pass, so the dataset can repeat
+    reader = self.frame_reader if num_shards == 1 else lambda: self.frame_reader.shard(num_shards, index)
+
+    if self._library is not None and mode == tf.estimator.ModeKeys.TRAIN:
+      dataset = self._library.dataset(num_epoch=self.num_epoch, shuffle_buffer=self._shuffle_buffer,
+                                      num_shards=num_shards, index=index)
+      dataset = dataset.map(map_fn, num_parallel_calls=tf.data.AUTOTUNE)
+      dataset = dataset.batch(batch_size=batch_size, drop_remainder=self.drop_remainder)
+    elif (frames is None and self._cache is not None and (num_shards == 1 or self._cache.complete) and
+          (mode != tf.estimator.ModeKeys.PREDICT or 'origin' in self._cache.keys)):
+      # only training sees the frames shuffled, predict needs them in order. the workers of a distributed training
+      # share a complete cache, but do not write one
+      shuffle_buffer = self._shuffle_buffer if mode == tf.estimator.ModeKeys.TRAIN else 0
+      dataset = self._cache.dataset(num_epoch=self.num_epoch, shuffle_buffer=shuffle_buffer)
+      if num_shards > 1:
+        dataset = dataset.shard(num_shards, index)
+      dataset = dataset.map(map_fn, num_parallel_calls=tf.data.AUTOTUNE)
+      dataset = dataset.batch(batch_size=batch_size, drop_remainder=self.drop_remainder)
+    elif isinstance(self.frame_reader, RawFrameGenerator):
+      dataset = self.frame_reader.dataset(batch_size=batch_size, drop_remainder=self.drop_remainder,
+                                          generator=frames or reader)
+      dataset = dataset.map(map_fn, num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+      dataset = tf.data.Dataset.from_generator(generator=frames or reader,
+                                               output_signature=self.frame_reader.signature)
+      dataset = dataset.map(map_fn).batch(batch_size=batch_size, drop_remainder=self.drop_remainder)
+    if num_shards > 1:
+      # the shards differ in length, a worker running out first would leave the others waiting in the all-reduce
+      dataset = dataset.repeat()
+    dataset = dataset.prefetch(buffer_size=tf.data.AUTOTUNE)
+
+    return dataset
+
+  def serving_input_receiver_fn(self) -> tf.estimator.export.ServingInputReceiver:
+    """Fixed shape serving input: a batch of uint8 BGR frames as decoded, and the left views of the two frames before.
+
+    The frames are preprocessed in the graph like RawFrameGenerator does, the exported signature returns the uint8
+    stereo pair and the context to feed with the next batch of the movie.
+    """
+    height, width = self.origin_size
+    frames = tf.compat.v1.placeholder(dtype=tf.uint8, shape=(self.batch_size, height, width, 3), name='frames')
+    context = tf.compat.v1.placeholder(dtype=tf.uint8, shape=(2, self.frame_reader.height, self.frame_reader.width),
+                                       name='context')
+    features = split_frames(frames, self.video_type, self.origin_type, self.frame_reader.resize)
+    next_context, features = stack_frames(context, features)
+    features = {key: value if key == 'origin' else tf.cast(value, dtype=tf.float32) / 255.0
+                for key, value in features.items()}
+    features['context'] = next_context
+    return tf.estimator.export.ServingInputReceiver(features, {'frames': frames, 'context': context})
+
+  def _initializers(self, mode: str, config: tf.estimator.RunConfig):
+    # the VGG16 layers only matter to a training that starts fresh, anything else restores them from model_dir
+    fresh = mode == tf.estimator.ModeKeys.TRAIN and not tf.train.latest_checkpoint(config.model_dir)
+    if not (fresh and self._vgg16):
+      return lambda name: {}
+    params = load_vgg16(self._vgg16, self._vgg16_cache or None)
+    return lambda name: {'kernel_initializer': tf.constant_initializer(params[f'{name}/weights']),
+                         'bias_initializer': tf.constant_initializer(params[f'{name}/biases'])}
+
+  def _kernel(self, data: tf.Tensor, vgg16, softmax: bool = True) -> tf.Tensor:
+    """The per pixel deep_dot kernel of a batch of features, the network itself, as logits without `softmax`."""
+    depth = self._depth_ks ** 2
+
+    # group 1
+    data = Conv2D(filters=64, kernel_size=(3, 3), activation='relu', padding="same", name='conv1_1',
+                  **vgg16('conv1_1'))(data)
+    data = Conv2D(filters=64, kernel_size=(3, 3), activation='relu', padding="same", name='conv1_2',
+                  **vgg16('conv1_2'))(data)
+    data = MaxPooling2D(pool_size=(2, 2), strides=(2, 2))(data)
+    emit1 = BatchNormalization()(data)
+    emit1 = Conv2D(filters=depth, kernel_size=(3, 3), padding="same", activation='relu')(emit1)
+    logging.info(f'the shape of emit1 is {emit1.get_shape().as_list()}]')
+    emit1 = Conv2DTranspose(filters=depth, kernel_size=(1, 1), strides=(1, 1), use_bias=False)(emit1)
+    logging.info(f'the shape of emit1 after Conv2DTranspose is {emit1.get_shape().as_list()}')
+
+    # group 2
+    data = Conv2D(filters=128, kernel_size=(3, 3), activation='relu', padding="same", name='conv2_1',
+                  **vgg16('conv2_1'))(data)
+    data = Conv2D(filters=128, kernel_size=(3, 3), activation='relu', padding="same", name='conv2_2',
+                  **vgg16('conv2_2'))(data)
+    data = MaxPooling2D(pool_size=(2, 2), strides=(2, 2))(data)
+    emit2 = BatchNormalization()(data)
+    emit2 = Conv2D(filters=depth, kernel_size=(3, 3), padding="same", activation='relu')(emit2)
+    logging.info(f'the shape of emit2 is {emit2.get_shape().as_list()}]')
+    emit2 = Conv2DTranspose(filters=depth, kernel_size=(4, 4), strides=(2, 2), padding="same", use_bias=False,
+                            kernel_initializer=tf.constant_initializer(bilinear(shape=[4, 4, depth, depth])))(emit2)
+    logging.info(f'the shape of emit2 after Conv2DTranspose is {emit2.get_shape().as_list()}')
+
+    # group 3
+    data = Conv2D(filters=256, kernel_size=(3, 3), activation='relu', padding="same", name='conv3_1',
+                  **vgg16('conv3_1'))(data)
+    data = Conv2D(filters=256, kernel_size=(3, 3), activation='relu', padding="same", name='conv3_2',
+                  **vgg16('conv3_2'))(data)
+    data = MaxPooling2D(pool_size=(2, 2), strides=(2, 2))(data)
+    emit3 = BatchNormalization()(data)
+    emit3 = Conv2D(filters=depth, kernel_size=(3, 3), padding="same", activation='relu')(emit3)
+    logging.info(f'the shape of emit3 is {emit3.get_shape().as_list()}')
+    emit3 = Conv2DTranspose(filters=depth, kernel_size=(8, 8), strides=(4, 4), padding="same", use_bias=False,
+                            kernel_initializer=tf.constant_initializer(bilinear(shape=[8, 8, depth, depth])))(emit3)
+    logging.info(f'the shape of emit3 after Conv2DTranspose is {emit3.get_shape().as_list()}')
+
+    emit = ReLU()(emit1 * emit2 * emit3)
+    emit = Conv2DTranspose(filters=depth, kernel_size=(4, 4), strides=(2, 2), padding="same", use_bias=False,
+                           kernel_initializer=tf.constant_initializer(bilinear(shape=[4, 4, depth, depth])))(emit)
+    logging.info(f'the shape of emit after Conv2DTranspose is {emit.get_shape().as_list()}')
+    emit = Conv2D(filters=depth, kernel_size=(3, 3), padding="same")(ReLU()(emit))
+    if softmax and not self._fused_softmax:
+      # with fused_softmax emit stays as logits, the op applies the softmax so the probabilities are never stored
+      emit = Softmax(axis=-1)(emit)
+    logging.info(f'the shape of emit is {emit.get_shape().as_list()}')
+    return emit
+
+  def logits(self, feature: tf.Tensor) -> tf.Tensor:
+    """The kernel logits of a batch of float features, with the variables of model_fn, see deep3d.quantize."""
+    return self._kernel(feature, lambda name: {}, softmax=False)
+
+  def _reuse_kernels(self, features: Dict[str, tf.Tensor], vgg16):
+    """Runs the network on the key frames only, the other frames reuse the kernel of the last key frame.
+
+    The last kernel and the thumbnail it was computed for carry over from one predict batch to the next in local
+    variables. With skip_eval the network also runs on every frame, to measure what reusing costs on left_pred.
+    """
+    left = features['left']
+    thumbnails = thumbnail(left)
+    reference = tf.compat.v1.get_local_variable('skip_reference', initializer=tf.zeros_like(thumbnails[0]),
+                                                use_resource=True)
+    # no key frame before the first batch, its first frame is one
+    has_reference = tf.compat.v1.get_local_variable('skip_has_reference', initializer=tf.constant(False),
+                                                    use_resource=True)
+    is_key, kernel_index, next_reference = select_key_frames(thumbnails, reference.read_value(),
+                                                             has_reference.read_value(), self._skip_threshold)
+    key_frames = tf.cast(tf.where(is_key)[:, 0], tf.int32)
+    batch_size = tf.shape(left)[0]
+    indices = tf.concat([key_frames, tf.range(batch_size)], axis=0) if self._skip_eval else key_frames
+    # the convolutions do not take an empty batch, a batch without key frames runs one frame for nothing
+    indices = tf.cond(tf.size(indices) > 0, lambda: indices, lambda: tf.zeros([1], dtype=tf.int32))
+    kernels = self._kernel(tf.gather(features['feature'], indices), vgg16)
+
+    last_kernel = tf.compat.v1.get_local_variable('skip_kernel', shape=kernels.shape[1:], dtype=kernels.dtype,
+                                                  initializer=tf.zeros_initializer(), use_resource=True)
+    num_keys = tf.size(key_frames)
+    candidates = tf.concat([tf.expand_dims(last_kernel.read_value(), axis=0), kernels[:num_keys]], axis=0)
+    emit = tf.gather(candidates, kernel_index)
+    with tf.control_dependencies([emit]):
+      updates = [reference.assign(next_reference), has_reference.assign(True), last_kernel.assign(candidates[-1])]
+    with tf.control_dependencies(updates):
+      emit = tf.identity(emit)
+
+    skip = {'skipped': tf.logical_not(is_key)}
+    if self._skip_eval:
+      compose = softmax_deep_dot if self._fused_softmax else deep_dot
+      full = compose(tf.cast(left, emit.dtype), kernels[num_keys:], kernel_size=self._depth_ks,
+                     interpolation=self._interpolation)
+      reused = compose(tf.cast(left, emit.dtype), emit, kernel_size=self._depth_ks,
+                       interpolation=self._interpolation)
+      skip['skip_error'] = tf.reduce_mean(tf.abs(tf.cast(reused - full, tf.float32)), axis=[1, 2, 3])
+    return emit, skip
+
+  def model_fn(self, features: Dict[str, tf.Tensor],
+               labels: tf.Tensor,
+               mode: str,
+               config: tf.estimator.RunConfig) -> tf.estimator.EstimatorSpec:
+    labels = labels or features.get('right', None)
+    logging.info(f'the shape of left is {features["feature"].get_shape().as_list()}')
+    depth_ks = self._depth_ks
+    vgg16 = self._initializers(mode, config)
+    compose = softmax_deep_dot if self._fused_softmax else deep_dot
+
+    skip = None
+    if mode == tf.estimator.ModeKeys.PREDICT and self._skip_threshold > 0 and 'context' not in features:
+      emit, skip = self._reuse_kernels(features, vgg16)
+    else:
+      emit = self._kernel(features['feature'], vgg16)
+
+    def apply(origin: tf.Tensor) -> tf.Tensor:
+      if origin.dtype == tf.uint8:
+        return quantized_deep_dot(origin, emit, kernel_size=depth_ks, interpolation=self._interpolation,
+                                  softmax=self._fused_softmax, out_type=tf.uint8)
+      # under a mixed precision policy emit is float16/bfloat16, the op accumulates in float either way
+      composed = compose(tf.cast(origin, emit.dtype), emit, kernel_size=depth_ks,
+                         interpolation=self._interpolation)
+      return tf.cast(composed, tf.float32)
+
+    if mode == tf.estimator.ModeKeys.PREDICT:
+      pred = {
+        'left': features['left'],
+        'left_pred': apply(features['left']),
+        'right': features['right'],
+      }
+      if 'origin' in features:
+        pred.update({'origin': features['origin'], 'origin_pred': apply(features['origin'])})
+      else:
+        pred['kernel'] = emit
+      if skip is not None:
+        pred.update(skip)
+    else:
+      pred = apply(features['left'])
+      logging.info(f'the shape of pred is {pred.get_shape().as_list()}')
+
+    if mode == tf.estimator.ModeKeys.TRAIN:
+      loss = tf.reduce_mean(MAE(pred, labels))
+      opt = tf.compat.v1.train.MomentumOptimizer(learning_rate=0.001, momentum=0.9)
+      if emit.dtype == tf.float16:
+        # bfloat16 has the exponent range of float32, only float16 gradients need loss scaling
+        opt = tf.compat.v1.mixed_precision.MixedPrecisionLossScaleOptimizer(opt, loss_scale='dynamic')
+      if self._accumulation_steps > 1:
+        opt = GradientAccumulationOptimizer(opt, self._accumulation_steps)
+      train_op = opt.minimize(loss=loss, global_step=tf.compat.v1.train.get_or_create_global_step())
+      return tf.estimator.EstimatorSpec(mode=mode, loss=loss, train_op=train_op, predictions=pred)
+    elif mode == tf.estimator.ModeKeys.EVAL:
+      loss = tf.reduce_mean(MAE(pred, labels))
+      return tf.estimator.EstimatorSpec(mode=mode, loss=loss, predictions=pred)
+    else:
+      export_outputs = None
+      if 'context' in features:
+        # exporting, see serving_input_receiver_fn
+        export_outputs = {'serving_default': tf.estimator.export.PredictOutput({
+          'left': features['origin'], 'right': pred['origin_pred'], 'context': features['context']})}
+      return tf.estimator.EstimatorSpec(mode=mode, predictions=pred, export_outputs=export_outputs)
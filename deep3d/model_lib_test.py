@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import tensorflow as tf
+
+from deep3d.model_lib import Deep3dModel
+from deep3d.synthetic import stereo_video
+
+
+class Deep3dModelTest(tf.test.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 10 frames predict in batches of 4, 4 and 2
+        cls.file_name = os.path.join(tf.compat.v1.test.get_temp_dir(), 'model.mp4')
+        stereo_video(cls.file_name, 10, height=64, width=56)
+        cls.model_dir = os.path.join(tf.compat.v1.test.get_temp_dir(), 'ckpt')
+        model = cls.model()
+        tf.estimator.Estimator(model.model_fn, model_dir=cls.model_dir).train(model.input_fn, steps=1)
+
+    @classmethod
+    def model(cls, **kwargs) -> Deep3dModel:
+        # tile_rows leaves the origin out of predict, which then returns the kernels
+        return Deep3dModel(cls.file_name, 4, batch_size=4, drop_remainder=False, tile_rows=8, **kwargs)
+
+    def predict(self, **kwargs):
+        model = self.model(**kwargs)
+        predictions = list(tf.estimator.Estimator(model.model_fn, model_dir=self.model_dir).predict(model.input_fn))
+        self.assertLen(predictions, 10)
+        return {key: np.stack([item[key] for item in predictions]) for key in predictions[0]}
+
+    def test_skip_threshold(self):
+        with self.assertRaises(ValueError):
+            self.model(skip_threshold=1.0)
+
+        full = self.predict()
+        # any frame is a key frame below the smallest difference, the network runs on every frame as without skipping
+        every = self.predict(skip_threshold=1e-6)
+        self.assertFalse(np.any(every['skipped']))
+        self.assertAllClose(every['kernel'], full['kernel'], atol=1e-5)
+
+        # only the first frame of the movie is a key frame, the two batches after its own have none and reuse its
+        # kernel, carried over between the batches
+        first = self.predict(skip_threshold=0.99, skip_eval=True)
+        self.assertAllEqual(first['skipped'], [False] + [True] * 9)
+        for kernel in first['kernel']:
+            self.assertAllClose(kernel, full['kernel'][0], atol=1e-5)
+        self.assertAllClose(first['left_pred'][0], full['left_pred'][0], atol=1e-5)
+        # skip_eval compares to the network run on every frame
+        self.assertAllClose(first['skip_error'][0], 0.0, atol=1e-5)
+        self.assertAllClose(first['skip_error'], np.abs(first['left_pred'] - full['left_pred']).mean(axis=(1, 2, 3)),
+                            atol=1e-5)
+        self.assertGreater(first['skip_error'][-1], 0.0)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,132 @@
+import cv2
+import csv
+import time
+import numpy as np
+from absl import logging
+from typing import Callable, Dict, List, Sequence
+
+from deep3d.data import Shape
+from deep3d.instrument import instruments
+
+
+def scale_view(view: Shape, scale: float, multiple: int = 8) -> Shape:
+  """`view` times `scale` rounded to a multiple of `multiple`, the network pools three times and needs one of 8."""
+  return Shape(max(multiple, int(view.high * scale / multiple + 0.5) * multiple),
+               max(multiple, int(view.width * scale / multiple + 0.5) * multiple))
+
+
+def detail(gray: np.ndarray) -> float:
+  """The mean absolute horizontal plus vertical gradient of a gray view in gray levels, 0 for a flat frame."""
+  gray = gray.astype(np.int16)
+  return float(np.abs(np.diff(gray, axis=1)).mean() + np.abs(np.diff(gray, axis=0)).mean())
+
+
+class ScalePicker(object):
+  """Picks the scale of the network input for each frame from the detail of its left view.
+
+  `scales` go from coarse to fine with one of the ascending `thresholds` between each two of them: a frame whose
+  detail is above the i-th threshold gets at least the (i + 1)-th scale. The detail is measured on the left view
+  resized to `view`, the one at scale 1, so the thresholds do not depend on the scale it is read at. A pick holds for
+  the scene, until the thumbnail of the left view is more than `scene_threshold` gray levels away in mean from the one
+  of the frame it was made on, like skip_threshold does for kernels; 0 picks for every frame. Each pick is kept in
+  `decisions` with the detail it was made on, the frames of its scene and the seconds spent picking and in the trunk
+  for them.
+  """
+
+  def __init__(self, scales: Sequence[float], thresholds: Sequence[float], scene_threshold: float = 0.0,
+               view: Shape = None, thumbnail: Shape = Shape(36, 64)):
+    if len(thresholds) != len(scales) - 1:
+      raise ValueError(f'{len(scales)} scales need {len(scales) - 1} thresholds, not {len(thresholds)}')
+    if list(scales) != sorted(scales) or list(thresholds) != sorted(thresholds):
+      raise ValueError(f'scales {scales} and thresholds {thresholds} go from coarse to fine')
+    self.scales = list(scales)
+    self.thresholds = list(thresholds)
+    self.scene_threshold = scene_threshold
+    self._view = view
+    self._thumbnail = thumbnail
+    self._reference = None
+    self._frames = 0
+    self.decisions = []
+
+  def __call__(self, gray: np.ndarray) -> Dict:
+    """The decision for the next frame of the movie, from its [height, width] uint8 left view."""
+    start = time.time()
+    thumbnail = None
+    if self.scene_threshold > 0:
+      thumbnail = cv2.resize(gray, (self._thumbnail.width, self._thumbnail.high),
+                             interpolation=cv2.INTER_AREA).astype(np.float32)
+    if thumbnail is not None and self.decisions and np.abs(thumbnail - self._reference).mean() <= self.scene_threshold:
+      decision = self.decisions[-1]
+    else:
+      if self._view is not None and gray.shape != self._view:
+        level = detail(cv2.resize(gray, (self._view.width, self._view.high), interpolation=cv2.INTER_AREA))
+      else:
+        level = detail(gray)
+      decision = {'frame': self._frames, 'detail': level,
+                  'scale': self.scales[int(np.searchsorted(self.thresholds, level, side='right'))],
+                  'frames': 0, 'pick_seconds': 0.0, 'trunk_seconds': 0.0}
+      self.decisions.append(decision)
+      self._reference = thumbnail
+    decision['frames'] += 1
+    decision['pick_seconds'] += time.time() - start
+    self._frames += 1
+    return decision
+
+
+def report_scales(decisions: List[Dict], file_name: str = None):
+  """Logs every decision of a ScalePicker with its timings and the frames at each scale, and writes them as csv."""
+  for decision in decisions:
+    logging.info(f'frame {decision["frame"]}: detail {decision["detail"]:.2f}, scale {decision["scale"]:g} for '
+                 f'{decision["frames"]} frames, {1000 * decision["pick_seconds"]:.2f}ms picking, '
+                 f'{decision["trunk_seconds"]:.2f}s in the trunk')
+  for scale in sorted({decision['scale'] for decision in decisions}):
+    scene = [decision for decision in decisions if decision['scale'] == scale]
+    frames, seconds = sum(d['frames'] for d in scene), sum(d['trunk_seconds'] for d in scene)
+    logging.info(f'scale {scale:g}: {len(scene)} decisions, {frames} frames, {frames / max(seconds, 1e-6):.1f} fps')
+  if file_name:
+    with open(file_name, 'w', newline='') as f:
+      writer = csv.DictWriter(f, fieldnames=['frame', 'detail', 'scale', 'frames', 'pick_seconds', 'trunk_seconds'])
+      writer.writeheader()
+      writer.writerows(decisions)
+
+
+def multiscale_predict(trunk: Callable[[np.ndarray], np.ndarray], picker: ScalePicker, view: Shape, batch_size: int,
+                       report_file: str = None):
+  """`predict` for deep3d.tiling.tiled_predict: the kernel logits of `trunk` at the scale `picker` picks each frame.
+
+  `view` is the view at scale 1. The frames are read at the finest scale and their features shrunk to coarser ones,
+  `trunk` takes any size that scale_view gives and the kernels come out at that size, which DeepDot stretches onto
+  the origin. Consecutive frames at one scale share a batch, a batch ends early where the scale changes, and the
+  frames keep their order. Every decision is reported once the frames run out.
+  """
+  stages = {scale: instruments.new_stage(f'inference x{scale:g}') for scale in picker.scales}
+
+  def run(scale: float, batch: List) -> Dict[str, np.ndarray]:
+    shape = scale_view(view, scale)
+    # preprocessed like Deep3dModel.input_fn
+    features = np.stack([feature if feature.shape[:2] == shape else
+                         cv2.resize(feature, (shape.width, shape.high), interpolation=cv2.INTER_AREA)
+                         for feature, _ in batch]).astype(np.float32) / 255.0
+    stage = stages[scale]
+    busy = stage.busy
+    with stage.work():
+      logits = trunk(features)
+    stage.frames += len(batch)
+    for _, decision in batch:
+      decision['trunk_seconds'] += (stage.busy - busy) / len(batch)
+    return {'kernel': logits}
+
+  def predict(frames):
+    batch, scale = [], None
+    for frame in frames():
+      decision = picker(frame['feature'][..., 0])
+      if batch and (decision['scale'] != scale or len(batch) == batch_size):
+        yield run(scale, batch)
+        batch = []
+      scale = decision['scale']
+      batch.append((frame['feature'], decision))
+    if batch:
+      yield run(scale, batch)
+    report_scales(picker.decisions, report_file)
+
+  return predict
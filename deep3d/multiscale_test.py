@@ -0,0 +1,84 @@
+import os
+import csv
+import numpy as np
+import tensorflow as tf
+
+from deep3d.data import Shape
+from deep3d.multiscale import ScalePicker, detail, multiscale_predict, scale_view
+from deep3d.quantize import FloatTrunk
+from deep3d.synthetic import TinyNetwork, UniformTrunk
+from deep3d.tiling import TiledComposer, tiled_predict
+
+
+def frame(level: int, height: int = 48, width: int = 64, seed: int = 0, base: int = 128):
+    # a flat frame for level 0, noise of `level` gray levels around `base` otherwise
+    rng = np.random.RandomState(seed)
+    gray = np.clip(base + rng.randint(-level, level + 1, size=(height, width)), 0, 255).astype(np.uint8)
+    return {'feature': np.stack([gray] * 3, axis=-1), 'origin': rng.randint(0, 256, size=(40, 56, 3)).astype(np.uint8)}
+
+
+class MultiScaleTest(tf.test.TestCase):
+    def test_scale_view(self):
+        self.assertEqual(scale_view(Shape(256, 224), 1.0), Shape(256, 224))
+        self.assertEqual(scale_view(Shape(256, 224), 0.5), Shape(128, 112))
+        self.assertEqual(scale_view(Shape(256, 224), 1.5), Shape(384, 336))
+        self.assertEqual(scale_view(Shape(128, 448), 0.3), Shape(40, 136))
+        self.assertEqual(scale_view(Shape(16, 16), 0.1), Shape(8, 8))
+
+    def test_picker(self):
+        self.assertEqual(detail(frame(0)['feature'][..., 0]), 0.0)
+        with self.assertRaises(ValueError):
+            ScalePicker([0.5, 1.0], [10, 20])
+        with self.assertRaises(ValueError):
+            ScalePicker([1.0, 0.5], [10])
+
+        picker = ScalePicker([0.5, 1.0, 1.5], [5, 50])
+        scales = [picker(frame(level)['feature'][..., 0])['scale'] for level in [0, 10, 100, 0]]
+        self.assertEqual(scales, [0.5, 1.0, 1.5, 0.5])
+        self.assertLen(picker.decisions, 4)
+
+        # a pick holds until the scene changes, the detail is measured at the view of scale 1: the noise averages out
+        # there and the frames get the middle scale rather than the finest
+        picker = ScalePicker([0.5, 1.0, 1.5], [5, 50], scene_threshold=20, view=Shape(24, 32))
+        for level, seed, base in [(40, 0, 128), (40, 1, 128), (40, 2, 128), (0, 0, 64), (40, 3, 64)]:
+            picker(frame(level, 96, 128, seed, base)['feature'][..., 0])
+        self.assertGreater(detail(frame(40, 96, 128)['feature'][..., 0]), 50)
+        self.assertEqual([(decision['frame'], decision['frames']) for decision in picker.decisions], [(0, 3), (3, 2)])
+        self.assertEqual([decision['scale'] for decision in picker.decisions], [1.0, 0.5])
+
+    def test_multiscale_predict(self):
+        frames = [frame(level, seed=index) for index, level in enumerate([0, 0, 0, 10, 10, 0, 100, 100, 100])]
+        trunk = UniformTrunk()
+        report_file = os.path.join(self.get_temp_dir(), 'scales.csv')
+        picker = ScalePicker([0.5, 1.0, 1.5], [5, 50])
+        predict = multiscale_predict(trunk, picker, Shape(32, 40), batch_size=2, report_file=report_file)
+        composer = TiledComposer(4, softmax=True)
+        outputs = list(tiled_predict(predict, composer, lambda item: item['origin'])(lambda: iter(frames)))
+
+        # a batch ends where the scale changes, the frames keep their order
+        self.assertEqual(trunk.shapes, [(2, 16, 24, 3), (1, 16, 24, 3), (2, 32, 40, 3), (1, 16, 24, 3),
+                                  (2, 48, 64, 3), (1, 48, 64, 3)])
+        self.assertLen(outputs, len(frames))
+        for output, item in zip(outputs, frames):
+            self.assertAllEqual(output['origin'][0], item['origin'])
+            # uniform kernels stretched from any scale compose like the one at the view
+            self.assertAllEqual(output['origin_pred'][0], composer(item['origin'], np.zeros((32, 40, 16), np.float32)))
+        with open(report_file) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([float(row['scale']) for row in rows], [0.5, 0.5, 0.5, 1, 1, 0.5, 1.5, 1.5, 1.5])
+        self.assertTrue(all(float(row['trunk_seconds']) > 0 for row in rows))
+
+    def test_float_trunk_any_size(self):
+        model_dir = os.path.join(self.get_temp_dir(), 'ckpt')
+        with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+            TinyNetwork().logits(tf.compat.v1.placeholder(tf.float32, shape=(None, 32, 40, 3)))
+            sess.run(tf.compat.v1.global_variables_initializer())
+            tf.compat.v1.train.Saver().save(sess, os.path.join(model_dir, 'model.ckpt'))
+
+        trunk = FloatTrunk(TinyNetwork(), model_dir, any_size=True)
+        for shape in [(16, 24), (32, 40), (48, 64)]:
+            self.assertEqual(trunk(np.zeros((2,) + shape + (3,), dtype=np.float32)).shape, (2,) + shape + (16,))
+
+
+if __name__ == '__main__':
+    tf.test.main()
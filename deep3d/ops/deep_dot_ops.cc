@@ -4,24 +4,75 @@
 using namespace tensorflow;
 
 REGISTER_OP("DeepDot")
-    .Input("origin: float")
-    .Input("kernel: float")
-    .Output("composed: float")
+    .Input("origin: T")
+    .Input("kernel: T")
+    .Output("composed: T")
+    .Attr("T: {half, bfloat16, float} = DT_FLOAT")
     .Attr("kernel_size: int")
+    .Attr("interpolation: {'nearest', 'bilinear'} = 'nearest'")
     .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
         c->set_output(0, c->input(0));
         return Status::OK();
     });
 
 REGISTER_OP("GradDeepDot")
-    .Input("grad_composed: float")
-    .Input("origin: float")
-    .Input("kernel: float")
-    .Output("grad_origin: float")
-    .Output("grad_kernel: float")
+    .Input("grad_composed: T")
+    .Input("origin: T")
+    .Input("kernel: T")
+    .Output("grad_origin: T")
+    .Output("grad_kernel: T")
+    .Attr("T: {half, bfloat16, float} = DT_FLOAT")
     .Attr("kernel_size: int")
+    .Attr("interpolation: {'nearest', 'bilinear'} = 'nearest'")
     .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
         c->set_output(0, c->input(1));
         c->set_output(1, c->input(2));
         return Status::OK();
-    });
\ No newline at end of file
+    });
+
+REGISTER_OP("SoftmaxDeepDot")
+    .Input("origin: T")
+    .Input("logits: T")
+    .Output("composed: T")
+    .Attr("T: {half, bfloat16, float} = DT_FLOAT")
+    .Attr("kernel_size: int")
+    .Attr("interpolation: {'nearest', 'bilinear'} = 'nearest'")
+    .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+        c->set_output(0, c->input(0));
+        return Status::OK();
+    });
+
+REGISTER_OP("GradSoftmaxDeepDot")
+    .Input("grad_composed: T")
+    .Input("origin: T")
+    .Input("logits: T")
+    .Output("grad_origin: T")
+    .Output("grad_logits: T")
+    .Attr("T: {half, bfloat16, float} = DT_FLOAT")
+    .Attr("kernel_size: int")
+    .Attr("interpolation: {'nearest', 'bilinear'} = 'nearest'")
+    .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+        c->set_output(0, c->input(1));
+        c->set_output(1, c->input(2));
+        return Status::OK();
+    });
+
+// DeepDot on a uint8 origin, dequantized by `scale` inside the op. With out_type uint8 the result
+// stays in the 0-255 domain of the origin and is rounded straight into the output, `scale` unused.
+// With softmax the kernel holds logits, as in SoftmaxDeepDot.
+REGISTER_OP("QuantizedDeepDot")
+    .Input("origin: uint8")
+    .Input("kernel: T")
+    .Output("composed: out_type")
+    .Attr("T: {half, bfloat16, float} = DT_FLOAT")
+    .Attr("out_type: {uint8, float} = DT_FLOAT")
+    .Attr("kernel_size: int")
+    .Attr("interpolation: {'nearest', 'bilinear'} = 'nearest'")
+    .Attr("softmax: bool = false")
+    .Attr("scale: float = 0.00392156862745098")
+    .Attr("row_offset: int = 0")
+    .Attr("full_height: int = 0")
+    .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+        c->set_output(0, c->input(0));
+        return Status::OK();
+    });
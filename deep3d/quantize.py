@@ -0,0 +1,163 @@
+import cv2
+import itertools
+import numpy as np
+import tensorflow as tf
+from absl import logging
+from typing import Callable, Dict, Iterator, List
+
+from deep3d.instrument import instruments
+from deep3d.tiling import TiledComposer
+
+
+def _features(frames: List[Dict[str, np.ndarray]]) -> np.ndarray:
+  # the float features of a batch of frames, preprocessed like Deep3dModel.input_fn
+  return np.stack([frame['feature'] for frame in frames]).astype(np.float32) / 255.0
+
+
+class FloatTrunk(object):
+  """The network of a Deep3dModel up to the kernel logits, restored from the latest checkpoint of `model_dir`.
+
+  It runs in a graph and session of its own, model.py predicts in graph mode with the Estimator graph finalized. The
+  softmax is left out, it stays in float with DeepDot when the trunk is quantized. Batches of any size go through it
+  unless `batch_size` is set, and features of any size with `any_size`, see deep3d.multiscale.
+  """
+
+  def __init__(self, model, model_dir: str, batch_size: int = None, any_size: bool = False):
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      height, width = (None, None) if any_size else (model.frame_reader.height, model.frame_reader.width)
+      self.feature = tf.compat.v1.placeholder(tf.float32, shape=(batch_size, height, width, 3), name='feature')
+      self.logits = model.logits(self.feature)
+      self._session = tf.compat.v1.Session(graph=self._graph)
+      tf.compat.v1.train.Saver().restore(self._session, tf.train.latest_checkpoint(model_dir))
+
+  def __call__(self, features: np.ndarray) -> np.ndarray:
+    return self._session.run(self.logits, {self.feature: features})
+
+  def to_int8(self, representative: Callable[[], Iterator[np.ndarray]]) -> bytes:
+    """The trunk as a TFLite model with INT8 weights and activations, their ranges calibrated on `representative`.
+
+    Its input and output stay float, the model quantizes the features and dequantizes the logits itself. Convert a
+    trunk of batch_size 1: the XNNPACK delegate of the interpreter only takes the static shapes that gives.
+    """
+    converter = tf.compat.v1.lite.TFLiteConverter.from_session(self._session, [self.feature], [self.logits])
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: ([feature] for feature in representative())
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+class Int8Trunk(object):
+  """Runs a trunk quantized by FloatTrunk.to_int8 on batches of float features, one frame at a time."""
+
+  def __init__(self, tflite_model: bytes, num_threads: int = None):
+    self._interpreter = tf.lite.Interpreter(model_content=tflite_model, num_threads=num_threads)
+    self._interpreter.allocate_tensors()
+    self._input = self._interpreter.get_input_details()[0]['index']
+    self._output = self._interpreter.get_output_details()[0]['index']
+
+  @classmethod
+  def load(cls, file_name: str, num_threads: int = None) -> 'Int8Trunk':
+    with tf.io.gfile.GFile(file_name, 'rb') as f:
+      return cls(f.read(), num_threads)
+
+  def _invoke(self, feature: np.ndarray) -> np.ndarray:
+    self._interpreter.set_tensor(self._input, feature[np.newaxis])
+    self._interpreter.invoke()
+    return self._interpreter.get_tensor(self._output)[0]
+
+  def __call__(self, features: np.ndarray) -> np.ndarray:
+    return np.stack([self._invoke(feature) for feature in features])
+
+
+def calibration_features(frame_reader, num_frames: int) -> Iterator[np.ndarray]:
+  """One [1, height, width, 3] feature from each of `num_frames` equal parts of the movie of `frame_reader`.
+
+  The third frame of each part is taken, so its temporal stack holds the two frames before it rather than black.
+  The frames are sought to in one FrameGenerator of this process, a ParallelFrameGenerator would start its decoder
+  processes over again for every one of them.
+  """
+  with frame_reader.in_process() as reader:
+    length = reader.frame_count
+    for index in range(num_frames):
+      start, stop = length * index // num_frames, length * (index + 1) // num_frames
+      if start == stop:
+        continue
+      frame = next(reader.seek(min(start + 2, stop - 1)), None)
+      if frame is not None:
+        yield _features([frame])
+
+
+def trunk_predict(trunk: Callable[[np.ndarray], np.ndarray], batch_size: int):
+  """`predict` for deep3d.tiling.tiled_predict: the kernel logits of `trunk` for batches of the frames."""
+
+  def predict(frames):
+    batch = []
+    for frame in frames():
+      batch.append(frame)
+      if len(batch) == batch_size:
+        yield {'kernel': trunk(_features(batch))}
+        batch = []
+    if batch:
+      yield {'kernel': trunk(_features(batch))}
+
+  return predict
+
+
+def mse(image: np.ndarray, reference: np.ndarray) -> float:
+  return float(np.mean((image.astype(np.float64) - reference.astype(np.float64)) ** 2))
+
+
+def psnr(mean_squared_error: float) -> float:
+  return float('inf') if mean_squared_error == 0 else float(10 * np.log10(255.0 ** 2 / mean_squared_error))
+
+
+def ssim(image: np.ndarray, reference: np.ndarray) -> float:
+  # the SSIM of Wang et al. with its 11x11 gaussian window of sigma 1.5, averaged over the channels
+  c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+  x, y = image.astype(np.float64), reference.astype(np.float64)
+  blur = lambda image: cv2.GaussianBlur(image, (11, 11), 1.5)
+  mu_x, mu_y = blur(x), blur(y)
+  sigma_x, sigma_y, sigma_xy = blur(x * x) - mu_x ** 2, blur(y * y) - mu_y ** 2, blur(x * y) - mu_x * mu_y
+  ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (sigma_x + sigma_y + c2))
+  return float(ssim_map.mean())
+
+
+def compare(float_trunk: FloatTrunk, int8_trunk: Int8Trunk, composer: TiledComposer, frame_reader,
+            origin_fn: Callable, num_frames: int, batch_size: int) -> Dict[str, float]:
+  """The PSNR and SSIM of the INT8 origin_pred against the float one, and the frames per second of both trunks.
+
+  Both run on the first `num_frames` frames of `frame_reader`, and their logits are composed alike by `composer`,
+  so what differs is the quantization alone.
+  """
+  stages = {name: instruments.new_stage(f'inference {name}') for name in ['float', 'int8']}
+  trunks = {'float': float_trunk, 'int8': int8_trunk}
+  errors, ssims = [], []
+  frames, num_compared = iter(frame_reader), 0
+  while num_compared < num_frames:
+    batch = list(itertools.islice(frames, min(batch_size, num_frames - num_compared)))
+    if not batch:
+      break
+    features = _features(batch)
+    if num_compared == 0:
+      # the first call starts the session and allocates the interpreter, it is not timed
+      for trunk in trunks.values():
+        trunk(features)
+    num_compared += len(batch)
+    logits = {}
+    for name, trunk in trunks.items():
+      with stages[name].work():
+        logits[name] = trunk(features)
+      stages[name].frames += len(batch)
+    for frame, float_logits, int8_logits in zip(batch, logits['float'], logits['int8']):
+      origin = origin_fn(frame)
+      reference = composer(origin, float_logits)
+      origin_pred = composer(origin, int8_logits)
+      errors.append(mse(origin_pred, reference))
+      ssims.append(ssim(origin_pred, reference))
+  # the PSNR of the mean error over all the frames, a frame the quantization left intact would be an infinite one
+  result = {'psnr': psnr(float(np.mean(errors))), 'ssim': float(np.mean(ssims)),
+            'float_fps': stages['float'].fps, 'int8_fps': stages['int8'].fps}
+  logging.info(f'INT8 origin_pred against float over {num_compared} frames: {result["psnr"]:.2f}dB PSNR, '
+               f'{result["ssim"]:.4f} SSIM, trunk at {result["int8_fps"]:.1f} fps against {result["float_fps"]:.1f}')
+  return result
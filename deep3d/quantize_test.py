@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import tensorflow as tf
+
+from deep3d.model_lib import Deep3dModel
+from deep3d.quantize import FloatTrunk, Int8Trunk, calibration_features, compare, mse, psnr, ssim, trunk_predict
+from deep3d.synthetic import TinyNetwork, stereo_video
+from deep3d.tiling import TiledComposer
+
+
+class QuantizeTest(tf.test.TestCase):
+    def test_psnr_ssim(self):
+        rng = np.random.RandomState(0)
+        image = rng.randint(0, 256, size=(32, 48, 3)).astype(np.uint8)
+        noisy, noisier = [np.clip(image + rng.normal(scale=scale, size=image.shape), 0, 255).astype(np.uint8)
+                          for scale in [4, 32]]
+        self.assertEqual(psnr(mse(image, image)), float('inf'))
+        self.assertAllClose(psnr(255.0 ** 2 / 100), 20.0)
+        self.assertAllClose(ssim(image, image), 1.0)
+        self.assertGreater(psnr(mse(noisy, image)), psnr(mse(noisier, image)))
+        self.assertLess(ssim(noisier, image), ssim(noisy, image))
+        self.assertLess(ssim(noisy, image), 1.0)
+
+    def test_int8_trunk(self):
+        file_name = os.path.join(self.get_temp_dir(), 'quantize.mp4')
+        stereo_video(file_name, num_frames=8, height=64, width=56)
+        model = TinyNetwork(file_name)
+        # a checkpoint of the network from random weights, as training would leave in model_dir
+        model_dir = os.path.join(self.get_temp_dir(), 'ckpt')
+        with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+            model.logits(tf.compat.v1.placeholder(tf.float32, shape=(None, 256, 224, 3)))
+            sess.run(tf.compat.v1.global_variables_initializer())
+            tf.compat.v1.train.Saver().save(sess, os.path.join(model_dir, 'model.ckpt'))
+
+        float_trunk = FloatTrunk(model, model_dir)
+        tflite_model = FloatTrunk(model, model_dir, batch_size=1).to_int8(
+            lambda: calibration_features(model.frame_reader, 4))
+        int8_trunk = Int8Trunk(tflite_model)
+
+        kernels = list(trunk_predict(int8_trunk, batch_size=3)(lambda: iter(model.frame_reader)))
+        self.assertEqual([len(batch['kernel']) for batch in kernels], [3, 3, 2])
+        self.assertEqual(kernels[0]['kernel'].shape[1:], (256, 224, 16))
+
+        # the movie read again from its start
+        movie = TinyNetwork(file_name)
+        result = compare(float_trunk, int8_trunk, TiledComposer(4, softmax=True), movie.frame_reader,
+                         lambda frame: frame['origin'], num_frames=4, batch_size=2)
+        self.assertGreater(result['psnr'], 35)
+        self.assertGreater(result['ssim'], 0.95)
+        self.assertGreater(result['int8_fps'], 0)
+
+    def test_float_trunk_checkpoint(self):
+        file_name = os.path.join(self.get_temp_dir(), 'checkpoint.mp4')
+        stereo_video(file_name, num_frames=4, height=64, width=56)
+        # tile_rows leaves the origin out of predict, which then returns the kernels
+        model = Deep3dModel(file_name, 4, batch_size=4, tile_rows=8)
+        model_dir = os.path.join(self.get_temp_dir(), 'model')
+        estimator = tf.estimator.Estimator(model.model_fn, model_dir=model_dir)
+        estimator.train(model.input_fn, steps=1)
+
+        # the trunk restores the variables model_fn trained and gives its kernels before the softmax
+        model = Deep3dModel(file_name, 4, batch_size=4, tile_rows=8)
+        kernels = np.stack([item['kernel'] for item in estimator.predict(model.input_fn)])
+        trunk = FloatTrunk(Deep3dModel(file_name, 4), model_dir)
+        features = np.stack([item['feature'] for item in Deep3dModel(file_name, 4).frame_reader]) / 255.0
+        self.assertAllClose(tf.nn.softmax(trunk(features.astype(np.float32))), kernels, atol=1e-5)
+
+
+if __name__ == '__main__':
+    tf.test.main()
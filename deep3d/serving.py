@@ -0,0 +1,40 @@
+from absl import flags, app
+
+from deep3d.convert import convert
+from deep3d.data import RawFrameGenerator, VideoType
+from deep3d.instrument import instruments
+from deep3d.serving_lib import StereoRunner
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('export_dir', '/Users/fitz/data/code/deep3d/export', 'SavedModel written by model.py --mode=export')
+flags.DEFINE_string('file_name', '/Volumes/data/baidu/Avatar_3D.mkv', 'input movie file_name')
+flags.DEFINE_string('output_file', '/Volumes/data/baidu/carrier2.mp4', 'the converted 3D movie')
+flags.DEFINE_enum('vt', 'lr3d', ['simple', 'lr3d', 'ud3d'], 'video_type the model was exported with')
+flags.DEFINE_bool('jit', False, 'compile the graph around DeepDot with XLA auto clustering')
+flags.DEFINE_integer('queue_size', 64, 'decoded frames buffered ahead of inference')
+flags.DEFINE_enum('encoder', 'cv2', ['cv2', 'ffmpeg'], 'ffmpeg encodes with libx264 and muxes the audio of file_name')
+flags.DEFINE_integer('crf', 18, 'constant quality of the ffmpeg encoder, lower is better')
+flags.DEFINE_string('preset', 'medium', 'x264 preset of the ffmpeg encoder')
+flags.DEFINE_enum('layout', None, ['sbs', 'tb', 'anaglyph'], 'output layout, sbs for color and anaglyph for gray '
+                  'when not set')
+flags.DEFINE_string('report_file', '', 'where to write the stage timers, queue depths and peak RSS of the run, as csv '
+                   'for .csv and json otherwise, empty for none')
+flags.DEFINE_bool('trace', False, 'annotate the pipeline stages in the TensorFlow profiler trace')
+
+
+def main(_):
+  instruments.trace = FLAGS.trace
+  runner = StereoRunner(FLAGS.export_dir, jit=FLAGS.jit)
+  frame_reader = RawFrameGenerator(FLAGS.file_name, video_type=VideoType[FLAGS.vt.upper()],
+                                   origin_type=runner.origin_type)
+  writer_options = {}
+  if FLAGS.encoder == 'ffmpeg':
+    writer_options = {'backend': 'ffmpeg', 'audio': FLAGS.file_name, 'crf': FLAGS.crf, 'preset': FLAGS.preset}
+  convert(runner.predict, frame_reader, FLAGS.output_file, runner.origin_type, queue_size=FLAGS.queue_size,
+          writer_options=writer_options, layout=FLAGS.layout)
+  if FLAGS.report_file:
+    instruments.write(FLAGS.report_file)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,70 @@
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from absl import logging
+from typing import Dict
+
+import deep3d.deep_dot  # registers DeepDot, which the SavedModel refers to
+from deep3d.data import OriginType
+
+
+def latest_export(export_dir: str) -> str:
+  # export_saved_model writes into a timestamped directory under export_dir
+  if tf.saved_model.contains_saved_model(export_dir):
+    return export_dir
+  versions = [name for name in tf.io.gfile.listdir(export_dir) if name.strip('/').isdigit()]
+  if not versions:
+    raise ValueError(f'no SavedModel in {export_dir}')
+  return os.path.join(export_dir, max(versions, key=lambda name: int(name.strip('/'))))
+
+
+class StereoRunner(object):
+  """Runs an exported Deep3D model on batches of uint8 frames, without the Estimator.
+
+  The SavedModel is loaded once and called through a tf.function with the fixed shape of its signature. The runner
+  carries the context, the left views of the last two frames, from one call to the next, so consecutive batches of a
+  movie get the same temporal stack as in training. Call `reset` before another movie.
+  """
+
+  def __init__(self, export_dir: str, jit: bool = False):
+    if jit:
+      # DeepDot has no XLA kernel, auto clustering compiles the convolutions around it
+      tf.config.optimizer.set_jit('autoclustering')
+    start = time.time()
+    self._loaded = tf.saved_model.load(latest_export(export_dir))
+    signature = self._loaded.signatures['serving_default']
+    inputs = signature.structured_input_signature[1]
+    self.batch_size, self.height, self.width = inputs['frames'].shape.as_list()[:3]
+    self.origin_type = OriginType.COLOR if signature.structured_outputs['left'].shape[-1] == 3 else OriginType.GRAY
+    self._run = tf.function(lambda frames, context: signature(frames=frames, context=context),
+                            input_signature=[inputs['frames'], inputs['context']])
+    self._context_shape = inputs['context'].shape
+    self.reset()
+    logging.info(f'loaded {export_dir} in {time.time() - start:.2f}s')
+
+  def reset(self):
+    self._context = tf.zeros(self._context_shape, dtype=tf.uint8)
+
+  def __call__(self, frames: np.ndarray) -> Dict[str, np.ndarray]:
+    """The left and right views of up to batch_size consecutive [height, width, 3] BGR frames."""
+    num_frames = len(frames)
+    if num_frames < self.batch_size:
+      # the end of the movie, the context after the padding is never used
+      frames = np.concatenate([frames, np.zeros((self.batch_size - num_frames,) + frames.shape[1:], frames.dtype)])
+    outputs = self._run(frames, self._context)
+    self._context = outputs['context']
+    return {'left': outputs['left'].numpy()[:num_frames], 'right': outputs['right'].numpy()[:num_frames]}
+
+  def predict(self, frames):
+    """`predict` for deep3d.convert: runs over the {'frame': ...} items of a generator function."""
+    batch = []
+    for frame in frames():
+      batch.append(frame['frame'])
+      if len(batch) == self.batch_size:
+        views = self(np.stack(batch))
+        yield {'origin': views['left'], 'origin_pred': views['right']}
+        batch = []
+    if batch:
+      views = self(np.stack(batch))
+      yield {'origin': views['left'], 'origin_pred': views['right']}
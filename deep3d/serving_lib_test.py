@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import tensorflow as tf
+
+from deep3d.model_lib import Deep3dModel
+from deep3d.serving_lib import StereoRunner, latest_export
+from deep3d.synthetic import read_frames, stereo_video
+
+
+class ServingTest(tf.test.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # a movie of 7 frames, the second batch of 4 is padded
+        cls.temp_dir = tf.compat.v1.test.get_temp_dir()
+        cls.file_name = os.path.join(cls.temp_dir, 'serving.mp4')
+        stereo_video(cls.file_name, 7, height=64, width=56)
+        cls.model = Deep3dModel(cls.file_name, 4, batch_size=4, drop_remainder=False, raw_frames=True,
+                                uint8_origin=True)
+        cls.estimator = tf.estimator.Estimator(cls.model.model_fn, model_dir=os.path.join(cls.temp_dir, 'ckpt'))
+        cls.estimator.train(cls.model.input_fn, steps=1)
+        cls.export_dir = os.path.join(cls.temp_dir, 'export')
+        cls.estimator.export_saved_model(cls.export_dir, cls.model.serving_input_receiver_fn)
+
+    def test_latest_export(self):
+        version = latest_export(self.export_dir)
+        self.assertEqual(os.path.dirname(version), self.export_dir)
+        self.assertEqual(latest_export(version), version)
+        with self.assertRaises(ValueError):
+            latest_export(self.temp_dir)
+
+    def test_runner(self):
+        runner = StereoRunner(self.export_dir)
+        self.assertEqual((runner.batch_size, runner.height, runner.width), (4, 64, 112))
+        frames = np.stack(read_frames(self.file_name))
+        outputs = list(runner.predict(lambda: iter({'frame': frame} for frame in frames)))
+        self.assertEqual([len(output['origin']) for output in outputs], [4, 3])
+
+        # the Estimator runs the same graph on the whole movie, its temporal stack carries across the batches
+        model = Deep3dModel(self.file_name, 4, batch_size=4, drop_remainder=False, raw_frames=True, uint8_origin=True)
+        expected = list(self.estimator.predict(model.input_fn))
+        self.assertLen(expected, 7)
+        left = np.concatenate([output['origin'] for output in outputs])
+        right = np.concatenate([output['origin_pred'] for output in outputs])
+        self.assertAllEqual(left, np.stack([item['origin'] for item in expected]))
+        self.assertAllClose(right, np.stack([item['origin_pred'] for item in expected]), atol=1)
+
+        # the context carried into the next batch is the left views of the last two frames, reset starts a movie over
+        runner.reset()
+        self.assertAllEqual(runner(frames[:4])['right'], right[:4])
+        views = np.stack([np.round(item['left'][..., 0] * 255) for item in expected[2:4]]).astype(np.uint8)
+        self.assertAllEqual(runner._context, views)
+        runner.reset()
+        self.assertAllEqual(runner._context, np.zeros_like(views))
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,29 @@
+import tensorflow as tf
+from typing import Tuple
+
+
+def thumbnail(left: tf.Tensor, factor: int = 4) -> tf.Tensor:
+  """Average pooled [batch, height / factor, width / factor, 1] left views, what frames are compared on."""
+  return tf.nn.avg_pool2d(tf.cast(left, tf.float32), ksize=factor, strides=factor, padding='VALID')
+
+
+def select_key_frames(thumbnails: tf.Tensor, reference: tf.Tensor, has_reference: tf.Tensor,
+                      threshold: float) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+  """Which frames of a batch need their own kernel, and which kernel each frame uses.
+
+  A frame is a key frame when the mean absolute difference of its thumbnail to the thumbnail of the last key frame,
+  `reference` to start with, is above `threshold`, in the units of the thumbnails. Comparing to the last key frame
+  rather than to the previous frame keeps slow pans from drifting away one small step at a time. Without
+  `has_reference` there is no key frame before the batch and its first frame is one for any threshold. Returns the
+  key frame mask, the kernel index of each frame, 0 for the kernel of the key frame before the batch and i for the
+  i-th key frame of the batch, and the reference for the next batch.
+  """
+
+  def step(state, current):
+    last, count, has_last = state
+    is_key = tf.logical_or(tf.logical_not(has_last), tf.reduce_mean(tf.abs(current - last)) > threshold)
+    return tf.where(is_key, current, last), count + tf.cast(is_key, tf.int32), tf.constant(True)
+
+  references, counts, _ = tf.scan(step, thumbnails, initializer=(reference, tf.constant(0), has_reference))
+  is_key = counts > tf.concat([[0], counts[:-1]], axis=0)
+  return is_key, counts, references[-1]
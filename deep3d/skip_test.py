@@ -0,0 +1,36 @@
+import numpy as np
+import tensorflow as tf
+
+from deep3d.skip import thumbnail, select_key_frames
+
+
+class SkipTest(tf.test.TestCase):
+    def test_thumbnail(self):
+        left = np.arange(2 * 8 * 8).reshape(2, 8, 8, 1).astype(np.float32)
+        thumbnails = thumbnail(left, factor=4)
+        self.assertEqual(thumbnails.shape, (2, 2, 2, 1))
+        self.assertAllClose(thumbnails[0, 0, 0, 0], np.mean(left[0, :4, :4]))
+
+    def test_select_key_frames(self):
+        # a static shot, a slow pan and a cut
+        levels = [0.5, 0.5, 0.51, 0.52, 0.53, 0.9, 0.9]
+        thumbnails = tf.constant([np.full((2, 2, 1), level) for level in levels], dtype=tf.float32)
+        is_key, kernel_index, reference = select_key_frames(thumbnails, tf.zeros((2, 2, 1)), False, threshold=0.025)
+        self.assertAllEqual(is_key, [True, False, False, False, True, True, False])
+        self.assertAllEqual(kernel_index, [1, 1, 1, 1, 2, 3, 3])
+        self.assertAllClose(reference, np.full((2, 2, 1), 0.9))
+
+        # the next batch starts from the reference of this one
+        is_key, kernel_index, _ = select_key_frames(thumbnails[-2:], reference, True, threshold=0.025)
+        self.assertAllEqual(is_key, [False, False])
+        self.assertAllEqual(kernel_index, [0, 0])
+
+        # the first frame of a movie is a key frame whatever the threshold
+        is_key, kernel_index, reference = select_key_frames(thumbnails, tf.zeros((2, 2, 1)), False, threshold=1.0)
+        self.assertAllEqual(is_key, [True, False, False, False, False, False, False])
+        self.assertAllEqual(kernel_index, [1] * 7)
+        self.assertAllClose(reference, np.full((2, 2, 1), 0.5))
+
+
+if __name__ == '__main__':
+    tf.test.main()
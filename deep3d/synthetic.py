@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+import tensorflow as tf
+from typing import List
+
+from deep3d.data import FrameGenerator
+from deep3d.decode import VideoType
+
+
+def stereo_video(file_name: str, num_frames: int, height: int = 1080, width: int = 960,
+                 video_type: VideoType = VideoType.LR3D, disparity: int = 8, fps: float = 24, seed: int = 0,
+                 fourcc: str = 'mp4v'):
+  """Writes a synthetic stereo movie of `num_frames` frames with `height` x `width` eyes.
+
+  The scene is smooth noise panning 3 pixels a frame, and the right eye is the left eye shifted `disparity` pixels
+  to the right, so the movie has a depth to learn and compresses like footage rather than like white noise. LR3D
+  puts the eyes side by side, UD3D above each other, and SIMPLE writes the left eye alone. MJPG as `fourcc` makes
+  every frame a keyframe, so seeking is exact.
+  """
+  rng = np.random.RandomState(seed)
+  scene_width = width + disparity + 3 * num_frames
+  scene = cv2.resize(rng.randint(0, 256, size=(height // 8 + 1, scene_width // 8 + 1, 3)).astype(np.uint8),
+                     dsize=(scene_width, height), interpolation=cv2.INTER_CUBIC)
+  if video_type == VideoType.LR3D:
+    size = (2 * width, height)
+  elif video_type == VideoType.UD3D:
+    size = (width, 2 * height)
+  else:
+    size = (width, height)
+
+  writer = cv2.VideoWriter(file_name, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+  try:
+    for i in range(num_frames):
+      start = 3 * i
+      left = scene[:, start + disparity:start + disparity + width]
+      right = scene[:, start:start + width]
+      if video_type == VideoType.LR3D:
+        writer.write(np.concatenate([left, right], axis=1))
+      elif video_type == VideoType.UD3D:
+        writer.write(np.concatenate([left, right], axis=0))
+      else:
+        writer.write(np.ascontiguousarray(left))
+  finally:
+    writer.release()
+
+
+def read_frames(file_name: str) -> List[np.ndarray]:
+  """Every frame of a movie as decoded, in order."""
+  vc = cv2.VideoCapture(file_name)
+  frames = []
+  try:
+    while True:
+      ret, frame = vc.read()
+      if not ret:
+        return frames
+      frames.append(frame)
+  finally:
+    vc.release()
+
+
+class TinyNetwork(object):
+  """A fully convolutional stand-in for Deep3dModel.logits with 16 kernel logits, small enough for a test.
+
+  With `file_name` it has the frame_reader of that movie too, which is what deep3d.quantize reads of a model.
+  """
+
+  def __init__(self, file_name: str = None):
+    self.frame_reader = FrameGenerator(file_name) if file_name else None
+
+  def logits(self, feature: tf.Tensor) -> tf.Tensor:
+    data = tf.keras.layers.Conv2D(8, (3, 3), padding='same', activation='relu', name='conv1')(feature)
+    data = tf.keras.layers.MaxPooling2D()(data)
+    data = tf.keras.layers.Conv2DTranspose(16, (4, 4), strides=(2, 2), padding='same', name='emit')(data)
+    return tf.keras.layers.Conv2D(16, (3, 3), padding='same', name='logits')(data)
+
+
+class UniformTrunk(object):
+  """A trunk of uniform kernel logits, 16 zeros per pixel, failing once `fail_after` batches went through.
+
+  The shape of every batch of features it took is kept in `shapes`.
+  """
+
+  def __init__(self, fail_after: int = None):
+    self.fail_after = fail_after
+    self.shapes = []
+
+  def __call__(self, features: np.ndarray) -> np.ndarray:
+    if self.fail_after is not None and len(self.shapes) == self.fail_after:
+      raise RuntimeError('trunk failed')
+    self.shapes.append(features.shape)
+    return np.zeros(features.shape[:3] + (16,), dtype=np.float32)
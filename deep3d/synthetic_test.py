@@ -0,0 +1,31 @@
+import os
+import numpy as np
+import tensorflow as tf
+
+from deep3d.decode import VideoType
+from deep3d.synthetic import read_frames, stereo_video
+
+
+class SyntheticTest(tf.test.TestCase):
+    def _frames(self, video_type: VideoType):
+        file_name = os.path.join(self.get_temp_dir(), f'{video_type.name.lower()}.mp4')
+        stereo_video(file_name, num_frames=3, height=64, width=96, video_type=video_type, disparity=8)
+        return [frame.astype(np.float32) for frame in read_frames(file_name)]
+
+    def test_stereo_video(self):
+        for video_type, shape in [(VideoType.LR3D, (64, 192, 3)), (VideoType.UD3D, (128, 96, 3))]:
+            frames = self._frames(video_type)
+            self.assertEqual(len(frames), 3)
+            self.assertEqual(frames[0].shape, shape)
+            if video_type == VideoType.LR3D:
+                left, right = frames[0][:, :96], frames[0][:, 96:]
+            else:
+                left, right = frames[0][:64], frames[0][64:]
+            # the right eye is the left eye 8 pixels to the right, up to compression
+            shifted = np.mean(np.abs(right[:, 8:] - left[:, :-8]))
+            self.assertLess(shifted, 4)
+            self.assertGreater(np.mean(np.abs(right - left)), 2 * shifted)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,78 @@
+import collections
+import numpy as np
+import tensorflow as tf
+from typing import Callable
+
+from deep3d.deep_dot import quantized_deep_dot
+
+
+class TiledComposer(object):
+  """Applies DeepDot to a full resolution uint8 frame in strips of `tile_rows` rows, straight into a uint8 frame.
+
+  Each strip is read with the rows of its halo, the kernel_size // 2 rows above and the rows below that the window
+  reaches, and QuantizedDeepDot samples the kernel as it would for the whole frame, so the output is exactly the one
+  of a single call. Only one strip is ever converted or accumulated, memory stays bounded by `tile_rows` times the
+  width whatever the resolution, next to the uint8 frames themselves.
+  """
+
+  def __init__(self, kernel_size: int, interpolation: str = 'nearest', softmax: bool = False, tile_rows: int = 64):
+    self.kernel_size = kernel_size
+    self.interpolation = interpolation
+    self.softmax = softmax
+    self.tile_rows = tile_rows
+    # the window of DeepDot covers rows h - kernel_size // 2 to h + kernel_size - kernel_size // 2 - 1
+    self._above = kernel_size // 2
+    self._below = kernel_size - kernel_size // 2 - 1
+    # a graph of its own, model.py predicts in graph mode with the Estimator graph finalized
+    self._graph = tf.Graph()
+    self._session = tf.compat.v1.Session(graph=self._graph)
+    self._strips = {}
+
+  def _strip(self, first: int, rows: int, height: int, dtype: np.dtype):
+    # row_offset and full_height are attrs, there is one op for each strip position of a frame height
+    key = (first, rows, height, dtype)
+    if key not in self._strips:
+      with self._graph.as_default():
+        origin = tf.compat.v1.placeholder(tf.uint8, shape=(1, rows, None, None))
+        kernel = tf.compat.v1.placeholder(tf.as_dtype(dtype), shape=(1, None, None, None))
+        composed = quantized_deep_dot(origin, kernel, kernel_size=self.kernel_size, interpolation=self.interpolation,
+                                      softmax=self.softmax, out_type=tf.uint8, row_offset=first, full_height=height)
+      self._strips[key] = origin, kernel, composed
+    return self._strips[key]
+
+  def __call__(self, origin: np.ndarray, kernel: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """The composed [height, width, channel] uint8 frame of a uint8 origin and its [h, w, depth] kernel."""
+    height = origin.shape[0]
+    out = np.empty_like(origin) if out is None else out
+    kernel = np.asarray(kernel)[np.newaxis]
+    for top in range(0, height, self.tile_rows):
+      bottom = min(top + self.tile_rows, height)
+      first, last = max(top - self._above, 0), min(bottom + self._below, height)
+      origin_strip, kernel_input, composed = self._strip(first, last - first, height, kernel.dtype)
+      strip = self._session.run(composed, {origin_strip: origin[np.newaxis, first:last], kernel_input: kernel})
+      out[top:bottom] = strip[0, top - first:bottom - first]
+    return out
+
+
+def tiled_predict(predict: Callable, composer: TiledComposer, origin_fn: Callable) -> Callable:
+  """Wraps `predict` of deep3d.convert that returns kernels instead of composed frames.
+
+  The full resolution origins never enter the graph. `origin_fn` takes them from the frames on their way to `predict`,
+  they wait as uint8 until the kernel of their batch comes out and `composer` writes their right view, and the
+  frames are handed on one at a time.
+  """
+
+  def predict_tiled(frames):
+    origins = collections.deque()
+
+    def tee():
+      for frame in frames():
+        origins.append(origin_fn(frame))
+        yield frame
+
+    for batch in predict(tee):
+      for kernel in batch['kernel']:
+        origin = origins.popleft()
+        yield {'origin': origin[np.newaxis], 'origin_pred': composer(origin, kernel)[np.newaxis]}
+
+  return predict_tiled
@@ -0,0 +1,44 @@
+import numpy as np
+import tensorflow as tf
+
+from deep3d.deep_dot import quantized_deep_dot
+from deep3d.tiling import TiledComposer, tiled_predict
+
+
+class TilingTest(tf.test.TestCase):
+    def test_tiled_composer(self):
+        rng = np.random.RandomState(0)
+        origin = rng.randint(0, 255, size=(50, 36, 3)).astype(np.uint8)
+        for kernel_size in [3, 4]:
+            for interpolation in ['nearest', 'bilinear']:
+                logits = rng.normal(size=(13, 11, kernel_size ** 2)).astype(np.float32)
+                expected = quantized_deep_dot(origin[np.newaxis], logits[np.newaxis], kernel_size=kernel_size,
+                                              interpolation=interpolation, softmax=True, out_type=tf.uint8)
+                composer = TiledComposer(kernel_size, interpolation=interpolation, softmax=True, tile_rows=7)
+                self.assertAllEqual(composer(origin, logits), expected[0])
+
+    def test_tiled_predict(self):
+        origins = [np.full((8, 6, 3), i, dtype=np.uint8) for i in range(5)]
+        # a uniform kernel over the 2x2 window, the composed frame is the origin where the window is inside it
+        kernel = np.full((4, 3, 4), 0.25, dtype=np.float32)
+
+        def predict(frames):
+            batch = []
+            for frame in frames():
+                batch.append(frame['left'])
+                if len(batch) == 2:
+                    yield {'kernel': np.stack([kernel] * len(batch))}
+                    batch = []
+            if batch:
+                yield {'kernel': np.stack([kernel] * len(batch))}
+
+        frames = lambda: ({'origin': origin, 'left': origin[:4, :3, :1]} for origin in origins)
+        predictions = list(tiled_predict(predict, TiledComposer(2, tile_rows=3), lambda frame: frame['origin'])(frames))
+        self.assertLen(predictions, 5)
+        for origin, prediction in zip(origins, predictions):
+            self.assertAllEqual(prediction['origin'][0], origin)
+            self.assertAllEqual(prediction['origin_pred'][0, 1:, 1:], origin[1:, 1:])
+
+
+if __name__ == '__main__':
+    tf.test.main()
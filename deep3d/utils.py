@@ -1,9 +1,16 @@
+import os
 import atexit
+import threading
+import subprocess
 import cv2
-from typing import Tuple, Union
+from typing import Dict, Optional, Tuple, Union
 import contextlib
+import functools
 import numpy as np
 import tensorflow as tf
+from absl import logging
+
+from deep3d.instrument import instruments
 
 
 
@@ -27,27 +34,125 @@ def read_vgg16(ckpt_path: str):
   return params
 
 
-def bilinear(shape):
-  assert shape[0] == shape[1]
-  init = np.empty(shape, dtype='float32')
-  weight = np.empty(shape=(shape[0], shape[1]), dtype='float32')
+def load_vgg16(ckpt_path: str, cache_path: str = None) -> Dict[str, np.ndarray]:
+  """The conv layers read_vgg16 takes, from a small .npz bundle extracted from the checkpoint on first use.
+
+  The bundle defaults to `<ckpt_path without extension>.conv.npz`, it holds only the six layers, a few MB against
+  the 500 MB checkpoint, and loads in milliseconds.
+  """
+  cache_path = cache_path or os.path.splitext(ckpt_path)[0] + '.conv.npz'
+  if os.path.exists(cache_path):
+    with np.load(cache_path) as bundle:
+      return {name.replace('.', '/'): bundle[name] for name in bundle.files}
+
+  params = read_vgg16(ckpt_path)
+  try:
+    # np.savez appends .npz to a name without it, keep the suffix so the rename finds the file
+    temp_path = f'{cache_path}.tmp-{os.getpid()}.npz'
+    np.savez(temp_path, **{name.replace('/', '.'): value for name, value in params.items()})
+    os.replace(temp_path, cache_path)
+  except OSError as e:
+    logging.warning(f'can not cache the vgg16 layers at {cache_path}: {e}')
+  return params
+
 
+def bilinear(shape) -> np.ndarray:
+  """Bilinear upsampling kernel of `shape` [k, k, depth, depth] for Conv2DTranspose, shared and read only."""
+  return _bilinear(tuple(shape))
+
+
+@functools.lru_cache(maxsize=None)
+def _bilinear(shape: Tuple[int, ...]) -> np.ndarray:
+  assert shape[0] == shape[1]
   s = int(shape[0] / 2)
   c = (2 * s - 1 - s % 2) / (2 * s)
   coeff = 1 / abs(s - c)
-  for i in range(shape[0]):
-    for j in range(shape[1]):
-      weight[i, j] = (1 - coeff * i) * (1 - coeff * j)
-
-  for p in range(shape[2]):
-    for q in range(shape[2]):
-      init[:, :, p, q] = weight[:, :]
+  weight = 1 - coeff * np.arange(shape[0])
+  init = np.broadcast_to(np.outer(weight, weight).reshape(shape[:2] + (1,) * (len(shape) - 2)), shape)
+  init = np.ascontiguousarray(init, dtype='float32')
+  init.setflags(write=False)
   return init
 
 
+def ffmpeg_binary() -> str:
+  # the ffmpeg moviepy runs, imageio_ffmpeg ships it with the wheel
+  try:
+    from imageio_ffmpeg import get_ffmpeg_exe
+    return get_ffmpeg_exe()
+  except ImportError:
+    return 'ffmpeg'
+
+
+class FFmpegWriter(object):
+  """A cv2.VideoWriter look-alike that pipes raw BGR frames into an ffmpeg process.
+
+  ffmpeg encodes with `codec` at constant quality `crf` and `preset`, on `threads` threads (0 lets the encoder choose),
+  and muxes the first audio track of `audio` in the same pass, so the movie is written once and needs no compose
+  step. Unlike cv2.VideoWriter a frame of the wrong size is an error rather than silently dropped.
+  """
+
+  def __init__(self, fname: str, fps: float, size: Tuple[int, int], is_color: bool = True,
+               audio: Optional[str] = None, audio_codec: str = 'copy', codec: str = 'libx264', crf: int = 18,
+               preset: str = 'medium', threads: int = 0):
+    self._shape = (size[1], size[0], 3) if is_color else (size[1], size[0])
+    command = [ffmpeg_binary(), '-y', '-v', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24' if is_color else 'gray', '-s', f'{size[0]}x{size[1]}',
+               '-r', str(fps), '-i', '-']
+    if audio:
+      # the trailing ? keeps a movie without audio working
+      command += ['-i', audio, '-map', '0:v:0', '-map', '1:a:0?', '-c:a', audio_codec, '-shortest']
+    command += ['-c:v', codec, '-crf', str(crf), '-preset', preset, '-threads', str(threads),
+                '-pix_fmt', 'yuv420p', fname]
+    self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    # stderr is drained aside as in deep3d.compose.run_ffmpeg, ffmpeg would block on a full stderr pipe while the
+    # frames are written
+    self._errors = []
+    self._drain = threading.Thread(target=lambda: self._errors.append(self._process.stderr.read()), daemon=True)
+    self._drain.start()
+
+  def isOpened(self) -> bool:
+    return self._process.poll() is None
+
+  def write(self, img: np.ndarray):
+    if img.shape != self._shape and img.shape != self._shape + (1,):
+      raise ValueError(f'frame of shape {img.shape} written to a video of {self._shape}')
+    try:
+      self._process.stdin.write(np.ascontiguousarray(img, dtype=np.uint8).data)
+    except BrokenPipeError:
+      # ffmpeg exited, release raises its error
+      self.release()
+      raise RuntimeError('ffmpeg exited before the end of the movie')
+
+  def release(self):
+    if self._process.stdin.closed:
+      return
+    # the frames buffered for a pipe ffmpeg closed are lost either way, what ffmpeg said matters
+    with contextlib.suppress(BrokenPipeError):
+      self._process.stdin.close()
+    self._drain.join()
+    if self._process.wait() != 0:
+      raise RuntimeError(f'ffmpeg failed: {b"".join(self._errors).decode(errors="replace").strip()}')
+
+
+class TimedWriter(object):
+  """A video writer whose writes are timed as the write stage of deep3d.instrument."""
+
+  def __init__(self, writer):
+    self._writer = writer
+    self._stage = instruments.stage('write')
+
+  def write(self, frame: np.ndarray):
+    with self._stage.work():
+      self._writer.write(frame)
+    self._stage.frames += 1
+
+  def __getattr__(self, name):
+    return getattr(self._writer, name)
+
+
 @contextlib.contextmanager
-def save(fname: str, fourcc: Union[int, str], fps: int,
-         size: Tuple[int, int], is_color: bool) -> cv2.VideoWriter:
+def save(fname: str, fourcc: Union[int, str], fps: float,
+         size: Tuple[int, int], is_color: bool, backend: str = 'cv2', **options) -> cv2.VideoWriter:
   '''
   CV_FOURCC('P', 'I', 'M', '1') = MPEG-1 codec
   CV_FOURCC('M', 'J', 'P', 'G') = motion-jpeg codec
@@ -57,14 +162,19 @@ def save(fname: str, fourcc: Union[int, str], fps: int,
   CV_FOURCC('U', '2', '6', '3') = H263 codec
   CV_FOURCC('I', '2', '6', '3') = H263I codec
   CV_FOURCC('F', 'L', 'V', '1') = FLV1 codec
+
+  backend='ffmpeg' ignores fourcc and writes through FFmpegWriter, which takes `options`.
   '''
 
-  if isinstance(fourcc, str):
-    fourcc = cv2.VideoWriter_fourcc(*list(fourcc.upper()))
-  videoWrite = cv2.VideoWriter()
-  videoWrite.open(fname, fourcc, fps, size, is_color)
+  if backend == 'ffmpeg':
+    videoWrite = FFmpegWriter(fname, fps, size, is_color, **options)
+  else:
+    if isinstance(fourcc, str):
+      fourcc = cv2.VideoWriter_fourcc(*list(fourcc.upper()))
+    videoWrite = cv2.VideoWriter()
+    videoWrite.open(fname, fourcc, fps, size, is_color)
 
   try:
-    yield videoWrite
+    yield TimedWriter(videoWrite)
   finally:
     videoWrite.release()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import subprocess
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from deep3d.utils import bilinear, load_vgg16, ffmpeg_binary, save
+
+
+def write_vgg16(ckpt_path: str):
+    # a checkpoint with the names of the VGG16 conv layers, and a layer load_vgg16 leaves out
+    with tf.Graph().as_default():
+        for block_id in range(1, 4):
+            for layer_id in range(1, 3):
+                scope = f'vgg_16/conv{block_id}/conv{block_id}_{layer_id}'
+                tf.compat.v1.get_variable(f'{scope}/weights', initializer=tf.fill([3, 3, 2, 4], float(block_id)))
+                tf.compat.v1.get_variable(f'{scope}/biases', initializer=tf.fill([4], float(layer_id)))
+        tf.compat.v1.get_variable('vgg_16/fc6/weights', initializer=tf.zeros([7, 7, 2, 8]))
+        with tf.compat.v1.Session() as sess:
+            sess.run(tf.compat.v1.global_variables_initializer())
+            tf.compat.v1.train.Saver().save(sess, ckpt_path)
+
+
+class UtilsTest(tf.test.TestCase):
+    def test_bilinear(self):
+        init = bilinear([4, 4, 3, 3])
+        self.assertEqual(init.shape, (4, 4, 3, 3))
+        self.assertEqual(init.dtype, np.float32)
+        self.assertAllClose(init[:, :, 0, 0], np.outer([1, 0.2, -0.6, -1.4], [1, 0.2, -0.6, -1.4]))
+        self.assertAllEqual(init[:, :, 2, 1], init[:, :, 0, 0])
+        self.assertIs(bilinear((4, 4, 3, 3)), init)
+        self.assertFalse(init.flags.writeable)
+
+    def test_load_vgg16(self):
+        ckpt_path = os.path.join(self.get_temp_dir(), 'vgg_16.ckpt')
+        write_vgg16(ckpt_path)
+        params = load_vgg16(ckpt_path)
+        self.assertEqual(len(params), 12)
+        self.assertAllEqual(params['conv3_2/weights'], np.full([3, 3, 2, 4], 3.0))
+        self.assertTrue(os.path.exists(os.path.join(self.get_temp_dir(), 'vgg_16.conv.npz')))
+
+        # the bundle is read without the checkpoint
+        for name in tf.io.gfile.glob(ckpt_path + '*'):
+            os.remove(name)
+        cached = load_vgg16(ckpt_path)
+        self.assertEqual(sorted(cached), sorted(params))
+        self.assertAllEqual(cached['conv1_2/biases'], params['conv1_2/biases'])
+
+    def test_ffmpeg_writer(self):
+        if shutil.which(ffmpeg_binary()) is None:
+            self.skipTest('ffmpeg is not installed')
+        audio = os.path.join(self.get_temp_dir(), 'audio.m4a')
+        subprocess.run([ffmpeg_binary(), '-y', '-v', 'error', '-f', 'lavfi', '-i', 'sine=duration=1', '-c:a', 'aac',
+                        audio], check=True)
+        video = os.path.join(self.get_temp_dir(), 'ffmpeg.mp4')
+        with save(video, 'mp4v', 24, (160, 96), True, backend='ffmpeg', audio=audio, preset='ultrafast') as writer:
+            for i in range(24):
+                writer.write(np.full(shape=(96, 160, 3), fill_value=10 * i, dtype=np.uint8))
+            with self.assertRaises(ValueError):
+                writer.write(np.zeros(shape=(96, 162, 3), dtype=np.uint8))
+
+        vc = cv2.VideoCapture(video)
+        self.assertEqual(vc.get(cv2.CAP_PROP_FRAME_COUNT), 24)
+        vc.set(cv2.CAP_PROP_POS_FRAMES, 12)
+        self.assertAllClose(vc.read()[1], np.full(shape=(96, 160, 3), fill_value=120), atol=6)
+        vc.release()
+        # the audio track came along
+        subprocess.run([ffmpeg_binary(), '-v', 'error', '-i', video, '-map', '0:a:0', '-f', 'null', '-'], check=True)
+
+    def test_ffmpeg_writer_error(self):
+        if shutil.which(ffmpeg_binary()) is None:
+            self.skipTest('ffmpeg is not installed')
+        video = os.path.join(self.get_temp_dir(), 'error.mp4')
+        # ffmpeg exits on the first frame, the small frames after it are buffered when the pipe breaks and its error
+        # is what surfaces
+        with self.assertRaisesRegex(RuntimeError, 'no_such_codec'):
+            with save(video, 'mp4v', 24, (16, 16), True, backend='ffmpeg', codec='no_such_codec') as writer:
+                for _ in range(1000):
+                    writer.write(np.zeros(shape=(16, 16, 3), dtype=np.uint8))
+
+
+if __name__ == '__main__':
+    tf.test.main()